@@ -118,15 +118,8 @@ class CustomerRegistrationForm(UserCreationForm):
         if commit:
             user.save()
             
-            # Get the next available customer ID
-            try:
-                max_id = Customer.objects.order_by('-cust_id').first().cust_id
-            except AttributeError:
-                max_id = 0
-            
-            # Create customer record
+            # Create customer record (id assigned by library.ids)
             customer = Customer.objects.create(
-                cust_id=max_id + 1,
                 fname=self.cleaned_data['first_name'],
                 lname=self.cleaned_data['last_name'],
                 phone=self.cleaned_data['phone'],
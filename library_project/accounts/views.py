@@ -2,13 +2,13 @@ from django.shortcuts import render, redirect
 from django.contrib.auth import login, authenticate, logout
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.db import transaction
 from django.db.models import Q
 from django.contrib.auth.models import User, Group
 from .forms import (
     CustomerRegistrationForm, EmployeeRegistrationForm,
     UserLoginForm, ProfileUpdateForm
 )
+from library.retry import transactional
 from .models import UserProfile
 
 def customer_login(request):
@@ -75,7 +75,7 @@ def logout_view(request):
     messages.success(request, "You have been logged out successfully.")
     return redirect('library:home')
 
-@transaction.atomic
+@transactional
 def register_customer(request):
     """Handle customer registration"""
     if request.user.is_authenticated:
@@ -103,7 +103,7 @@ def register_customer(request):
     return render(request, 'accounts/register.html', {'form': form, 'user_type': 'customer'})
 
 @login_required
-@transaction.atomic
+@transactional
 def register_employee(request):
     """Handle employee registration (admin only)"""
     if not request.user.is_superuser:
@@ -5,6 +5,8 @@ from .models import (
     Sponsor, Individual, Organization, SeminarSponsor,
     StudyRoom, Reservation, Invoice, Payment, Rental
 )
+from .exhibitions import recount_exhibitions
+from .inventory import recount_books
 
 # Register your models here
 @admin.register(Topic)
@@ -28,16 +30,38 @@ class BookCopyInline(admin.TabularInline):
 
 @admin.register(Book)
 class BookAdmin(admin.ModelAdmin):
-    list_display = ('book_id', 'book_name', 'topic', 'available_copies_count')
+    list_display = ('book_id', 'book_name', 'topic', 'available_copies', 'total_copies')
     list_filter = ('topic',)
     search_fields = ('book_name',)
+    readonly_fields = ('available_copies', 'total_copies')
     inlines = [BookAuthorInline, BookCopyInline]
+    
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Copies may have been added, removed or changed through the inline
+        recount_books(Book.objects.filter(book_id=form.instance.book_id))
 
 @admin.register(BookCopy)
 class BookCopyAdmin(admin.ModelAdmin):
     list_display = ('copy_id', 'book', 'status')
     list_filter = ('status',)
     search_fields = ('book__book_name',)
+    
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        book_ids = {obj.book_id}
+        if change and 'book' in form.changed_data:
+            book_ids.add(form.initial['book'])
+        recount_books(Book.objects.filter(book_id__in=book_ids))
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        recount_books(Book.objects.filter(book_id=obj.book_id))
+    
+    def delete_queryset(self, request, queryset):
+        book_ids = set(queryset.values_list('book_id', flat=True))
+        super().delete_queryset(request, queryset)
+        recount_books(Book.objects.filter(book_id__in=book_ids))
 
 @admin.register(Customer)
 class CustomerAdmin(admin.ModelAdmin):
@@ -48,6 +72,7 @@ class CustomerAdmin(admin.ModelAdmin):
 class ExhibitionInline(admin.StackedInline):
     model = Exhibition
     can_delete = False
+    readonly_fields = ('registered_count',)
 
 class SeminarInline(admin.StackedInline):
     model = Seminar
@@ -71,8 +96,9 @@ class EventAdmin(admin.ModelAdmin):
 
 @admin.register(Exhibition)
 class ExhibitionAdmin(admin.ModelAdmin):
-    list_display = ('event', 'expenses')
+    list_display = ('event', 'expenses', 'registered_count')
     search_fields = ('event__event_name',)
+    readonly_fields = ('registered_count',)
 
 @admin.register(ExhibitionAttendance)
 class ExhibitionAttendanceAdmin(admin.ModelAdmin):
@@ -80,6 +106,21 @@ class ExhibitionAttendanceAdmin(admin.ModelAdmin):
     list_filter = ('exhibition',)
     search_fields = ('customer__fname', 'customer__lname', 'exhibition__event__event_name')
 
+    # Keep Exhibition.registered_count in step with edits made here
+    def save_model(self, request, obj, form, change):
+        previous = form.initial.get('exhibition') if change else None
+        super().save_model(request, obj, form, change)
+        recount_exhibitions(Exhibition.objects.filter(pk__in=[obj.exhibition_id, previous]))
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        recount_exhibitions(Exhibition.objects.filter(pk=obj.exhibition_id))
+
+    def delete_queryset(self, request, queryset):
+        exhibition_ids = set(queryset.values_list('exhibition_id', flat=True))
+        super().delete_queryset(request, queryset)
+        recount_exhibitions(Exhibition.objects.filter(pk__in=exhibition_ids))
+
 @admin.register(Seminar)
 class SeminarAdmin(admin.ModelAdmin):
     list_display = ('event', 'est_auth')
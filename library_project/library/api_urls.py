@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import async_views, views
 
 router = DefaultRouter()
 router.register(r'books', views.BookViewSet)
@@ -11,7 +11,13 @@ router.register(r'reservations', views.ReservationViewSet, basename='reservation
 router.register(r'customers', views.CustomerViewSet)
 router.register(r'invoices', views.InvoiceViewSet, basename='invoice')
 router.register(r'payments', views.PaymentViewSet, basename='payment')
+router.register(r'dashboard', views.DashboardViewSet, basename='dashboard')
 
 urlpatterns = [
+    # Async read side of the books and events API, for ASGI deployments
+    path('async/books/', async_views.api_book_list, name='async-book-list'),
+    path('async/books/<int:pk>/', async_views.api_book_detail, name='async-book-detail'),
+    path('async/events/', async_views.api_event_list, name='async-event-list'),
+    path('async/events/<int:pk>/', async_views.api_event_detail, name='async-event-detail'),
     path('', include(router.urls)),
 ] 
\ No newline at end of file
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class LibraryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'library'
+
+    def ready(self):
+        # Register signal handlers that keep derived data in sync
+        from . import (  # noqa: F401
+            availability, book_cache, dashboard, facets, ids, kpis, leaderboard, recommendations, search, stats,
+            typeahead,
+        )
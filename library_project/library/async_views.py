@@ -0,0 +1,259 @@
+"""
+Async versions of the busiest read paths, for ASGI deployments.
+
+The HTML pages (home, book list and detail, events, study rooms) are served
+under ``async/`` and the read side of the books and events API under
+``api/async/``, next to the sync views they mirror. Queries go through
+Django's async ORM, and a view's independent queries are awaited together
+with ``asyncio.gather``. The search index, facet and book detail caches,
+the keyset paginator, template rendering and DRF authentication have no
+async API, so they run through ``sync_to_async``.
+
+Under WSGI these views gain nothing; ``manage.py benchmark_async_views``
+compares their latency under concurrency with the sync views under ASGI.
+
+Django 4.2 runs the async ORM's queries on the request's sync thread, so
+the queries of one request still execute one at a time. What ASGI gains is
+that a request waiting on the database does not hold a worker. Django
+4.2's ``login_required`` and ``request.user`` are sync-only, so the user is
+loaded through ``sync_to_async`` and the login checks are done here. The
+API detail views authenticate alongside their one-row lookup; the list
+views authenticate before building a page.
+"""
+import asyncio
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.http import JsonResponse
+from django.shortcuts import redirect, render
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed, NotFound
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from . import kpis, leaderboard
+from .book_cache import get_book_detail
+from .facets import filter_books, get_facets, normalize_filters
+from .models import Book, Event, Reservation, StudyRoom
+from .pagination import COUNT_ESTIMATE, KeysetPagination, KeysetPaginator
+from .search import search_books
+from .serializers import BookSerializer, EventSerializer
+
+
+async def _list(queryset):
+    return [obj async for obj in queryset]
+
+
+@sync_to_async
+def _user(request):
+    """The authenticated user, or None; reading ``request.user`` queries the session"""
+    return request.user if request.user.is_authenticated else None
+
+
+async def _is_employee(user):
+    return user is not None and await user.groups.filter(name='Employees').aexists()
+
+
+@sync_to_async
+def _render(request, template_name, context):
+    return render(request, template_name, context)
+
+
+# HTML pages
+
+async def home(request):
+    """Async ``views.home``"""
+    user = await _user(request)
+    if await _is_employee(user):
+        return redirect('library:dashboard')
+
+    now = timezone.now()
+    counters, upcoming_events, featured_books, trending_books = await asyncio.gather(
+        sync_to_async(kpis.snapshot)(kpis.PUBLIC_GROUPS),
+        _list(Event.objects.filter(start_dt__gt=now, event_type='E').order_by('start_dt')[:3]),
+        _list(
+            Book.objects.filter(available_copies__gt=0)
+            .select_related('topic').prefetch_related('authors')[:4]
+        ),
+        sync_to_async(leaderboard.top_books)('7d', 5),
+    )
+
+    context = {
+        'total_books': counters['total_books'],
+        'active_rentals': counters['active_rentals'],
+        'available_rooms': counters['available_rooms'],
+        'upcoming_events': upcoming_events,
+        'featured_books': featured_books,
+        'trending_books': trending_books,
+        'is_authenticated': user is not None,
+        'is_employee': False,
+        'is_author': user is not None and 'author_id' in request.session,
+    }
+    return await _render(request, 'home.html', context)
+
+
+async def book_list(request):
+    """Async ``views.book_list``"""
+    user = await _user(request)
+    if user is None:
+        return redirect_to_login(request.get_full_path())
+
+    search_query = request.GET.get('search', '')
+    filters = normalize_filters(
+        search=search_query,
+        topic=request.GET.get('category'),
+        author=request.GET.get('author'),
+        available=request.GET.get('available'),
+    )
+
+    books = Book.objects.select_related('topic').prefetch_related('authors')
+    if search_query:
+        books = await sync_to_async(search_books)(search_query, books)
+    books = filter_books(dict(filters, search=''), books)
+
+    ordering = ('-search_rank', 'book_id') if search_query else ('book_id',)
+    paginator = KeysetPaginator(books, 12, ordering=ordering, count=COUNT_ESTIMATE)
+    page_obj, facets, is_employee = await asyncio.gather(
+        sync_to_async(paginator.get_page)(request.GET.get('cursor')),
+        sync_to_async(get_facets)(filters),
+        _is_employee(user),
+    )
+
+    filter_params = request.GET.copy()
+    filter_params.pop('cursor', None)
+
+    context = {
+        'books': page_obj,
+        'facets': facets,
+        'filters': filters,
+        'filter_query': filter_params.urlencode(),
+        'search_query': search_query,
+        'is_employee': is_employee,
+    }
+    return await _render(request, 'library/book_list.html', context)
+
+
+async def book_detail(request, book_id):
+    """Async ``views.book_detail``"""
+    user = await _user(request)
+    if user is None:
+        return redirect_to_login(request.get_full_path())
+
+    is_employee = await _is_employee(user)
+    detail = await sync_to_async(get_book_detail)(book_id, is_employee)
+    return await _render(request, 'library/book_detail.html', dict(detail, is_employee=is_employee))
+
+
+async def event_list(request):
+    """Async ``views.event_list``"""
+    exhibition_events, seminars = await asyncio.gather(
+        _list(Event.objects.filter(event_type='E').select_related('exhibition').order_by('-start_dt')),
+        _list(Event.objects.filter(event_type='S').order_by('-start_dt')),
+    )
+
+    context = {
+        'exhibitions': exhibition_events,
+        'seminars': seminars,
+        'now': timezone.now(),
+    }
+    return await _render(request, 'library/event_list.html', context)
+
+
+async def study_room_list(request):
+    """Async ``views.study_room_list``; one query for all occupied rooms instead of one per room"""
+    user = await _user(request)
+    if user is None:
+        return redirect_to_login(request.get_full_path())
+
+    now = timezone.now()
+    rooms, occupied = await asyncio.gather(
+        _list(StudyRoom.objects.all()),
+        _list(
+            Reservation.objects.filter(start_dt__lte=now, end_dt__gt=now)
+            .values_list('study_room_id', flat=True).distinct()
+        ),
+    )
+    occupied = set(occupied)
+    for room in rooms:
+        room.is_available = room.room_id not in occupied
+
+    return await _render(request, 'library/study_room_list.html', {'rooms': rooms})
+
+
+# API, read side of BookViewSet and EventViewSet
+
+@sync_to_async
+def _api_user(request):
+    """Authenticate like the API views do; the user, or None"""
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        user = drf_request.user
+    except AuthenticationFailed:
+        return None
+    return user if user.is_authenticated else None
+
+
+def _not_authenticated():
+    return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=403)
+
+
+def _not_found(detail='Not found.'):
+    return JsonResponse({'detail': detail}, status=404)
+
+
+@sync_to_async
+def _book_page(request, queryset, ordering):
+    """One page of books in the body format of ``BookViewSet.list``"""
+    pagination = KeysetPagination()
+    page = pagination.paginate_queryset(queryset, Request(request), SimpleNamespace(keyset_ordering=ordering))
+    return pagination.get_paginated_response(BookSerializer(page, many=True).data).data
+
+
+async def api_book_list(request):
+    """Async ``BookViewSet.list``"""
+    # A page costs more than a detail row, so anonymous requests are turned away first
+    if await _api_user(request) is None:
+        return _not_authenticated()
+
+    search_query = request.GET.get('search', '')
+    books = Book.objects.select_related('topic').prefetch_related('authors')
+    if search_query:
+        books = await sync_to_async(search_books)(search_query, books)
+    ordering = ('-search_rank', 'book_id') if search_query else ('book_id',)
+    try:
+        body = await _book_page(request, books, ordering)
+    except NotFound as e:
+        return _not_found(str(e.detail))
+    return JsonResponse(body)
+
+
+async def api_book_detail(request, pk):
+    """Async ``BookViewSet.retrieve``"""
+    user, book = await asyncio.gather(
+        _api_user(request),
+        Book.objects.select_related('topic').prefetch_related('authors').filter(pk=pk).afirst(),
+    )
+    if user is None:
+        return _not_authenticated()
+    if book is None:
+        return _not_found()
+    # Topic and authors are loaded, so serializing makes no queries
+    return JsonResponse(BookSerializer(book).data)
+
+
+async def api_event_list(request):
+    """Async ``EventViewSet.list``"""
+    if await _api_user(request) is None:
+        return _not_authenticated()
+    return JsonResponse(EventSerializer(await _list(Event.objects.all()), many=True).data, safe=False)
+
+
+async def api_event_detail(request, pk):
+    """Async ``EventViewSet.retrieve``"""
+    user, event = await asyncio.gather(_api_user(request), Event.objects.filter(pk=pk).afirst())
+    if user is None:
+        return _not_authenticated()
+    if event is None:
+        return _not_found()
+    return JsonResponse(EventSerializer(event).data)
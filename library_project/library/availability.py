@@ -0,0 +1,433 @@
+"""
+Live book and study room availability.
+
+Circulation desk screens and the study room list subscribe to
+``availability_stream`` (Server-Sent Events) instead of polling. Writes
+announce what changed; a publisher reads the new state once and pushes it
+to every subscriber:
+
+* ``notify_book`` / ``notify_room`` run when the surrounding transaction
+  commits. They send a notice (``('book', 12)``) through the configured
+  backend. Copy counters (``inventory.adjust_counters``), BookCopy and
+  Rental rows, and reservations all send one.
+* The backend carries notices to every process that has subscribers.
+  ``InProcessBackend`` (the default) stays inside one process;
+  ``FileBackend`` shares notices between processes on one host through an
+  append-only file, which is enough for development and tests. A broker
+  such as Redis pub/sub fits the same two methods, ``start()`` and
+  ``publish()``.
+* In each process one publisher thread collects notices for
+  ``LIBRARY_AVAILABILITY_COALESCE_SECONDS``, reads the current state of
+  everything that changed with one query per kind, on the primary so
+  replication lag can't publish stale numbers, and fans the events out.
+  A thousand subscribers and a burst of checkouts cost one read, not one
+  per subscriber or per poll.
+
+A room also changes status when a reservation starts or ends, with no
+write to announce it. Room events carry ``busy_until`` and
+``next_reserved_at``, and the publisher re-reads each room it has reported
+at the earlier of the two, so those changes are pushed too.
+
+A subscriber that falls ``SUBSCRIBER_QUEUE_SIZE`` events behind is
+dropped; its stream ends and EventSource reconnects, starting with a
+fresh snapshot.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.db.models import Min, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import metrics
+from .db_router import primary
+from .models import Book, BookCopy, Rental, Reservation, StudyRoom
+
+logger = logging.getLogger(__name__)
+
+BOOK = 'book'
+ROOM = 'room'
+
+COALESCE_SECONDS = getattr(settings, 'LIBRARY_AVAILABILITY_COALESCE_SECONDS', 0.25)
+
+# Seconds between keepalive comments on an idle stream
+KEEPALIVE_SECONDS = 15
+
+# Streams end after this long and the browser reconnects, so a connection
+# whose client went away is not held forever
+STREAM_SECONDS = getattr(settings, 'LIBRARY_AVAILABILITY_STREAM_SECONDS', 300)
+
+# How long EventSource waits before reconnecting
+RECONNECT_MS = 3000
+
+SUBSCRIBER_QUEUE_SIZE = 100
+
+READS = 'availability.reads'
+EVENTS = 'availability.events'
+DROPPED = 'availability.dropped_subscribers'
+metrics.register(READS, EVENTS, DROPPED)
+
+
+# Backends
+
+class InProcessBackend:
+    """Delivers notices to subscribers in this process only"""
+
+    def __init__(self):
+        self.deliver = None
+
+    def start(self, deliver):
+        self.deliver = deliver
+
+    def publish(self, notice):
+        if self.deliver is not None:
+            self.deliver(notice)
+
+
+class FileBackend:
+    """Shares notices between the processes of one host through an append-only file"""
+
+    def __init__(self, path=None, poll_interval=0.1):
+        self.path = path or getattr(settings, 'LIBRARY_AVAILABILITY_FILE', '/tmp/library-availability.log')
+        self.poll_interval = poll_interval
+
+    def start(self, deliver):
+        # Only notices published from now on matter
+        with open(self.path, 'a'):
+            pass
+        offset = os.path.getsize(self.path)
+        threading.Thread(target=self._tail, args=(deliver, offset), daemon=True, name='availability-tail').start()
+
+    def _tail(self, deliver, offset):
+        with open(self.path, 'rb') as log:
+            log.seek(offset)
+            buffered = b''
+            while True:
+                chunk = log.read()
+                if not chunk:
+                    time.sleep(self.poll_interval)
+                    continue
+                buffered += chunk
+                *lines, buffered = buffered.split(b'\n')
+                for line in lines:
+                    kind, key = json.loads(line)
+                    deliver((kind, key))
+
+    def publish(self, notice):
+        # One short O_APPEND write per notice, so writers don't interleave
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, json.dumps(notice).encode() + b'\n')
+        finally:
+            os.close(fd)
+
+
+# Current state
+
+def book_events(book_ids):
+    """Availability events for the given books, read with one query"""
+    return [
+        (BOOK, book_id, {'book_id': book_id, 'available_copies': available, 'total_copies': total})
+        for book_id, available, total in Book.objects.filter(book_id__in=book_ids)
+        .values_list('book_id', 'available_copies', 'total_copies')
+    ]
+
+
+def room_events(room_ids=None, boundaries=None):
+    """Availability events for the given rooms (all rooms when None), read with one query.
+
+    ``boundaries``, when given, receives the time each room's status next
+    changes on its own: when its current reservation ends or its next one
+    starts.
+    """
+    now = timezone.now()
+    rooms = StudyRoom.objects.all() if room_ids is None else StudyRoom.objects.filter(room_id__in=room_ids)
+    active = Q(reservation__start_dt__lte=now, reservation__end_dt__gt=now)
+    upcoming = Q(reservation__start_dt__gt=now)
+    events = []
+    for room in rooms.annotate(
+        busy_until=Min('reservation__end_dt', filter=active),
+        next_reserved_at=Min('reservation__start_dt', filter=upcoming),
+    ):
+        boundary = room.busy_until or room.next_reserved_at
+        if boundaries is not None and boundary is not None:
+            boundaries[room.room_id] = boundary
+        events.append((ROOM, room.room_id, {
+            'room_id': room.room_id,
+            'available': room.busy_until is None,
+            'busy_until': room.busy_until.isoformat() if room.busy_until else None,
+            'next_reserved_at': room.next_reserved_at.isoformat() if room.next_reserved_at else None,
+        }))
+    return events
+
+
+# Subscribers and the publisher
+
+class Subscription:
+    """One stream's queue of events, filtered to the books and rooms it asked for.
+
+    ``books``/``rooms`` are sets of ids, or None for every room. Pass the
+    running event loop for an async stream.
+    """
+
+    def __init__(self, books=(), rooms=None, loop=None):
+        self.books = set(books)
+        self.rooms = rooms if rooms is None else set(rooms)
+        self.loop = loop
+        self.queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE) if loop else queue.Queue(SUBSCRIBER_QUEUE_SIZE)
+        self.dropped = False
+
+    def wants(self, kind, key):
+        if kind == BOOK:
+            return key in self.books
+        return self.rooms is None or key in self.rooms
+
+    def put(self, event):
+        if self.loop is None:
+            self._put(event)
+            return
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # The stream's event loop has closed
+            self.dropped = True
+
+    def _put(self, event):
+        if self.dropped:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except (queue.Full, asyncio.QueueFull):
+            self.dropped = True
+            metrics.incr(DROPPED)
+
+    def get(self, timeout):
+        """Next event, or None after ``timeout`` seconds"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    async def aget(self, timeout):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class Broker:
+    """Collects change notices and publishes coalesced events to subscribers"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.subscribers = set()
+        self.pending = {BOOK: set(), ROOM: set()}
+        # Room id -> when its status next changes without a write
+        self.boundaries = {}
+        self.sequence = itertools.count(1)
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.started = False
+
+    def notify(self, kind, key):
+        if key is not None:
+            self.backend.publish((kind, key))
+
+    def receive(self, notice):
+        kind, key = notice
+        with self.lock:
+            if not self.subscribers:
+                return
+            self.pending[kind].add(key)
+            self.changed.notify()
+
+    def subscribe(self, subscription):
+        with self.lock:
+            self.subscribers.add(subscription)
+            if not self.started:
+                self.started = True
+                self.backend.start(self.receive)
+                threading.Thread(target=self._run, daemon=True, name='availability-publisher').start()
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def _wait(self):
+        """Block until something is pending; reservations starting or ending count"""
+        with self.lock:
+            while True:
+                now = timezone.now()
+                for room_id, boundary in list(self.boundaries.items()):
+                    if boundary <= now:
+                        del self.boundaries[room_id]
+                        self.pending[ROOM].add(room_id)
+                if self.pending[BOOK] or self.pending[ROOM]:
+                    return
+                timeout = None
+                if self.boundaries:
+                    timeout = (min(self.boundaries.values()) - now).total_seconds()
+                self.changed.wait(timeout)
+
+    def _schedule(self, boundaries):
+        if boundaries:
+            with self.lock:
+                self.boundaries.update(boundaries)
+                self.changed.notify()
+
+    def _run(self):
+        while True:
+            self._wait()
+            # Let the rest of the burst arrive
+            time.sleep(COALESCE_SECONDS)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Publishing availability failed')
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        """Read the state of everything that changed and send it to the subscribers"""
+        with self.lock:
+            books, rooms = self.pending[BOOK], self.pending[ROOM]
+            self.pending = {BOOK: set(), ROOM: set()}
+            subscribers = list(self.subscribers)
+        if not (books or rooms):
+            return
+
+        events = []
+        boundaries = {}
+        with primary():
+            if books:
+                metrics.incr(READS)
+                events += book_events(books)
+            if rooms:
+                metrics.incr(READS)
+                events += room_events(rooms, boundaries)
+        self._schedule(boundaries)
+
+        for kind, key, data in events:
+            event = (next(self.sequence), kind, data)
+            metrics.incr(EVENTS)
+            for subscription in subscribers:
+                if subscription.wants(kind, key):
+                    subscription.put(event)
+
+    def snapshot(self, subscription):
+        """Current state of what a new subscriber asked for"""
+        boundaries = {}
+        with primary():
+            events = book_events(subscription.books) if subscription.books else []
+            if subscription.rooms is None or subscription.rooms:
+                events += room_events(subscription.rooms, boundaries)
+        self._schedule(boundaries)
+        return [(next(self.sequence), kind, data) for kind, _key, data in events]
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            backend = getattr(settings, 'LIBRARY_AVAILABILITY_BACKEND', 'library.availability.InProcessBackend')
+            _broker = Broker(import_string(backend)())
+        return _broker
+
+
+def notify_book(book_id):
+    """Announce a change to a book's copies once the current transaction commits"""
+    if book_id is not None:
+        transaction.on_commit(lambda: broker().notify(BOOK, book_id))
+
+
+def notify_room(room_id):
+    """Announce a change to a room's reservations once the current transaction commits"""
+    if room_id is not None:
+        transaction.on_commit(lambda: broker().notify(ROOM, room_id))
+
+
+@receiver(post_save, sender=BookCopy)
+@receiver(post_delete, sender=BookCopy)
+def copy_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        notify_book(instance.book_id)
+
+@receiver(post_save, sender=Rental)
+@receiver(post_delete, sender=Rental)
+def rental_changed(sender, instance, raw=False, **kwargs):
+    if raw or instance.book_copy_id is None:
+        return
+    if Rental._meta.get_field('book_copy').is_cached(instance):
+        notify_book(instance.book_copy.book_id)
+    else:
+        notify_book(BookCopy.objects.filter(copy_id=instance.book_copy_id).values_list('book_id', flat=True).first())
+
+@receiver(post_save, sender=Reservation)
+@receiver(post_delete, sender=Reservation)
+def reservation_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        notify_room(instance.study_room_id)
+
+
+def format_event(event):
+    """An event as a Server-Sent Events message"""
+    sequence, kind, data = event
+    return f'id: {sequence}\nevent: {kind}\ndata: {json.dumps(data)}\n\n'
+
+
+def _release_connections():
+    """Close this thread's idle connections; a long stream should not hold one open"""
+    for connection in connections.all(initialized_only=True):
+        if not connection.in_atomic_block:
+            connection.close()
+
+
+def stream(books=(), rooms=None):
+    """Server-Sent Events for a sync (WSGI) response: a snapshot, then changes"""
+    hub = broker()
+    subscription = Subscription(books, rooms)
+    # Subscribe before the snapshot so no change falls between the two
+    hub.subscribe(subscription)
+    try:
+        yield f'retry: {RECONNECT_MS}\n\n'
+        for event in hub.snapshot(subscription):
+            yield format_event(event)
+        _release_connections()
+        ends = time.monotonic() + STREAM_SECONDS
+        while not subscription.dropped and time.monotonic() < ends:
+            event = subscription.get(KEEPALIVE_SECONDS)
+            yield format_event(event) if event else ': keepalive\n\n'
+    finally:
+        hub.unsubscribe(subscription)
+
+
+async def async_stream(books=(), rooms=None):
+    """Server-Sent Events for an async (ASGI) response: a snapshot, then changes"""
+    hub = broker()
+    subscription = Subscription(books, rooms, loop=asyncio.get_running_loop())
+    hub.subscribe(subscription)
+    try:
+        yield f'retry: {RECONNECT_MS}\n\n'
+        for event in await sync_to_async(hub.snapshot)(subscription):
+            yield format_event(event)
+        ends = time.monotonic() + STREAM_SECONDS
+        while not subscription.dropped and time.monotonic() < ends:
+            event = await subscription.aget(KEEPALIVE_SECONDS)
+            yield format_event(event) if event else ': keepalive\n\n'
+    finally:
+        hub.unsubscribe(subscription)
@@ -0,0 +1,141 @@
+"""
+Cached render model for the book detail page.
+
+Everything ``book_detail`` shows about a book (the book with its topic and
+authors, availability, similar books and, for employees, recent rentals)
+is built once and cached under the book's id and version. There are separate
+entries for employees and everyone else. Saving or deleting a Book,
+BookCopy, BookAuthor or Rental bumps the version of the affected book once
+the transaction commits, which orphans the old entries. So does a
+versioned transition of a BookCopy or Rental (returns, losses, payments),
+which sends no ``post_save``.
+
+Recommendations are rebuilt offline without touching those models, so
+entries also expire after ``LIBRARY_BOOK_DETAIL_CACHE_TTL`` seconds.
+
+A version bump only reaches workers that share the cache, so deployments
+with more than one process need a shared cache backend (see ``CACHES`` in
+the settings). In a per-process cache the other workers keep serving their
+entry until it expires.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.http import Http404
+
+from . import metrics
+from .models import Book, BookAuthor, BookCopy, Rental
+from .recommendations import recommended_books
+from .versioning import transitioned
+
+DETAIL_CACHE_TTL = getattr(settings, 'LIBRARY_BOOK_DETAIL_CACHE_TTL', 300)
+
+HITS = 'book_detail_cache.hits'
+MISSES = 'book_detail_cache.misses'
+metrics.register(HITS, MISSES)
+
+
+def _version_key(book_id):
+    return f'library:book:{book_id}:version'
+
+
+def book_version(book_id):
+    return cache.get_or_set(_version_key(book_id), 1, None)
+
+
+def bump_book_version(book_id):
+    try:
+        cache.incr(_version_key(book_id))
+    except ValueError:
+        cache.set(_version_key(book_id), 1, None)
+
+
+def build_book_detail(book_id, is_employee):
+    """Load everything the detail page renders for one book"""
+    try:
+        book = Book.objects.select_related('topic').prefetch_related('authors').get(book_id=book_id)
+    except Book.DoesNotExist:
+        raise Http404('No Book matches the given query.')
+
+    # Books co-borrowed with this one; fall back to the same topic until
+    # the recommendation job has covered it
+    similar_books = recommended_books(book.book_id, limit=3)
+    if not similar_books and book.topic_id is not None:
+        similar_books = list(
+            Book.objects.filter(topic_id=book.topic_id).exclude(book_id=book.book_id)[:3]
+        )
+
+    rental_history = None
+    if is_employee:
+        rental_history = list(
+            Rental.objects.filter(book_copy__book_id=book.book_id)
+            .select_related('customer').order_by('-borrow_date')[:5]
+        )
+
+    return {
+        'book': book,
+        'similar_books': similar_books,
+        'available_copies': book.available_copies,
+        'rental_history': rental_history,
+    }
+
+
+def get_book_detail(book_id, is_employee):
+    """Cached ``build_book_detail``"""
+    role = 'employee' if is_employee else 'public'
+    key = f'library:book_detail:{book_id}:{book_version(book_id)}:{role}'
+    detail = cache.get(key)
+    if detail is None:
+        metrics.incr(MISSES)
+        detail = build_book_detail(book_id, is_employee)
+        cache.set(key, detail, DETAIL_CACHE_TTL)
+    else:
+        metrics.incr(HITS)
+    return detail
+
+
+def invalidate_book_detail(book_id):
+    """Drop a book's cached detail once the current transaction commits"""
+    if book_id is not None:
+        transaction.on_commit(lambda: bump_book_version(book_id))
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_book(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_book_detail(instance.book_id)
+
+@receiver(post_save, sender=BookCopy)
+@receiver(post_delete, sender=BookCopy)
+@receiver(transitioned, sender=BookCopy)
+@receiver(post_save, sender=BookAuthor)
+@receiver(post_delete, sender=BookAuthor)
+def invalidate_book_of_row(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_book_detail(instance.book_id)
+
+@receiver(post_save, sender=Rental)
+@receiver(post_delete, sender=Rental)
+@receiver(transitioned, sender=Rental)
+def invalidate_book_of_rental(sender, instance, raw=False, **kwargs):
+    if raw or instance.book_copy_id is None:
+        return
+    if Rental._meta.get_field('book_copy').is_cached(instance):
+        invalidate_book_detail(instance.book_copy.book_id)
+    else:
+        invalidate_book_detail(
+            BookCopy.objects.filter(copy_id=instance.book_copy_id).values_list('book_id', flat=True).first()
+        )
+
+@receiver(m2m_changed, sender=Book.authors.through)
+def invalidate_books_on_authors_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        invalidate_book_detail(instance.book_id)
+    else:
+        for book_id in pk_set or ():
+            invalidate_book_detail(book_id)
@@ -0,0 +1,77 @@
+"""
+Study room booking.
+
+Checking for an overlapping reservation and then inserting races: two
+requests for the same slot can both find it free. ``book_room`` therefore
+locks the room's PJI_STUDY_ROOM row first, so bookings of one room run one
+at a time while bookings of different rooms do not wait on each other.
+Backends with ``SELECT ... FOR UPDATE`` lock the row that way. Elsewhere
+(SQLite) a no-op UPDATE of the row takes the write lock.
+
+Two reservations overlap when each starts before the other ends. On its
+own that predicate has no lower bound on ``start_dt``, so the
+(study_room, start_dt) index would be scanned from the room's first
+booking. Reservations last at most ``MAX_DURATION``, so an overlapping one
+must also start after ``start_dt - MAX_DURATION``. That bounds the range
+scan to a few rows.
+"""
+from datetime import timedelta
+
+from django.db import connections, router, transaction
+from django.db.models import F
+
+from .models import Reservation, StudyRoom
+
+MIN_DURATION = timedelta(hours=1)
+MAX_DURATION = timedelta(hours=8)
+
+
+class BookingError(Exception):
+    """A reservation that cannot be made as requested"""
+
+
+class RoomUnavailable(BookingError):
+    """The room is already reserved for part of the requested time"""
+
+
+def _lock_room(room_id):
+    """Take the room's row lock for the rest of the transaction; False if there is no such room"""
+    rooms = StudyRoom.objects.filter(room_id=room_id)
+    if connections[router.db_for_write(StudyRoom)].features.has_select_for_update:
+        return rooms.select_for_update().values_list('room_id', flat=True).first() is not None
+    return bool(rooms.update(capacity=F('capacity')))
+
+
+def overlapping(room_id, start_dt, end_dt):
+    """Reservations of a room that overlap [start_dt, end_dt)"""
+    return Reservation.objects.filter(
+        study_room_id=room_id,
+        start_dt__gt=start_dt - MAX_DURATION,
+        start_dt__lt=end_dt,
+        end_dt__gt=start_dt,
+    )
+
+
+def book_room(reservation):
+    """Save a new or rescheduled reservation unless its room is taken.
+
+    ``reservation`` must have its room and times set. Raises BookingError
+    for an unknown room or out-of-range times, and RoomUnavailable when
+    another reservation overlaps.
+    """
+    duration = reservation.end_dt - reservation.start_dt
+    if duration < MIN_DURATION:
+        raise BookingError('Reservation must be at least 1 hour.')
+    if duration > MAX_DURATION:
+        raise BookingError('Reservation cannot exceed 8 hours.')
+
+    with transaction.atomic():
+        if not _lock_room(reservation.study_room_id):
+            raise BookingError('No such study room.')
+        conflicts = overlapping(reservation.study_room_id, reservation.start_dt, reservation.end_dt)
+        if reservation.pk is not None:
+            conflicts = conflicts.exclude(pk=reservation.pk)
+        if conflicts.exists():
+            raise RoomUnavailable('The room is already reserved during this time. Please choose another time.')
+        reservation.save()
+    return reservation
@@ -0,0 +1,245 @@
+"""
+Bulk catalog import.
+
+Reads books from CSV or JSON Lines one row at a time and writes them with
+``bulk_create`` in batches, one transaction per batch. Each row describes a
+book:
+
+* ``title`` (required)
+* ``topic``: topic name, created when unknown
+* ``authors``: author names. In CSV they are separated by ``;``; in JSONL
+  they are a list of names or of ``{"fname", "lname", ...}`` objects.
+  Authors are matched on first and last name and created when unknown.
+* ``copies``: number of copies, all available (default 1)
+
+Topics and authors are resolved through in-memory dictionaries loaded once
+up front, so a row costs no lookups. Primary keys are assigned here rather
+than read back from the database, because MySQL does not return keys from
+bulk inserts. Each batch reserves its id ranges from the id sequence (see
+``library.ids``), the same one the site allocates from.
+
+Search documents are written directly from the imported values. The
+catalog-level caches (typeahead index, facet counts) are invalidated once
+at the end.
+"""
+import csv
+import json
+
+from django.db import transaction
+
+from .db_router import primary
+from .facets import bump_catalog_version
+from .ids import reserve_block
+from .models import Author, Book, BookAuthor, BookCopy, BookSearchDocument, Topic
+from . import kpis, typeahead
+
+DEFAULT_BATCH_SIZE = 5000
+
+AUTHOR_SEPARATOR = ';'
+
+
+class CatalogImportError(ValueError):
+    """A row that cannot be imported; carries its line number"""
+
+    def __init__(self, line, message):
+        super().__init__(f'line {line}: {message}')
+        self.line = line
+
+
+def _split_name(name):
+    parts = name.split()
+    if not parts:
+        return None
+    if len(parts) == 1:
+        return parts[0], ''
+    return ' '.join(parts[:-1]), parts[-1]
+
+
+def _author_spec(value):
+    """Return ``(fname, lname, extra_fields)`` for one author entry"""
+    if isinstance(value, dict):
+        fname = str(value.get('fname', '')).strip()
+        lname = str(value.get('lname', '')).strip()
+        extra = {
+            field: str(value[field])
+            for field in ('email', 'street', 'city', 'state', 'country', 'postal_code')
+            if value.get(field) is not None
+        }
+        return (fname, lname, extra) if fname or lname else None
+    name = _split_name(str(value))
+    return (name[0], name[1], {}) if name else None
+
+
+def _check_length(line, model, field, value, label):
+    """Reject values the column cannot hold; strict MySQL would fail the whole batch on them"""
+    max_length = model._meta.get_field(field).max_length
+    if len(value) > max_length:
+        raise CatalogImportError(line, f'{label} longer than {max_length} characters: {value[:20]!r}...')
+
+
+def _parse_row(line, row):
+    title = (row.get('title') or '').strip()
+    if not title:
+        raise CatalogImportError(line, 'missing title')
+    _check_length(line, Book, 'book_name', title, 'title')
+
+    authors = row.get('authors') or []
+    if isinstance(authors, str):
+        authors = authors.split(AUTHOR_SEPARATOR)
+    authors = [spec for spec in map(_author_spec, authors) if spec]
+    for fname, lname, extra in authors:
+        _check_length(line, Author, 'fname', fname, 'author first name')
+        _check_length(line, Author, 'lname', lname, 'author last name')
+        for field, value in extra.items():
+            _check_length(line, Author, field, value, f'author {field}')
+
+    copies = row.get('copies')
+    try:
+        copies = 1 if copies in (None, '') else int(copies)
+    except (TypeError, ValueError):
+        raise CatalogImportError(line, f'invalid copies value {copies!r}')
+    if copies < 0:
+        raise CatalogImportError(line, 'copies must not be negative')
+
+    topic = (row.get('topic') or '').strip() or None
+    if topic:
+        _check_length(line, Topic, 'topic_name', topic, 'topic')
+    return title, topic, authors, copies
+
+
+def read_rows(stream, fmt):
+    """Yield ``(line_number, row_dict)`` from a CSV or JSONL text stream"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            if line.strip():
+                try:
+                    yield line_number, json.loads(line)
+                except ValueError as e:
+                    raise CatalogImportError(line_number, f'invalid JSON ({e})')
+    else:
+        raise ValueError(f'Unsupported format {fmt!r}')
+
+
+class CatalogImporter:
+    """Streams parsed rows into the catalog tables in batches"""
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+        self.batch_size = batch_size
+        self.progress = progress
+        self.books = 0
+        self.copies = 0
+        self.topics_created = 0
+        self.authors_created = 0
+
+        # From the primary: a lagging replica would make known names look new
+        with primary():
+            self.topic_ids = {
+                name.lower(): topic_id
+                for topic_id, name in Topic.objects.values_list('topic_id', 'topic_name')
+            }
+            self.author_ids = {
+                (fname.lower(), lname.lower()): author_id
+                for author_id, fname, lname in Author.objects.values_list('author_id', 'fname', 'lname')
+            }
+
+    def run(self, rows):
+        """Import ``(line_number, row_dict)`` pairs; returns the number of books created"""
+        batch = []
+        try:
+            for line, row in rows:
+                batch.append(_parse_row(line, row))
+                if len(batch) >= self.batch_size:
+                    self._write(batch)
+                    batch = []
+            if batch:
+                self._write(batch)
+        finally:
+            if self.books:
+                typeahead.index.invalidate()
+                bump_catalog_version()
+                kpis.mark_dirty('catalog')
+        return self.books
+
+    def _reserve_ids(self, batch):
+        """Reserve id blocks covering every row the batch will insert"""
+        topics, authors = set(), set()
+        for _title, topic, specs, _copy_count in batch:
+            if topic and topic.lower() not in self.topic_ids:
+                topics.add(topic.lower())
+            for fname, lname, _extra in specs:
+                if (fname.lower(), lname.lower()) not in self.author_ids:
+                    authors.add((fname.lower(), lname.lower()))
+        copy_count = sum(row[3] for row in batch)
+
+        self.next_topic_id = reserve_block(Topic, len(topics)) if topics else None
+        self.next_author_id = reserve_block(Author, len(authors)) if authors else None
+        self.next_book_id = reserve_block(Book, len(batch))
+        self.next_copy_id = reserve_block(BookCopy, copy_count) if copy_count else None
+
+    def _topic_id(self, name, new_topics):
+        key = name.lower()
+        if key not in self.topic_ids:
+            self.topic_ids[key] = self.next_topic_id
+            new_topics.append(Topic(topic_id=self.next_topic_id, topic_name=name))
+            self.next_topic_id += 1
+        return self.topic_ids[key]
+
+    def _author_id(self, spec, new_authors):
+        fname, lname, extra = spec
+        key = (fname.lower(), lname.lower())
+        if key not in self.author_ids:
+            self.author_ids[key] = self.next_author_id
+            fields = {'street': '', 'city': '', 'country': '', 'postal_code': '', 'email': ''}
+            fields.update(extra)
+            new_authors.append(Author(author_id=self.next_author_id, fname=fname, lname=lname, **fields))
+            self.next_author_id += 1
+        return self.author_ids[key]
+
+    def _write(self, batch):
+        self._reserve_ids(batch)
+        new_topics, new_authors = [], []
+        books, links, copies, documents = [], [], [], []
+
+        for title, topic, authors, copy_count in batch:
+            book_id = self.next_book_id
+            self.next_book_id += 1
+            topic_id = self._topic_id(topic, new_topics) if topic else None
+            books.append(Book(
+                book_id=book_id, book_name=title, topic_id=topic_id,
+                available_copies=copy_count, total_copies=copy_count,
+            ))
+
+            author_ids = []
+            for spec in authors:
+                author_id = self._author_id(spec, new_authors)
+                if author_id not in author_ids:
+                    author_ids.append(author_id)
+                    links.append(BookAuthor(book_id=book_id, author_id=author_id))
+
+            for _ in range(copy_count):
+                copies.append(BookCopy(copy_id=self.next_copy_id, book_id=book_id, status='available'))
+                self.next_copy_id += 1
+
+            keywords = [f'{fname} {lname}' for fname, lname, _extra in authors]
+            if topic:
+                keywords.append(topic)
+            documents.append(BookSearchDocument(book_id=book_id, title=title, keywords=' '.join(keywords)))
+
+        with transaction.atomic():
+            Topic.objects.bulk_create(new_topics, batch_size=self.batch_size)
+            Author.objects.bulk_create(new_authors, batch_size=self.batch_size)
+            Book.objects.bulk_create(books, batch_size=self.batch_size)
+            BookAuthor.objects.bulk_create(links, batch_size=self.batch_size)
+            BookCopy.objects.bulk_create(copies, batch_size=self.batch_size)
+            BookSearchDocument.objects.bulk_create(documents, batch_size=self.batch_size)
+
+        self.books += len(books)
+        self.copies += len(copies)
+        self.topics_created += len(new_topics)
+        self.authors_created += len(new_authors)
+        if self.progress:
+            self.progress(self)
@@ -0,0 +1,119 @@
+"""
+Copy checkout.
+
+Every path that lends out a copy (``borrow_book``, ``rental_create`` and the
+rentals API) claims it here. A claim is a conditional UPDATE,
+
+    UPDATE PJI_BOOK_COPY SET STATUS = 'not available', VERSION = VERSION + 1
+    WHERE COPY_ID = %s AND STATUS = 'available' AND VERSION = %s
+
+which only one of several concurrent transactions can win, so a copy is
+never lent twice. The version condition makes it a versioned transition
+(see library.versioning), so the claim also fails if the copy changed in
+any way since it was read.
+
+When a caller only needs *some* copy of a book, picking one is the hot spot:
+if every request takes the first available copy they all queue on the same
+row. On backends with ``SELECT ... FOR UPDATE SKIP LOCKED`` (MySQL 8,
+MariaDB 10.6, PostgreSQL) each transaction locks the first copy nobody else
+holds and moves on. Elsewhere a handful of candidates is read without
+locking, shuffled, and tried in turn; a lost race just moves on to the next
+candidate.
+
+The claim also moves the book's counters, a row every checkout of the
+title shares. That UPDATE is deferred to the end of the transaction (see
+library.deferred), so concurrent borrowers of one title only queue on
+the book row while each of them commits.
+"""
+import random
+
+from django.db import connections, router, transaction
+from django.db.models import F
+
+from . import metrics
+from .book_cache import invalidate_book_detail
+from .inventory import AVAILABLE, CHECKED_OUT, adjust_counters
+from .models import BookCopy
+
+# Available copies read per attempt when SKIP LOCKED is not supported
+CANDIDATES = 8
+
+CLAIMS = 'checkout.claims'
+CONFLICTS = 'checkout.conflicts'
+UNAVAILABLE = 'checkout.unavailable'
+metrics.register(CLAIMS, CONFLICTS, UNAVAILABLE)
+
+
+class CopyUnavailable(Exception):
+    """No copy could be claimed: none is available, or the one asked for was taken"""
+
+
+def _take(copy_id, book_id, version, status):
+    """Conditionally move one available copy to ``status``.
+
+    Returns the claimed copy, or None when another transaction got there first.
+    """
+    if not BookCopy.objects.filter(copy_id=copy_id, status=AVAILABLE, version=version).update(
+        status=status, version=F('version') + 1
+    ):
+        return None
+    adjust_counters(book_id, available=-1)
+    # update() sends no post_save signal
+    invalidate_book_detail(book_id)
+    metrics.incr(CLAIMS)
+    return BookCopy(copy_id=copy_id, book_id=book_id, status=status, version=version + 1)
+
+
+def supports_skip_locked():
+    connection = connections[router.db_for_write(BookCopy)]
+    return connection.features.has_select_for_update_skip_locked
+
+
+def checkout_copy(book_id, status=CHECKED_OUT):
+    """Claim any available copy of a book and return it.
+
+    Raises CopyUnavailable when every copy is out. Call inside the
+    transaction that records the rental so the claim rolls back with it.
+    """
+    with transaction.atomic():
+        if supports_skip_locked():
+            candidate = (
+                BookCopy.objects.select_for_update(skip_locked=True)
+                .filter(book_id=book_id, status=AVAILABLE)
+                .order_by('copy_id')
+                .values_list('copy_id', 'version')
+                .first()
+            )
+            if candidate is not None:
+                copy_id, version = candidate
+                book_copy = _take(copy_id, book_id, version, status)
+                if book_copy is not None:
+                    return book_copy
+        else:
+            while True:
+                candidates = list(
+                    BookCopy.objects.filter(book_id=book_id, status=AVAILABLE)
+                    .order_by('copy_id')
+                    .values_list('copy_id', 'version')[:CANDIDATES]
+                )
+                if not candidates:
+                    break
+                random.shuffle(candidates)
+                for copy_id, version in candidates:
+                    book_copy = _take(copy_id, book_id, version, status)
+                    if book_copy is not None:
+                        return book_copy
+                    metrics.incr(CONFLICTS)
+
+    metrics.incr(UNAVAILABLE)
+    raise CopyUnavailable('No copies of this book are currently available.')
+
+
+def claim_copy(book_copy, status=CHECKED_OUT):
+    """Claim one particular copy; raises CopyUnavailable if it is no longer available"""
+    if _take(book_copy.copy_id, book_copy.book_id, book_copy.version, status) is None:
+        metrics.incr(CONFLICTS)
+        raise CopyUnavailable('This copy has already been checked out.')
+    book_copy.status = status
+    book_copy.version += 1
+    return book_copy
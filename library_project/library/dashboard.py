@@ -0,0 +1,214 @@
+"""
+Metrics for the management dashboard and ``/api/dashboard/``.
+
+Activity series come from the daily rollup (see library.stats), so each
+is one query over at most a few hundred rows however long the history is:
+the week's rentals, returns and today's reservations from seven daily
+rows, and revenue for the last six calendar months from their daily rows
+grouped with ``TruncMonth``. Days and months without activity come back
+as zero. Popular books come from the leaderboard (see library.leaderboard)
+and invoice totals are cached KPIs (see library.kpis).
+
+The API serves the dashboard as widgets, each with its own series and
+version, so a chart can be refreshed without rendering the page. The
+cache holds the time of the last committed write to the models each
+widget reads, bumped by signals like the KPI generations. A widget's
+version is built from those times and, for widgets over a window ending
+today, the date. Versions are read with one ``get_many`` and no database
+query, so a conditional GET for an unchanged widget is answered with 304
+before any of its queries run.
+
+A write is only seen by workers that share the cache it was recorded in,
+so deployments with more than one process need a shared cache backend
+(see ``CACHES`` in the settings). The times also expire after
+``LIBRARY_DASHBOARD_VERSION_TTL`` seconds, and a missing time reads as
+now. A worker that missed a write, in a per-process cache or after an
+eviction, therefore moves to a new version within that time instead of
+answering 304 for good.
+"""
+import hashlib
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from . import kpis, leaderboard, stats
+from .models import Book, DailyLibraryStats, Invoice, Payment, Rental, Reservation
+from .versioning import transitioned
+
+# Seconds a recorded write time is kept; see the module docstring
+VERSION_TTL = getattr(settings, 'LIBRARY_DASHBOARD_VERSION_TTL', 300)
+
+WEEK_DAYS = 7
+REVENUE_MONTHS = 6
+POPULAR_BOOKS = 5
+POPULAR_WINDOW = '30d'
+
+# Bump when the shape of the API's widget payloads changes
+API_VERSION = 1
+
+
+def add_months(day, months):
+    """The first of the month ``months`` after (or before) ``day``'s month"""
+    index = day.year * 12 + day.month - 1 + months
+    return day.replace(year=index // 12, month=index % 12 + 1, day=1)
+
+
+def monthly_revenue(months, today):
+    """Invoiced amount per calendar month for the last ``months`` months, in one query.
+
+    Returns (labels, amounts), oldest month first, the current month last.
+    """
+    firsts = [add_months(today, -i) for i in range(months - 1, -1, -1)]
+    totals = dict(
+        DailyLibraryStats.objects.filter(stat_date__gte=firsts[0], stat_date__lt=add_months(today, 1))
+        .annotate(month=TruncMonth('stat_date'))
+        .values('month')
+        .annotate(total=Sum('revenue_invoiced'))
+        .values_list('month', 'total')
+    )
+    return (
+        [first.strftime('%b %Y') for first in firsts],
+        [float(totals.get(first) or 0) for first in firsts],
+    )
+
+
+def popular_books(limit=POPULAR_BOOKS):
+    """The books most borrowed in the last ``POPULAR_WINDOW`` as (labels, rental counts)"""
+    labels, data = [], []
+    for book, checkouts in leaderboard.top_books(POPULAR_WINDOW, limit):
+        labels.append(f"{book.book_name[:20]}..." if len(book.book_name) > 20 else book.book_name)
+        data.append(checkouts)
+    return labels, data
+
+
+def dashboard_metrics():
+    """Everything the dashboard charts and tiles show, as plain Python values"""
+    today = timezone.localdate()
+    week = stats.daily(today - timedelta(days=WEEK_DAYS - 1), today + timedelta(days=1))
+    popular_labels, popular_data = popular_books()
+    revenue_labels, revenue_data = monthly_revenue(REVENUE_MONTHS, today)
+    invoices = kpis.snapshot(['invoices'])
+
+    return {
+        'new_rentals_today': week[-1].rentals_opened,
+        'returns_today': week[-1].returns,
+        'reservations_today': week[-1].reservations,
+        'total_invoices': invoices['total_invoices'],
+        'total_revenue': invoices['total_revenue'],
+        'unpaid_invoices': invoices['unpaid_invoices'],
+        'weekly_labels': [row.stat_date.strftime('%a') for row in week],
+        'weekly_rentals': [row.rentals_opened for row in week],
+        'weekly_returns': [row.returns for row in week],
+        'popular_books_labels': popular_labels,
+        'popular_books_data': popular_data,
+        'monthly_revenue_labels': revenue_labels,
+        'monthly_revenue_data': revenue_data,
+    }
+
+
+# Widgets served by /api/dashboard/
+
+def today_widget(today):
+    row = stats.daily(today, today + timedelta(days=1))[0]
+    return {'new_rentals': row.rentals_opened, 'returns': row.returns, 'reservations': row.reservations}
+
+
+def weekly_activity_widget(today):
+    week = stats.daily(today - timedelta(days=WEEK_DAYS - 1), today + timedelta(days=1))
+    return {
+        'labels': [row.stat_date.strftime('%a') for row in week],
+        'rentals': [row.rentals_opened for row in week],
+        'returns': [row.returns for row in week],
+    }
+
+
+def popular_books_widget(today):
+    labels, rentals = popular_books()
+    return {'window': POPULAR_WINDOW, 'labels': labels, 'rentals': rentals}
+
+
+def monthly_revenue_widget(today):
+    labels, revenue = monthly_revenue(REVENUE_MONTHS, today)
+    return {'labels': labels, 'revenue': revenue}
+
+
+def invoices_widget(today):
+    return kpis.snapshot(['invoices'])
+
+
+# Widget -> (function building its payload, models whose writes change it,
+# whether it covers a window ending today)
+WIDGETS = {
+    'today': (today_widget, (Rental, Reservation), True),
+    'weekly_activity': (weekly_activity_widget, (Rental,), True),
+    'popular_books': (popular_books_widget, (Book, Rental), True),
+    'monthly_revenue': (monthly_revenue_widget, (Invoice,), True),
+    'invoices': (invoices_widget, (Invoice, Payment), False),
+}
+
+
+def _modified_key(name):
+    return f'library:dashboard:{name}:modified'
+
+
+def last_writes(names):
+    """Time of the last committed write each widget depends on, as {name: epoch seconds}"""
+    keys = {name: _modified_key(name) for name in names}
+    cached = cache.get_many(keys.values())
+    missing = [name for name in names if keys[name] not in cached]
+    if missing:
+        # Never recorded, or evicted: any earlier version may be out of date
+        now = time.time()
+        for name in missing:
+            cache.add(keys[name], now, VERSION_TTL)
+        cached.update(cache.get_many([keys[name] for name in missing]))
+    return {name: cached[keys[name]] for name in names}
+
+
+def versions(names, today):
+    """({name: version}, last modified datetime) for the widgets ``names``"""
+    writes = last_writes(names)
+    start_of_today = stats.start_of_day(today).timestamp()
+    result = {}
+    modified = 0
+    for name in names:
+        dated = WIDGETS[name][2]
+        result[name] = f'{API_VERSION}.{writes[name]:.6f}' + (f'.{today.isoformat()}' if dated else '')
+        modified = max(modified, writes[name], start_of_today if dated else 0)
+    return result, datetime.fromtimestamp(modified, tz=dt_timezone.utc)
+
+
+def etag(widget_versions):
+    digest = hashlib.sha256(repr(sorted(widget_versions.items())).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def widgets(names, today):
+    """Payloads of the widgets ``names``, by name"""
+    return {name: WIDGETS[name][0](today) for name in names}
+
+
+def touch(name):
+    """Give a widget a new version once the current transaction commits"""
+    transaction.on_commit(lambda: cache.set(_modified_key(name), time.time(), VERSION_TTL))
+
+
+def _record_write(sender, raw=False, **kwargs):
+    if not raw:
+        for name, (_build, models, _dated) in WIDGETS.items():
+            if sender in models:
+                touch(name)
+
+
+for _model in {model for _build, models, _dated in WIDGETS.values() for model in models}:
+    post_save.connect(_record_write, sender=_model, dispatch_uid=f'dashboard_post_save_{_model.__name__}')
+    post_delete.connect(_record_write, sender=_model, dispatch_uid=f'dashboard_post_delete_{_model.__name__}')
+
+transitioned.connect(_record_write, sender=Rental, dispatch_uid='dashboard_transitioned_rental')
@@ -0,0 +1,131 @@
+"""
+Read-replica routing.
+
+Reads of the library app's tables go to one of the aliases listed in
+``LIBRARY_READ_REPLICAS``, picked at random. All writes go to ``default``.
+Reads still go to the primary when:
+
+* the primary has a transaction open, so a transaction reads its own
+  writes and ``select_for_update()`` locks real rows;
+* the code runs under ``use_primary`` / ``primary()``, for views that must
+  never see replication lag;
+* the client wrote recently. ``ReplicaRoutingMiddleware`` sets a cookie
+  after every unsafe request and pins the client's requests to the primary
+  for ``LIBRARY_REPLICA_STICKY_SECONDS``, so a redirect after a POST shows
+  the new rows.
+
+Only the library app's models are routed. Sessions, auth and the other
+contrib apps always use the primary. Replicas get their rows by
+replication, so migrations run only on the primary.
+
+With no replicas configured every query uses ``default``, as before.
+"""
+import contextlib
+import contextvars
+import functools
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+ROUTED_APPS = ('library',)
+
+STICKY_COOKIE = 'library_primary'
+
+_pinned = contextvars.ContextVar('library_pinned_to_primary', default=False)
+
+
+def replicas():
+    return getattr(settings, 'LIBRARY_READ_REPLICAS', [])
+
+
+def sticky_seconds():
+    return getattr(settings, 'LIBRARY_REPLICA_STICKY_SECONDS', 5)
+
+
+@contextlib.contextmanager
+def primary():
+    """Send every read made inside the block to the primary"""
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+def use_primary(view_func):
+    """Pin a view's reads to the primary"""
+    @functools.wraps(view_func)
+    def wrapper(*args, **kwargs):
+        with primary():
+            return view_func(*args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label not in ROUTED_APPS:
+            return DEFAULT_DB_ALIAS
+        aliases = replicas()
+        if not aliases or _pinned.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replicas()
+
+
+class ReplicaRoutingMiddleware:
+    """Keeps a client on the primary while its recent writes replicate.
+
+    Works under WSGI and ASGI alike, so async views are not forced back
+    onto a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def _pins(request):
+        writes = request.method not in ('GET', 'HEAD', 'OPTIONS')
+        return writes, writes or STICKY_COOKIE in request.COOKIES
+
+    @staticmethod
+    def _stick(response):
+        response.set_cookie(STICKY_COOKIE, '1', max_age=sticky_seconds(), httponly=True, samesite='Lax')
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        writes, pinned = self._pins(request)
+        if not pinned:
+            return self.get_response(request)
+
+        with primary():
+            response = self.get_response(request)
+        if writes:
+            self._stick(response)
+        return response
+
+    async def __acall__(self, request):
+        writes, pinned = self._pins(request)
+        if not pinned:
+            return await self.get_response(request)
+
+        with primary():
+            response = await self.get_response(request)
+        if writes:
+            self._stick(response)
+        return response
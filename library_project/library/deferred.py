@@ -0,0 +1,81 @@
+"""
+Hot-row counter updates deferred to the end of the transaction.
+
+Counters that many transactions share, such as a book's copy counters and
+its popularity counts, are kept with ``UPDATE ... SET N = N + %s``. That
+UPDATE locks the row until commit. Once one checkout has touched a
+popular title, every other checkout of it waits for the rest of the first
+transaction, whichever copy SKIP LOCKED handed it.
+
+Inside ``collect()``, ``add()`` queues such updates instead. Deltas are
+merged per row, and the rows are written when the ``collect()`` block
+ends, just before the transaction commits, so their locks are held only
+for the commit itself. Rows are written in sorted key order, so two
+transactions that touch the same rows lock them in the same order.
+``run_in_transaction`` (``@transactional`` views and viewsets) collects
+around every attempt. Outside ``collect()``, ``add()`` writes at once.
+
+Deltas added inside a savepoint that is rolled back are dropped, the way
+Django drops ``on_commit`` callbacks: each ``add()`` registers a no-op
+``on_commit`` marker, and only deltas whose marker survived are written.
+"""
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db import transaction
+
+_state = threading.local()
+
+
+def _pending():
+    return getattr(_state, 'pending', None)
+
+
+def add(key, write, **deltas):
+    """Add ``deltas`` to the row named by ``key``; ``write(key, deltas)`` applies them.
+
+    ``key`` is a tuple starting with the table name; keys are written in
+    sorted order.
+    """
+    pending = _pending()
+    if pending is None or not transaction.get_connection().in_atomic_block:
+        write(key, deltas)
+        return
+
+    def marker():
+        pass
+    transaction.on_commit(marker)
+    pending.append((key, write, deltas, marker))
+
+
+def _flush(pending):
+    live = {id(entry[1]) for entry in transaction.get_connection().run_on_commit}
+    merged = {}
+    for key, write, deltas, marker in pending:
+        if id(marker) in live:
+            merged.setdefault(key, (write, Counter()))[1].update(deltas)
+    for key in sorted(merged):
+        write, deltas = merged[key]
+        deltas = {name: delta for name, delta in deltas.items() if delta}
+        if deltas:
+            write(key, deltas)
+
+
+@contextmanager
+def collect():
+    """Queue ``add()`` calls made in the block and write them when it ends.
+
+    Use inside the transaction, as its last step before commit. Nested
+    blocks join the outermost one.
+    """
+    if _pending() is not None:
+        yield
+        return
+    _state.pending = []
+    try:
+        yield
+        pending, _state.pending = _state.pending, None
+        _flush(pending)
+    finally:
+        _state.pending = None
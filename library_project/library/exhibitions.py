@@ -0,0 +1,92 @@
+"""
+Exhibition registration.
+
+``Exhibition.registered_count`` mirrors the exhibition's PJI_EXH_ATTD rows.
+A registration claims a place with one conditional UPDATE,
+
+    UPDATE PJI_EXHIBITION SET REGISTERED_COUNT = REGISTERED_COUNT + 1
+    WHERE EVENT_ID = %s
+      AND REGISTERED_COUNT < (SELECT ATTD_NO FROM PJI_EVENT WHERE EVENT_ID = %s)
+
+and then inserts the attendance row in the same transaction. When the
+exhibition is full the UPDATE matches nothing, and no registration can
+overfill it however many arrive at once. The unique
+(exhibition, customer) constraint turns a duplicate registration into an
+IntegrityError. That error rolls the claimed place back.
+
+Capacity is compared in a subquery rather than through a join, because
+MySQL runs a joined UPDATE as a SELECT followed by an unconditional UPDATE.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Event, Exhibition, ExhibitionAttendance
+
+
+class RegistrationError(Exception):
+    """A registration or cancellation that cannot be made"""
+
+
+class ExhibitionFull(RegistrationError):
+    pass
+
+
+class AlreadyRegistered(RegistrationError):
+    pass
+
+
+class NotRegistered(RegistrationError):
+    pass
+
+
+def _exhibition(event):
+    if event.event_type != 'E':
+        raise RegistrationError('This event is not an exhibition.')
+    return event.event_id
+
+
+def register(event, customer):
+    """Register a customer for an exhibition; returns the ExhibitionAttendance"""
+    exhibition_id = _exhibition(event)
+    if event.end_dt < timezone.now():
+        raise RegistrationError('This exhibition has already ended.')
+
+    capacity = Subquery(Event.objects.filter(event_id=OuterRef('event_id')).values('attd_no'))
+    with transaction.atomic():
+        claimed = Exhibition.objects.filter(
+            event_id=exhibition_id, registered_count__lt=capacity
+        ).update(registered_count=F('registered_count') + 1)
+        if not claimed:
+            raise ExhibitionFull('Sorry, this exhibition is full.')
+        try:
+            with transaction.atomic():
+                return ExhibitionAttendance.objects.create(exhibition_id=exhibition_id, customer=customer)
+        except IntegrityError:
+            # Leaving the outer block with an exception gives the place back
+            raise AlreadyRegistered('You are already registered for this exhibition.')
+
+
+def unregister(event, customer):
+    """Cancel a customer's registration and free the place"""
+    exhibition_id = _exhibition(event)
+    with transaction.atomic():
+        deleted, _ = ExhibitionAttendance.objects.filter(
+            exhibition_id=exhibition_id, customer=customer
+        ).delete()
+        if not deleted:
+            raise NotRegistered('You are not registered for this exhibition.')
+        Exhibition.objects.filter(event_id=exhibition_id).update(
+            registered_count=F('registered_count') - deleted
+        )
+
+
+def recount_exhibitions(queryset=None):
+    """Recompute ``registered_count`` from the attendance rows in one UPDATE"""
+    if queryset is None:
+        queryset = Exhibition.objects.all()
+    return queryset.update(registered_count=Coalesce(Subquery(
+        ExhibitionAttendance.objects.filter(exhibition=OuterRef('pk'))
+        .order_by().values('exhibition').annotate(count=Count('pk')).values('count')
+    ), 0))
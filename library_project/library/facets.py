@@ -0,0 +1,155 @@
+"""
+Facet counts for the book catalog.
+
+For the active filter set (search text, topic, author, available only) each
+facet dimension is counted with a single grouped query. A dimension ignores
+its own filter, so picking "Fiction" still shows how many books every other
+topic would give, but it does apply all the other filters.
+
+Results are cached per normalized filter set. Catalog edits (books, authors,
+topics, book/author links) bump a version number, and that version is part
+of every cache key. Availability moves with every checkout, so those counts
+are allowed to lag by up to ``LIBRARY_FACET_CACHE_TTL`` seconds.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Author, Book, BookAuthor, Topic
+from .search import matching_book_ids
+
+FACET_CACHE_TTL = getattr(settings, 'LIBRARY_FACET_CACHE_TTL', 60)
+
+# Authors listed in the author facet, most books first
+AUTHOR_FACET_LIMIT = 20
+
+VERSION_KEY = 'library:catalog_version'
+
+
+def catalog_version():
+    return cache.get_or_set(VERSION_KEY, 1, None)
+
+
+def bump_catalog_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+
+
+def _parse_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize_filters(search='', topic=None, author=None, available=False):
+    """Return the canonical form of a filter set; equal filters share cache entries"""
+    return {
+        'search': ' '.join(search.lower().split()),
+        'topic': _parse_id(topic),
+        'author': _parse_id(author),
+        'available': bool(available),
+    }
+
+
+def filter_books(filters, queryset=None, exclude=None):
+    """Apply a normalized filter set, skipping the dimension named in ``exclude``"""
+    if queryset is None:
+        queryset = Book.objects.all()
+    if filters['search']:
+        queryset = queryset.filter(book_id__in=matching_book_ids(filters['search']))
+    if filters['topic'] is not None and exclude != 'topic':
+        queryset = queryset.filter(topic_id=filters['topic'])
+    if filters['author'] is not None and exclude != 'author':
+        queryset = queryset.filter(bookauthor__author_id=filters['author'])
+    if filters['available'] and exclude != 'available':
+        queryset = queryset.filter(available_copies__gt=0)
+    return queryset
+
+
+def compute_facets(filters):
+    """Count books per topic, availability and author for a normalized filter set"""
+    topics = [
+        {'id': row['topic_id'], 'name': row['topic__topic_name'], 'count': row['count']}
+        for row in filter_books(filters, exclude='topic')
+        .order_by().values('topic_id', 'topic__topic_name')
+        .annotate(count=Count('book_id'))
+        .order_by('topic__topic_name')
+        if row['topic_id'] is not None
+    ]
+
+    availability = filter_books(filters, exclude='available').aggregate(
+        total=Count('book_id'),
+        available=Count('book_id', filter=Q(available_copies__gt=0)),
+    )
+
+    author_books = filter_books(filters, exclude='author').order_by()
+    author_rows = (
+        BookAuthor.objects.filter(book__in=author_books.values('book_id'))
+        .values('author_id', 'author__fname', 'author__lname')
+        .annotate(count=Count('book_id', distinct=True))
+        .order_by('-count', 'author__lname', 'author_id')
+    )
+    rows = list(author_rows[:AUTHOR_FACET_LIMIT])
+    selected = filters['author']
+    if selected is not None and all(row['author_id'] != selected for row in rows):
+        # The selected author always gets a row, after the top ones and with no books if need be
+        row = author_rows.filter(author_id=selected).first()
+        if row is None:
+            author = Author.objects.filter(author_id=selected).first()
+            if author is not None:
+                row = {'author_id': selected, 'author__fname': author.fname, 'author__lname': author.lname, 'count': 0}
+        if row is not None:
+            rows.append(row)
+    authors = [
+        {
+            'id': row['author_id'],
+            'name': f"{row['author__fname']} {row['author__lname']}",
+            'count': row['count'],
+        }
+        for row in rows
+    ]
+
+    return {
+        'topics': topics,
+        'availability': availability,
+        'authors': authors,
+    }
+
+
+def get_facets(filters):
+    """Cached ``compute_facets``"""
+    digest = hashlib.md5(json.dumps(filters, sort_keys=True).encode()).hexdigest()
+    key = f'library:facets:{catalog_version()}:{digest}'
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(filters)
+        cache.set(key, facets, FACET_CACHE_TTL)
+    return facets
+
+
+# Catalog edits invalidate every cached facet set
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+@receiver(post_save, sender=BookAuthor)
+@receiver(post_delete, sender=BookAuthor)
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+@receiver(post_save, sender=Topic)
+@receiver(post_delete, sender=Topic)
+def invalidate_facets(sender, raw=False, **kwargs):
+    if not raw:
+        bump_catalog_version()
+
+@receiver(m2m_changed, sender=Book.authors.through)
+def invalidate_facets_on_authors_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_catalog_version()
@@ -0,0 +1,220 @@
+"""
+Idempotency keys for mutating requests.
+
+A client that retries a POST after a timeout can't tell whether the first
+attempt went through. When it sends an ``Idempotency-Key`` header, or an
+``idempotency_key`` form field, the first response to that key is stored in
+PJI_IDEMPOTENCY_KEY. Repeats of the request get the stored response back
+without the view running again, marked with an ``Idempotent-Replayed``
+header. Keys are scoped to the user and the URL, so two users can't collide
+and one key can't be replayed against another endpoint.
+
+A key row is committed before the view runs, so a duplicate that arrives
+while the first request is still in flight gets 409 Conflict instead of
+running in parallel. Reusing a key with a different request body gets
+422. The row is dropped when the view raises or returns a server error,
+so the client can retry. Rows expire after ``LIBRARY_IDEMPOTENCY_TTL``
+seconds and ``manage.py purge_idempotency_keys`` deletes them.
+
+HTML forms get a fresh key per render from the ``form_token`` context
+processor: ``<input type="hidden" name="idempotency_key"
+value="{{ idempotency_key }}">``.
+
+Only the status, body, Content-Type and Location of a response are kept.
+Bodies are zlib-compressed, and a redirect stores no body at all.
+"""
+import functools
+import hashlib
+import json
+import uuid
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse, RawPostDataException
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+FORM_FIELD = 'idempotency_key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+TTL = getattr(settings, 'LIBRARY_IDEMPOTENCY_TTL', 24 * 60 * 60)
+
+# A request still marked in progress after this long is presumed dead
+IN_PROGRESS_TIMEOUT = timedelta(seconds=getattr(settings, 'LIBRARY_IDEMPOTENCY_IN_PROGRESS_TIMEOUT', 60))
+
+MAX_KEY_LENGTH = 255
+
+STORED_HEADERS = ('Content-Type', 'Location')
+
+UNSAFE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+def form_token(request):
+    """Context processor: a fresh idempotency key for each rendered form"""
+    return {'idempotency_key': SimpleLazyObject(lambda: uuid.uuid4().hex)}
+
+
+def _request_key(request):
+    key = request.headers.get(HEADER)
+    if not key and request.content_type in ('application/x-www-form-urlencoded', 'multipart/form-data'):
+        key = request.POST.get(FORM_FIELD)
+    return key or None
+
+
+def _digest(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _request_hash(request):
+    try:
+        body = request.body
+    except RawPostDataException:
+        # Multipart bodies are consumed once parsed; hash the parsed fields
+        body = json.dumps(sorted(request.POST.lists())).encode()
+    return _digest(request.method, body)
+
+
+def _scope(request):
+    """Whose keys these are: the user, the API credentials or the session; None if unknown"""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    # API clients using HTTP Basic are only authenticated later, by DRF
+    authorization = request.headers.get('Authorization')
+    if authorization:
+        return f'auth:{_digest(authorization)}'
+    session = getattr(request, 'session', None)
+    if session is not None and session.session_key:
+        return f'session:{session.session_key}'
+    return None
+
+
+def _store(record, response):
+    record.status_code = response.status_code
+    record.headers = json.dumps({name: response[name] for name in STORED_HEADERS if response.has_header(name)})
+    record.body = zlib.compress(response.content) if response.content else None
+    record.save(update_fields=['status_code', 'headers', 'body'])
+
+
+def _replay(record):
+    response = HttpResponse(
+        zlib.decompress(record.body) if record.body else b'',
+        status=record.status_code,
+    )
+    for name, value in json.loads(record.headers).items():
+        response[name] = value
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def _claim(key_hash, request_hash):
+    """Insert the key; returns (record, None) if this request owns it, else (None, response)"""
+    now = timezone.now()
+    record = IdempotencyKey(
+        key_hash=key_hash, request_hash=request_hash,
+        created_at=now, expires_at=now + timedelta(seconds=TTL),
+    )
+    try:
+        with transaction.atomic():
+            record.save(force_insert=True)
+        return record, None
+    except IntegrityError:
+        pass
+
+    existing = IdempotencyKey.objects.filter(key_hash=key_hash).first()
+    abandoned = existing is not None and (
+        existing.expires_at <= now
+        or (existing.status_code is None and existing.created_at <= now - IN_PROGRESS_TIMEOUT)
+    )
+    if existing is None or abandoned:
+        # Take over an expired key or one whose request died; the
+        # conditional delete lets only one retry win it
+        if existing is not None:
+            IdempotencyKey.objects.filter(key_hash=key_hash, created_at=existing.created_at).delete()
+        try:
+            with transaction.atomic():
+                record.save(force_insert=True)
+            return record, None
+        except IntegrityError:
+            return None, JsonResponse({'error': 'A request with this idempotency key is in progress.'}, status=409)
+
+    if existing.request_hash != request_hash:
+        return None, JsonResponse(
+            {'error': 'This idempotency key was already used for a different request.'}, status=422
+        )
+    if existing.status_code is None:
+        return None, JsonResponse({'error': 'A request with this idempotency key is in progress.'}, status=409)
+    return None, _replay(existing)
+
+
+def run_idempotently(request, view_func, *args, **kwargs):
+    """Run ``view_func`` once per idempotency key, replaying its response to repeats"""
+    key = _request_key(request) if request.method in UNSAFE_METHODS else None
+    scope = _scope(request) if key is not None else None
+    if scope is None:
+        return view_func(request, *args, **kwargs)
+    if len(key) > MAX_KEY_LENGTH:
+        return JsonResponse({'error': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters.'}, status=400)
+
+    key_hash = _digest(scope, request.path, key)
+    record, response = _claim(key_hash, _request_hash(request))
+    if record is None:
+        return response
+
+    try:
+        response = view_func(request, *args, **kwargs)
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.render()
+    except BaseException:
+        record.delete()
+        raise
+    if response.status_code >= 500 or response.streaming:
+        record.delete()
+    else:
+        _store(record, response)
+    return response
+
+
+def idempotent(view_func):
+    """Make a function view honour idempotency keys.
+
+    Put it outside ``@transactional`` so the key is committed before the
+    view's transaction starts.
+    """
+    @functools.wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        return run_idempotently(request, view_func, *args, **kwargs)
+    return wrapper
+
+
+class IdempotentViewSetMixin:
+    """Honour idempotency keys on a viewset's unsafe methods.
+
+    List it before TransactionalViewSetMixin.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        return run_idempotently(request, super().dispatch, *args, **kwargs)
+
+
+def purge_expired(batch_size=1000):
+    """Delete expired keys in batches; returns the number deleted"""
+    purged = 0
+    while True:
+        expired = list(
+            IdempotencyKey.objects.filter(expires_at__lte=timezone.now())
+            .values_list('key_hash', flat=True)[:batch_size]
+        )
+        if not expired:
+            return purged
+        IdempotencyKey.objects.filter(key_hash__in=expired).delete()
+        purged += len(expired)
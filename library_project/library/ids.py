@@ -0,0 +1,189 @@
+"""
+Primary key allocation.
+
+Rows used to take ``max(pk) + 1`` as their id. That costs a query per
+insert, and two concurrent inserts can read the same maximum and collide.
+Ids now come from a pluggable allocator, chosen with the
+``LIBRARY_ID_ALLOCATOR`` setting:
+
+``'hilo'`` (default)
+    Each process reserves blocks of ``LIBRARY_ID_BLOCK_SIZE`` ids per
+    table from PJI_ID_SEQUENCE and hands them out from memory. Reserving a
+    block is one atomic UPDATE that commits on its own, even when it
+    happens inside a request transaction, so a rollback can never hand the
+    same block out twice. A block always starts above the table's current
+    maximum id, so rows inserted by other means are skipped over. Each
+    process hands out ids from its own block, so ids do not grow in commit
+    order and cannot be used as a "seen up to" watermark.
+
+``'auto'``
+    Leaves the id unset and lets the table's AUTO_INCREMENT assign it.
+
+A ``pre_save`` hook assigns ids to new rows of the ``ALLOCATED_MODELS``.
+Views, forms, the admin and the API therefore all share one allocator.
+``bulk_create`` sends no signals, so bulk writers take their ids from
+``new_ids()``, or from ``reserve_block()`` when they need real ids even
+under ``'auto'``.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connections, router, transaction
+from django.db.models import F, Max
+from django.db.models.functions import Greatest
+from django.db.models.signals import pre_save
+
+from .models import IdSequence
+
+BLOCK_SIZE = getattr(settings, 'LIBRARY_ID_BLOCK_SIZE', 50)
+
+# Models whose ids are assigned by the allocator on insert
+ALLOCATED_MODELS = (
+    'library.Author',
+    'library.Book',
+    'library.BookCopy',
+    'library.Customer',
+    'library.Event',
+    'library.Invoice',
+    'library.Payment',
+    'library.Rental',
+    'library.Reservation',
+    'library.Topic',
+)
+
+
+def _reserve(model, count):
+    """Atomically reserve ``count`` ids for a model's table; returns the first"""
+    db = router.db_for_write(model)
+    name = model._meta.db_table
+    floor = (model._default_manager.using(db).aggregate(last=Max(model._meta.pk.attname))['last'] or 0) + 1
+    while True:
+        with transaction.atomic(using=db):
+            sequence = IdSequence.objects.using(db).filter(name=name)
+            if sequence.update(next_hi=Greatest(F('next_hi'), floor) + count):
+                return sequence.values_list('next_hi', flat=True).get() - count
+        try:
+            with transaction.atomic(using=db):
+                IdSequence.objects.using(db).create(name=name, next_hi=floor)
+        except IntegrityError:
+            # Another process created the row first
+            pass
+
+
+def _reserve_on_helper(model, count):
+    try:
+        return _reserve(model, count)
+    except DatabaseError:
+        # The kept-open connection may have been dropped by the server
+        # (wait_timeout); retry once on a new one
+        connections[router.db_for_write(model)].close()
+        return _reserve(model, count)
+
+
+# One long-lived helper thread per process. Its connection stays open
+# between reservations, so a reservation inside a transaction costs a
+# hand-off to that thread and the UPDATE, not a new thread and connection.
+_helper = ThreadPoolExecutor(max_workers=1, thread_name_prefix='library-id-reserve')
+
+
+def _reserve_autonomously(model, count):
+    """Reserve outside of any transaction open on this thread.
+
+    Runs on the helper thread, which has its own connection, so the
+    reservation commits even if the caller later rolls back. Reservations
+    from all threads of the process queue for the helper; each one is a
+    single short UPDATE and happens once per block. SQLite locks the whole
+    database for writing, so there the helper would wait on the caller's
+    own transaction; it reserves inline instead.
+    """
+    db = router.db_for_write(model)
+    connection = connections[db]
+    if not connection.in_atomic_block or connection.vendor == 'sqlite':
+        return _reserve(model, count)
+    return _helper.submit(_reserve_on_helper, model, count).result()
+
+
+def reserve_block(model, count):
+    """Reserve ``count`` consecutive ids for a bulk insert; returns the first"""
+    return _reserve_autonomously(model, count)
+
+
+class HiLoAllocator:
+    """Hands out ids from per-process blocks reserved in PJI_ID_SEQUENCE"""
+
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._blocks = {}
+
+    def new_ids(self, model, count):
+        start = _reserve_autonomously(model, count)
+        return range(start, start + count)
+
+    def next_id(self, model):
+        name = model._meta.db_table
+        with self._lock:
+            block = self._blocks.get(name)
+            if block is None or block[0] >= block[1]:
+                start = _reserve_autonomously(model, self.block_size)
+                block = self._blocks[name] = [start, start + self.block_size]
+            value = block[0]
+            block[0] += 1
+            return value
+
+
+class AutoIncrementAllocator:
+    """Leaves ids to the database's AUTO_INCREMENT"""
+
+    def new_ids(self, model, count):
+        return [None] * count
+
+    def next_id(self, model):
+        return None
+
+
+ALLOCATORS = {
+    'hilo': HiLoAllocator,
+    'auto': AutoIncrementAllocator,
+}
+
+_allocator = None
+_allocator_lock = threading.Lock()
+
+
+def get_allocator():
+    global _allocator
+    if _allocator is None:
+        with _allocator_lock:
+            if _allocator is None:
+                _allocator = ALLOCATORS[getattr(settings, 'LIBRARY_ID_ALLOCATOR', 'hilo')]()
+    return _allocator
+
+
+def set_allocator(allocator):
+    """Swap the process-wide allocator; returns the previous one"""
+    global _allocator
+    with _allocator_lock:
+        previous, _allocator = _allocator, allocator
+    return previous
+
+
+def next_id(model):
+    """Id for a new row of ``model``, or None to let the database assign it"""
+    return get_allocator().next_id(model)
+
+
+def new_ids(model, count):
+    """Ids for ``count`` rows about to be bulk inserted (Nones under ``'auto'``)"""
+    return get_allocator().new_ids(model, count)
+
+
+def assign_id(sender, instance, raw=False, **kwargs):
+    if not raw and instance.pk is None:
+        instance.pk = next_id(sender)
+
+
+for label in ALLOCATED_MODELS:
+    pre_save.connect(assign_id, sender=apps.get_model(label), dispatch_uid=f'library.ids.{label}')
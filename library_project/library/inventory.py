@@ -0,0 +1,116 @@
+"""
+Book copy inventory.
+
+``Book.available_copies`` and ``Book.total_copies`` are denormalized counters
+over PJI_BOOK_COPY. Every copy status change goes through ``set_copy_status``
+so the counters move in the same transaction as the copy row, and
+``recount_books`` rebuilds them from scratch when they need repair. Status
+changes are versioned transitions (see library.versioning). Counter
+updates wait for the end of the transaction when it collects deferred
+writes (see library.deferred), so a popular title's row is not locked
+for the whole of each checkout.
+"""
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from . import deferred
+from .availability import notify_book
+from .book_cache import invalidate_book_detail
+from .ids import new_ids
+from .models import Book, BookCopy
+
+AVAILABLE = 'available'
+CHECKED_OUT = 'not available'
+
+# Upper bound on copies provisioned by one add_copies() call
+MAX_NEW_COPIES = 10000
+
+# Rows per INSERT statement when provisioning copies
+COPY_BATCH_SIZE = 1000
+
+
+def _write_counters(key, deltas):
+    _table, book_id = key
+    updates = {
+        field: F(field) + deltas[name]
+        for name, field in (('available', 'available_copies'), ('total', 'total_copies'))
+        if deltas.get(name)
+    }
+    if updates:
+        Book.objects.filter(book_id=book_id).update(**updates)
+        notify_book(book_id)
+
+
+def adjust_counters(book_id, available=0, total=0, defer=True):
+    """Shift a book's counters by the given deltas with a single UPDATE.
+
+    The UPDATE locks the book's row until commit, so it is held back to
+    the end of the transaction when deferred writes are being collected
+    (see library.deferred). Pass ``defer=False`` to read the counters back
+    in the same transaction.
+    """
+    if defer:
+        deferred.add((Book._meta.db_table, book_id), _write_counters, available=available, total=total)
+    else:
+        _write_counters((Book._meta.db_table, book_id), {'available': available, 'total': total})
+
+
+def set_copy_status(book_copy, status):
+    """Move a copy to a new status and keep its book's counters in step.
+
+    Call inside the transaction that performs the surrounding checkout,
+    return or loss so the counter can never drift from the copy row.
+    Raises ConcurrentUpdateError if the copy changed since it was read.
+    """
+    previous = book_copy.status
+    if previous == status:
+        return
+    book_copy.transition(status=status)
+    adjust_counters(book_copy.book_id, available=int(status == AVAILABLE) - int(previous == AVAILABLE))
+
+
+def add_copies(book, count, status=AVAILABLE):
+    """Provision ``count`` new copies of a book with batched INSERTs.
+
+    Copy ids are reserved as one block (see library.ids), so there are no
+    per-copy id lookups. The counters move in the same transaction as the
+    new rows. Returns the number of copies added.
+    """
+    if not 1 <= count <= MAX_NEW_COPIES:
+        raise ValueError(f"Number of copies must be between 1 and {MAX_NEW_COPIES}.")
+    with transaction.atomic():
+        BookCopy.objects.bulk_create(
+            [
+                BookCopy(copy_id=copy_id, book_id=book.book_id, status=status)
+                for copy_id in new_ids(BookCopy, count)
+            ],
+            batch_size=COPY_BATCH_SIZE,
+        )
+        adjust_counters(book.book_id, available=count if status == AVAILABLE else 0, total=count, defer=False)
+        # bulk_create sends no post_save signals
+        invalidate_book_detail(book.book_id)
+    return count
+
+
+def _copy_count(**filters):
+    return Subquery(
+        BookCopy.objects.filter(book=OuterRef('pk'), **filters)
+        .order_by()
+        .values('book')
+        .annotate(count=Count('pk'))
+        .values('count')
+    )
+
+
+def recount_books(queryset=None):
+    """Recompute the counters of the given books from their copies in one UPDATE.
+
+    Returns the number of books updated.
+    """
+    if queryset is None:
+        queryset = Book.objects.all()
+    return queryset.update(
+        available_copies=Coalesce(_copy_count(status=AVAILABLE), 0),
+        total_copies=Coalesce(_copy_count(), 0),
+    )
@@ -0,0 +1,195 @@
+"""
+Cached headline counters (KPIs) for the home page, the management
+dashboard and ``/kpis/``.
+
+KPIs are computed in groups: one query per group, cached under the
+group's name for ``LIBRARY_KPI_TTL`` seconds. Each group also has a
+generation number in the cache. Saving or deleting a row of a model the
+group counts bumps its generation once the transaction commits, which
+marks the cached values dirty. Values computed at an older generation, or
+past their TTL, are recomputed on the next read. Some counters move with
+the clock alone (rooms free up when a reservation ends, rentals become
+overdue), so the TTL also bounds how stale those get.
+
+Recomputing is single-flight. The first reader of a dirty or expired group
+takes a short lock in the cache and recomputes. Readers arriving in the
+meantime get the previous value if there is one, instead of running the
+same queries in parallel, or wait for the new one if there is none.
+
+``snapshot()`` reads every entry and generation with one ``get_many``, so a
+page whose KPIs are all fresh makes no database query for them.
+
+Generations only mark entries dirty for workers that share the cache, so
+deployments with more than one process need a shared cache backend (see
+``CACHES`` in the settings). In a per-process cache the other workers
+don't see the bump and serve their values until the TTL runs out.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from . import metrics, stats
+from .models import Book, Invoice, Payment, Rental, Reservation, StudyRoom
+from .versioning import transitioned
+
+KPI_TTL = getattr(settings, 'LIBRARY_KPI_TTL', 30)
+
+# Dirty or expired values are kept this long so they can be served while
+# one request recomputes them
+STALE_TTL = getattr(settings, 'LIBRARY_KPI_STALE_TTL', 600)
+
+# How long a recompute may hold the lock before another reader takes over
+LOCK_TIMEOUT = 10
+
+# How often a reader with nothing to serve checks whether the recompute finished
+WAIT_INTERVAL = 0.05
+
+HITS = 'kpis.hits'
+STALE_HITS = 'kpis.stale_hits'
+RECOMPUTES = 'kpis.recomputes'
+metrics.register(HITS, STALE_HITS, RECOMPUTES)
+
+
+def _catalog():
+    return {'total_books': Book.objects.count()}
+
+
+def _rentals():
+    return Rental.objects.aggregate(
+        active_rentals=Count('pk', filter=Q(status='Borrowed')),
+        overdue_rentals=Count('pk', filter=Q(status='Borrowed', exp_return_dt__lt=timezone.now())),
+    )
+
+
+def _rooms():
+    now = timezone.now()
+    return StudyRoom.objects.aggregate(
+        total_rooms=Count('pk'),
+        available_rooms=Count('pk', filter=~Exists(
+            Reservation.objects.filter(study_room=OuterRef('pk'), start_dt__lte=now, end_dt__gt=now)
+        )),
+    )
+
+
+def _invoices():
+    totals = stats.totals()
+    unpaid = Invoice.objects.aggregate(
+        unpaid=Count('pk', filter=~Exists(Payment.objects.filter(invoice=OuterRef('pk'))))
+    )['unpaid']
+    return {
+        'total_invoices': totals['invoices_issued'],
+        'total_revenue': float(totals['revenue_invoiced']),
+        'unpaid_invoices': unpaid,
+    }
+
+
+# Group name -> (function computing its KPIs, models whose writes make it dirty)
+GROUPS = {
+    'catalog': (_catalog, (Book,)),
+    'rentals': (_rentals, (Rental,)),
+    'rooms': (_rooms, (StudyRoom, Reservation)),
+    'invoices': (_invoices, (Invoice, Payment)),
+}
+
+# Shown to everyone; the others are for employees
+PUBLIC_GROUPS = ('catalog', 'rentals', 'rooms')
+
+
+def _entry_key(name):
+    return f'library:kpi:{name}'
+
+
+def _generation_key(name):
+    return f'library:kpi:{name}:generation'
+
+
+def _lock_key(name):
+    return f'library:kpi:{name}:lock'
+
+
+def _is_fresh(entry, generation):
+    return entry is not None and entry['generation'] == generation and entry['fresh_until'] > time.time()
+
+
+def _recompute(name):
+    """Compute a group and cache it; returns its values"""
+    # Read the generation first: a write committed during the queries
+    # leaves the new entry already dirty
+    generation = cache.get_or_set(_generation_key(name), 1, None)
+    metrics.incr(RECOMPUTES)
+    values = GROUPS[name][0]()
+    cache.set(
+        _entry_key(name),
+        {'values': values, 'generation': generation, 'fresh_until': time.time() + KPI_TTL},
+        STALE_TTL,
+    )
+    return values
+
+
+def _refresh(name, stale):
+    """Values for a dirty or expired group, recomputing at most once at a time"""
+    if cache.add(_lock_key(name), 1, LOCK_TIMEOUT):
+        try:
+            return _recompute(name)
+        finally:
+            cache.delete(_lock_key(name))
+    if stale is not None:
+        metrics.incr(STALE_HITS)
+        return stale['values']
+
+    # Nothing to serve yet; wait for the request holding the lock
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        entry = cache.get(_entry_key(name))
+        if entry is not None:
+            return entry['values']
+    return _recompute(name)
+
+
+def snapshot(groups=None):
+    """The KPIs of ``groups`` (default: all) as one flat dict"""
+    names = list(GROUPS if groups is None else groups)
+    cached = cache.get_many([_entry_key(name) for name in names] + [_generation_key(name) for name in names])
+    values = {}
+    for name in names:
+        entry = cached.get(_entry_key(name))
+        if _is_fresh(entry, cached.get(_generation_key(name), 1)):
+            metrics.incr(HITS)
+            values.update(entry['values'])
+        else:
+            values.update(_refresh(name, entry))
+    return values
+
+
+def mark_dirty(name):
+    """Make a group's cached values stale once the current transaction commits"""
+    def bump():
+        try:
+            cache.incr(_generation_key(name))
+        except ValueError:
+            cache.set(_generation_key(name), 2, None)
+    transaction.on_commit(bump)
+
+
+def _dirty_groups(model):
+    return [name for name, (_compute, models) in GROUPS.items() if model in models]
+
+
+def _mark_dirty_on_write(sender, raw=False, **kwargs):
+    if not raw:
+        for name in _dirty_groups(sender):
+            mark_dirty(name)
+
+
+for _model in {model for _compute, models in GROUPS.values() for model in models}:
+    post_save.connect(_mark_dirty_on_write, sender=_model, dispatch_uid=f'kpis_post_save_{_model.__name__}')
+    post_delete.connect(_mark_dirty_on_write, sender=_model, dispatch_uid=f'kpis_post_delete_{_model.__name__}')
+
+# Returns and losses are written by transition(), which sends no post_save
+transitioned.connect(_mark_dirty_on_write, sender=Rental, dispatch_uid='kpis_transitioned_rental')
@@ -0,0 +1,204 @@
+"""
+Popular-books leaderboard over rolling 7, 30 and 365-day windows.
+
+PJI_BOOK_DAILY_CHECKOUTS counts the rentals of each book per borrow day,
+and PJI_BOOK_POPULARITY holds each book's count in every window. A new
+rental adds one to its book's bucket for the day and to every window
+counter covering that day, inside the rental's transaction; deleting the
+rental takes them back. Both writes wait for the end of the transaction
+when it collects deferred writes (see library.deferred), so a popular
+title's rows are only locked while it commits. The top N of a window is
+read with an index scan of PJI_BOOK_POPULARITY that stops after N rows,
+never touching PJI_RENTAL.
+
+Counters only grow between runs of ``manage.py decay_popularity``, which
+is meant to run daily just after midnight. For each window it recomputes,
+with one UPDATE, the counters of the books that have buckets which left
+the window in the last ``DECAY_LOOKBACK_DAYS`` days, from the buckets
+still inside it. It then deletes buckets older than the longest window.
+Until the job has run, a window can include one extra day.
+``decay_popularity --rebuild`` rebuilds both tables from rental history.
+"""
+import functools
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import deferred, stats
+from .models import BookCopy, BookDailyCheckouts, BookPopularity, Rental
+
+# Window name -> length in days, today included
+WINDOWS = {'7d': 7, '30d': 30, '365d': 365}
+DEFAULT_WINDOW = '7d'
+
+# How far back the decay job looks for buckets that left a window; covers
+# missed daily runs
+DECAY_LOOKBACK_DAYS = 7
+
+# Rows per INSERT when rebuilding
+BATCH_SIZE = 1000
+
+
+def column(window):
+    """The PJI_BOOK_POPULARITY field holding a window's counts"""
+    if window not in WINDOWS:
+        raise ValueError(f'Unknown window "{window}"; use one of {", ".join(WINDOWS)}.')
+    return f'checkouts_{window}'
+
+
+def _upsert(queryset, new_row, delta, **updates):
+    """Apply ``updates`` to the row, creating it first for positive deltas"""
+    if not queryset.update(**updates) and delta > 0:
+        # First checkout; another one may be creating the row too
+        type(new_row).objects.bulk_create([new_row], ignore_conflicts=True)
+        queryset.update(**updates)
+
+
+def _write_checkouts(key, deltas, today=None):
+    _table, book_id, day = key
+    delta = deltas['checkouts']
+    today = today or timezone.localdate()
+    _upsert(
+        BookDailyCheckouts.objects.filter(book_id=book_id, checkout_date=day),
+        BookDailyCheckouts(book_id=book_id, checkout_date=day), delta,
+        checkouts=F('checkouts') + delta,
+    )
+    windows = {
+        column(window): F(column(window)) + delta
+        for window, days in WINDOWS.items()
+        if today - timedelta(days=days) < day <= today
+    }
+    if windows:
+        _upsert(BookPopularity.objects.filter(book_id=book_id), BookPopularity(book_id=book_id), delta, **windows)
+
+
+def record_checkouts(book_id, day, delta, today=None):
+    """Add ``delta`` checkouts of a book borrowed on ``day`` to its bucket and window counters.
+
+    Held back to the end of the transaction when deferred writes are being
+    collected (see library.deferred).
+    """
+    if book_id is None or day is None:
+        return
+    deferred.add(
+        (BookPopularity._meta.db_table, book_id, day),
+        functools.partial(_write_checkouts, today=today),
+        checkouts=delta,
+    )
+
+
+def _book_id(book_copy_id, rental=None):
+    if book_copy_id is None:
+        return None
+    if rental is not None and Rental._meta.get_field('book_copy').is_cached(rental):
+        return rental.book_copy.book_id
+    return BookCopy.objects.filter(copy_id=book_copy_id).values_list('book_id', flat=True).first()
+
+
+def _day(value):
+    return timezone.localdate(value) if value is not None else None
+
+
+# The row's previous copy and borrow date come from the read stats makes before every save
+stats.remember_fields(Rental, 'book_copy_id', 'borrow_date')
+
+
+@receiver(post_save, sender=Rental)
+def _record_checkout(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    new = (instance.book_copy_id, instance.borrow_date)
+    previous = None if created else stats.old_values(instance)
+    old = None if previous is None else (previous['book_copy_id'], previous['borrow_date'])
+    if old == new:
+        return
+    if old is not None:
+        record_checkouts(_book_id(old[0]), _day(old[1]), -1)
+    record_checkouts(_book_id(instance.book_copy_id, instance), _day(instance.borrow_date), 1)
+
+
+@receiver(post_delete, sender=Rental)
+def _forget_checkout(sender, instance, **kwargs):
+    record_checkouts(_book_id(instance.book_copy_id, instance), _day(instance.borrow_date), -1)
+
+
+def _window_total(since, today):
+    """A book's checkouts on the days in (since, today], as an expression over its popularity row"""
+    totals = (
+        BookDailyCheckouts.objects.filter(book_id=OuterRef('book_id'), checkout_date__gt=since, checkout_date__lte=today)
+        .values('book_id').annotate(total=Sum('checkouts')).values('total')
+    )
+    return Coalesce(Subquery(totals), Value(0))
+
+
+def decay(today=None, lookback=DECAY_LOOKBACK_DAYS):
+    """Drop checkouts that left their windows from the counters; returns {window: books updated}"""
+    today = today or timezone.localdate()
+    updated = {}
+    for window, days in WINDOWS.items():
+        cutoff = today - timedelta(days=days)
+        expired = BookDailyCheckouts.objects.filter(
+            checkout_date__gt=cutoff - timedelta(days=lookback), checkout_date__lte=cutoff
+        ).values('book_id')
+        updated[window] = BookPopularity.objects.filter(book_id__in=expired).update(
+            **{column(window): _window_total(cutoff, today)}
+        )
+    BookDailyCheckouts.objects.filter(checkout_date__lte=today - timedelta(days=max(WINDOWS.values()))).delete()
+    return updated
+
+
+def rebuild(today=None):
+    """Rebuild the buckets and counters from the rentals of the longest window; returns books ranked"""
+    today = today or timezone.localdate()
+    first_day = today - timedelta(days=max(WINDOWS.values()) - 1)
+    with transaction.atomic():
+        BookDailyCheckouts.objects.all().delete()
+        BookPopularity.objects.all().delete()
+
+        checkouts = (
+            Rental.objects.filter(
+                book_copy__isnull=False,
+                borrow_date__gte=stats.start_of_day(first_day),
+                borrow_date__lt=stats.start_of_day(today + timedelta(days=1)),
+            )
+            .annotate(day=TruncDate('borrow_date', tzinfo=timezone.get_current_timezone()))
+            .values_list('book_copy__book_id', 'day')
+            .annotate(checkouts=Count('pk'))
+        )
+        buckets, counters = [], defaultdict(lambda: dict.fromkeys(WINDOWS, 0))
+        for book_id, day, count in checkouts:
+            buckets.append(BookDailyCheckouts(book_id=book_id, checkout_date=day, checkouts=count))
+            for window, days in WINDOWS.items():
+                if day > today - timedelta(days=days):
+                    counters[book_id][window] += count
+
+        BookDailyCheckouts.objects.bulk_create(buckets, batch_size=BATCH_SIZE)
+        BookPopularity.objects.bulk_create(
+            [
+                BookPopularity(book_id=book_id, **{column(window): count for window, count in windows.items()})
+                for book_id, windows in counters.items()
+            ],
+            batch_size=BATCH_SIZE,
+        )
+    return len(counters)
+
+
+def ranking(window=DEFAULT_WINDOW):
+    """Popularity rows with checkouts in ``window``, most first, each annotated with ``checkouts``"""
+    field = column(window)
+    return (
+        BookPopularity.objects.filter(**{f'{field}__gt': 0})
+        .annotate(checkouts=F(field))
+        .order_by(f'-{field}', '-book_id')
+    )
+
+
+def top_books(window=DEFAULT_WINDOW, limit=5):
+    """The most borrowed books in ``window`` as (book, checkouts) pairs, most first"""
+    return [(row.book, row.checkouts) for row in ranking(window).select_related('book')[:limit]]
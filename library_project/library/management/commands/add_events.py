@@ -7,12 +7,6 @@ class Command(BaseCommand):
     help = 'Adds new events to the database'
 
     def handle(self, *args, **kwargs):
-        # Get the next available event ID
-        try:
-            max_id = Event.objects.order_by('-event_id').first().event_id
-        except AttributeError:
-            max_id = 0
-
         # Create some exhibitions
         exhibitions = [
             {
@@ -58,12 +52,8 @@ class Command(BaseCommand):
 
         # Create exhibitions
         for exhibition_data in exhibitions:
-            event_id = max_id + 1
-            max_id += 1
-            
             # Create event
             event = Event.objects.create(
-                event_id=event_id,
                 event_name=exhibition_data['name'],
                 start_dt=exhibition_data['start_dt'],
                 end_dt=exhibition_data['end_dt'],
@@ -83,12 +73,8 @@ class Command(BaseCommand):
 
         # Create seminars
         for seminar_data in seminars:
-            event_id = max_id + 1
-            max_id += 1
-            
             # Create event
             event = Event.objects.create(
-                event_id=event_id,
                 event_name=seminar_data['name'],
                 start_dt=seminar_data['start_dt'],
                 end_dt=seminar_data['end_dt'],
@@ -5,17 +5,9 @@ class Command(BaseCommand):
     help = 'Adds test customers to the database'
 
     def handle(self, *args, **options):
-        # Get the next available customer ID
-        try:
-            max_id = Customer.objects.order_by('-cust_id').first().cust_id
-        except AttributeError:
-            max_id = 0
-
         # Create 100 test customers
         for i in range(1, 101):
-            customer_id = max_id + i
             Customer.objects.create(
-                cust_id=customer_id,
                 fname=f'Test{i}',
                 lname=f'Customer{i}',
                 email=f'test{i}@example.com',
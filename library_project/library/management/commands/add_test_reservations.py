@@ -26,19 +26,12 @@ class Command(BaseCommand):
         deleted, _ = Reservation.objects.filter(customer=alice).delete()
         self.stdout.write(self.style.WARNING(f'Deleted {deleted} old reservations for AliceJ.'))
 
-        # Get the next available reservation ID
-        try:
-            max_id = Reservation.objects.order_by('-reserve_id').first().reserve_id
-        except AttributeError:
-            max_id = 0
-
         now = timezone.now()
 
         # Past reservation: 2 hours ago to 1 hour ago
         past_start = now - timedelta(hours=2)
         past_end = now - timedelta(hours=1)
         Reservation.objects.create(
-            reserve_id=max_id + 1,
             topic_desc="Past Study Session",
             start_dt=past_start,
             end_dt=past_end,
@@ -51,7 +44,6 @@ class Command(BaseCommand):
         future_start = now + timedelta(hours=1)
         future_end = now + timedelta(hours=2)
         Reservation.objects.create(
-            reserve_id=max_id + 2,
             topic_desc="Upcoming Study Session",
             start_dt=future_start,
             end_dt=future_end,
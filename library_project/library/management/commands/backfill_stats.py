@@ -0,0 +1,60 @@
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from library import stats
+
+def parse_day(value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f'Invalid date "{value}"; use YYYY-MM-DD.')
+
+def rebuild_chunk(start, end):
+    try:
+        return stats.rebuild(start, end)
+    finally:
+        # Worker threads open their own connections
+        connections.close_all()
+
+class Command(BaseCommand):
+    help = 'Rebuilds the daily statistics rollup for a range of days from the rental, invoice and payment tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=parse_day, help='First day to rebuild (default: the earliest activity)')
+        parser.add_argument('--end', type=parse_day, help='Last day to rebuild, inclusive (default: the latest activity)')
+        parser.add_argument('--chunk-days', type=int, default=31, help='Days rebuilt per transaction')
+        parser.add_argument('--workers', type=int, default=4, help='Chunks rebuilt in parallel')
+
+    def handle(self, *args, **options):
+        activity = stats.activity_range()
+        if activity is None and not (options['start'] and options['end']):
+            self.stdout.write(self.style.SUCCESS('No activity to roll up'))
+            return
+        start = options['start'] or activity[0]
+        end = options['end'] or activity[1]
+        if start > end:
+            raise CommandError('--start must not be after --end.')
+        if options['chunk_days'] < 1 or options['workers'] < 1:
+            raise CommandError('--chunk-days and --workers must be at least 1.')
+
+        step = datetime.timedelta(days=options['chunk_days'])
+        stop = end + datetime.timedelta(days=1)
+        chunks = []
+        while start < stop:
+            chunks.append((start, min(start + step, stop)))
+            start += step
+
+        if options['workers'] > 1:
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                results = list(executor.map(rebuild_chunk, *zip(*chunks)))
+        else:
+            results = [stats.rebuild(*chunk) for chunk in chunks]
+
+        for (chunk_start, chunk_end), days in zip(chunks, results):
+            self.stdout.write(f'Rebuilt {chunk_start} to {chunk_end - datetime.timedelta(days=1)} ({days} active days)')
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {len(chunks)} chunks from {chunks[0][0]} to {end}, {sum(results)} active days'
+        ))
@@ -0,0 +1,99 @@
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient
+
+from library.models import Book, Event
+
+# (name, sync path, async path); {book_id} and {event_id} are filled in
+PATHS = [
+    ('home', '/', '/async/'),
+    ('book_list', '/books/', '/async/books/'),
+    ('book_detail', '/books/{book_id}/', '/async/books/{book_id}/'),
+    ('event_list', '/events/', '/async/events/'),
+    ('study_room_list', '/rooms/', '/async/rooms/'),
+    ('api_book_list', '/api/books/', '/api/async/books/'),
+    ('api_book_detail', '/api/books/{book_id}/', '/api/async/books/{book_id}/'),
+    ('api_event_list', '/api/events/', '/api/async/events/'),
+    ('api_event_detail', '/api/events/{event_id}/', '/api/async/events/{event_id}/'),
+]
+
+USERNAME = 'benchmark-async-views'
+
+def percentile(latencies, fraction):
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class Command(BaseCommand):
+    help = 'Compares p50/p99 latency of the sync and async read views under concurrent ASGI requests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per view')
+        parser.add_argument('--concurrency', type=int, default=20, help='Requests in flight at once')
+        parser.add_argument('--host', default='localhost', help='Host header; must be in ALLOWED_HOSTS')
+        parser.add_argument(
+            '--only', action='append', choices=[name for name, _sync, _async in PATHS],
+            help='Benchmark only this view (repeatable)',
+        )
+
+    def handle(self, *args, **options):
+        ids = {
+            'book_id': Book.objects.order_by('book_id').values_list('book_id', flat=True).first(),
+            'event_id': Event.objects.order_by('event_id').values_list('event_id', flat=True).first(),
+        }
+        paths = [
+            (name, sync_path.format(**ids), async_path.format(**ids))
+            for name, sync_path, async_path in PATHS
+            if (not options['only'] or name in options['only'])
+            and not any(ids[key] is None and '{' + key + '}' in sync_path for key in ids)
+        ]
+        if not paths:
+            raise CommandError('Nothing to benchmark; create some books and events first.')
+
+        # A plain customer: employees are redirected away from the home page
+        user, _created = User.objects.get_or_create(username=USERNAME)
+        try:
+            asyncio.run(self.run(user, paths, options))
+        finally:
+            user.delete()
+        self.stdout.write(self.style.SUCCESS('Benchmark complete'))
+
+    async def run(self, user, paths, options):
+        client = AsyncClient(HTTP_HOST=options['host'])
+        await sync_to_async(client.force_login)(user)
+
+        self.stdout.write(
+            f'{options["requests"]} requests per view, {options["concurrency"]} in flight'
+        )
+        self.stdout.write(f'  {"view":<18} {"":<6} {"p50 ms":>8} {"p99 ms":>8} {"req/s":>8} {"errors":>7}')
+        for name, sync_path, async_path in paths:
+            for variant, path in (('sync', sync_path), ('async', async_path)):
+                latencies, errors, elapsed = await self.measure(client, path, options)
+                self.stdout.write(
+                    f'  {name:<18} {variant:<6} {percentile(latencies, 0.5) * 1000:8.1f} '
+                    f'{percentile(latencies, 0.99) * 1000:8.1f} {len(latencies) / elapsed:8.0f} {errors:7d}'
+                )
+
+    async def measure(self, client, path, options):
+        """Issue the requests with bounded concurrency; returns latencies, error count and wall time"""
+        slots = asyncio.Semaphore(options['concurrency'])
+        latencies = []
+        errors = 0
+
+        async def one():
+            nonlocal errors
+            async with slots:
+                started = time.perf_counter()
+                response = await client.get(path)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    errors += 1
+
+        # Warm caches and connections before timing
+        await client.get(path)
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(options['requests'])))
+        return latencies, errors, time.perf_counter() - started
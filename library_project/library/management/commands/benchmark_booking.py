@@ -0,0 +1,113 @@
+import random
+import threading
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+from django.utils import timezone
+
+from library.booking import BookingError, RoomUnavailable, book_room, overlapping
+from library.models import Reservation, StudyRoom
+
+SLOT = timedelta(minutes=30)
+
+def naive_book(reservation):
+    """What reserve_room used to do: check for a conflict, then insert, without a lock"""
+    with transaction.atomic():
+        if overlapping(reservation.study_room_id, reservation.start_dt, reservation.end_dt).exists():
+            raise RoomUnavailable()
+        reservation.save()
+    return reservation
+
+def count_overlaps(room_ids):
+    """Pairs of reservations of the same room that overlap"""
+    overlaps = 0
+    for room_id in room_ids:
+        latest_end = None
+        for start_dt, end_dt in Reservation.objects.filter(study_room_id=room_id).order_by(
+            'start_dt'
+        ).values_list('start_dt', 'end_dt'):
+            if latest_end is not None and start_dt < latest_end:
+                overlaps += 1
+            latest_end = end_dt if latest_end is None else max(latest_end, end_dt)
+    return overlaps
+
+class Command(BaseCommand):
+    help = 'Books study rooms from many threads at once and checks that no reservations overlap'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=2, help='Rooms to book')
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent bookers')
+        parser.add_argument('--attempts', type=int, default=50, help='Booking attempts per thread')
+        parser.add_argument('--days', type=int, default=3, help='Days of slots to book into')
+        parser.add_argument(
+            '--strategy', choices=['engine', 'naive'], default='engine',
+            help='"engine" uses library.booking; "naive" checks then inserts without a lock',
+        )
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark rooms afterwards')
+
+    def handle(self, *args, **options):
+        book = book_room if options['strategy'] == 'engine' else naive_book
+        room_ids = [StudyRoom.objects.create(capacity=4).room_id for _ in range(options['rooms'])]
+        first_slot = timezone.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=1)
+        slots = options['days'] * 24 * 2
+
+        counts = {'booked': 0, 'taken': 0, 'retried': 0}
+        lock = threading.Lock()
+
+        def booker(seed):
+            rng = random.Random(seed)
+            try:
+                for _ in range(options['attempts']):
+                    start_dt = first_slot + SLOT * rng.randrange(slots)
+                    reservation = Reservation(
+                        topic_desc='Booking benchmark', group_size=1,
+                        study_room_id=rng.choice(room_ids),
+                        start_dt=start_dt, end_dt=start_dt + SLOT * rng.randint(2, 6),
+                    )
+                    while True:
+                        try:
+                            book(reservation)
+                            outcome = 'booked'
+                        except BookingError:
+                            outcome = 'taken'
+                        except OperationalError:
+                            # Lock wait timeouts, deadlocks, "database is locked"
+                            with lock:
+                                counts['retried'] += 1
+                            reservation.pk = None
+                            continue
+                        break
+                    with lock:
+                        counts[outcome] += 1
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=booker, args=(n,)) for n in range(options['threads'])]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        overlaps = count_overlaps(room_ids)
+        attempts = counts['booked'] + counts['taken']
+        self.stdout.write(
+            f'strategy={options["strategy"]} rooms={options["rooms"]} threads={options["threads"]}'
+        )
+        self.stdout.write(
+            f'  {attempts} attempts in {elapsed:.2f}s ({attempts / elapsed:.0f}/s): '
+            f'{counts["booked"]} booked ({counts["booked"] / elapsed:.0f} bookings/s), '
+            f'{counts["taken"]} refused, {counts["retried"]} retried errors'
+        )
+        self.stdout.write(f'  overlapping reservations={overlaps}')
+
+        if not options['keep']:
+            StudyRoom.objects.filter(room_id__in=room_ids).delete()
+
+        if overlaps:
+            self.stdout.write(self.style.ERROR('Benchmark complete: rooms were double-booked'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Benchmark complete'))
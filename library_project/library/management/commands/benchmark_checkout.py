@@ -0,0 +1,104 @@
+import contextlib
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+
+from library import deferred, metrics
+from library.checkout import CONFLICTS, CopyUnavailable, checkout_copy, supports_skip_locked
+from library.inventory import AVAILABLE, CHECKED_OUT, add_copies, set_copy_status
+from library.models import Book, BookCopy
+from library.versioning import ConcurrentUpdateError
+
+def naive_checkout(book_id):
+    """What borrow_book used to do: take the first available copy, unlocked"""
+    book_copy = BookCopy.objects.filter(book_id=book_id, status=AVAILABLE).order_by('copy_id').first()
+    if book_copy is None:
+        raise CopyUnavailable()
+    set_copy_status(book_copy, CHECKED_OUT)
+    return book_copy
+
+class Command(BaseCommand):
+    help = 'Measures checkout throughput with many threads borrowing copies of one hot title'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--copies', type=int, default=200, help='Copies of the hot title')
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent borrowers')
+        parser.add_argument(
+            '--strategy', choices=['engine', 'naive'], default='engine',
+            help='"engine" uses library.checkout; "naive" takes the first available copy without locking',
+        )
+        parser.add_argument(
+            '--hold-ms', type=float, default=0,
+            help='Work done in the transaction after the claim, like recording the rental and invoice'
+        )
+        parser.add_argument(
+            '--immediate-counters', action='store_true',
+            help='Update the book counters at the claim instead of deferring them to the commit'
+        )
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark book afterwards')
+
+    def handle(self, *args, **options):
+        checkout = checkout_copy if options['strategy'] == 'engine' else naive_checkout
+        book = Book.objects.create(book_name='Checkout benchmark', available_copies=0, total_copies=0)
+        add_copies(book, options['copies'])
+
+        claimed = []
+        retries = [0]
+        lock = threading.Lock()
+        hold = options['hold_ms'] / 1000
+        counters = contextlib.nullcontext if options['immediate_counters'] else deferred.collect
+
+        def borrower():
+            try:
+                while True:
+                    try:
+                        with transaction.atomic(), counters():
+                            book_copy = checkout(book.book_id)
+                            time.sleep(hold)
+                    except CopyUnavailable:
+                        return
+                    except (OperationalError, ConcurrentUpdateError):
+                        # Lock wait timeouts, deadlocks, "database is locked",
+                        # and naive reads whose copy changed before the write
+                        with lock:
+                            retries[0] += 1
+                        continue
+                    with lock:
+                        claimed.append(book_copy.copy_id)
+            finally:
+                connections.close_all()
+
+        conflicts_before = metrics.get(CONFLICTS)
+        workers = [threading.Thread(target=borrower) for _ in range(options['threads'])]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        book.refresh_from_db()
+        double_claims = len(claimed) - len(set(claimed))
+        self.stdout.write(
+            f'strategy={options["strategy"]} skip_locked={supports_skip_locked()} '
+            f'threads={options["threads"]} copies={options["copies"]} hold={options["hold_ms"]}ms '
+            f'counters={"immediate" if options["immediate_counters"] else "deferred"}'
+        )
+        self.stdout.write(
+            f'  checkouts={len(claimed)} in {elapsed:.2f}s ({len(claimed) / elapsed:.0f}/s), '
+            f'lost races={metrics.get(CONFLICTS) - conflicts_before}, retried errors={retries[0]}'
+        )
+        self.stdout.write(
+            f'  copies lent twice={double_claims}, available counter={book.available_copies} '
+            f'(expected {options["copies"] - len(set(claimed))})'
+        )
+
+        if not options['keep']:
+            book.delete()
+
+        if double_claims:
+            self.stdout.write(self.style.ERROR('Benchmark complete: copies were lent more than once'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Benchmark complete'))
@@ -0,0 +1,58 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from library.models import Book
+from library.search import search_books
+
+PAGE_SIZE = 12
+
+def legacy_search(query):
+    """The icontains/JOIN/DISTINCT query book_list used before the search index"""
+    books = Book.objects.filter(
+        Q(book_name__icontains=query) |
+        Q(authors__fname__icontains=query) |
+        Q(authors__lname__icontains=query) |
+        Q(topic__topic_name__icontains=query)
+    ).distinct()
+    return books.count(), list(books[:PAGE_SIZE])
+
+def indexed_search(query):
+    books = search_books(query)
+    return books.count(), list(books[:PAGE_SIZE])
+
+class Command(BaseCommand):
+    help = 'Compares catalog search latency of the full-text index against the legacy query'
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='*', help='Search terms to benchmark')
+        parser.add_argument('--iterations', type=int, default=20, help='Runs per query and strategy')
+
+    def handle(self, *args, **options):
+        queries = options['queries'] or self.sample_queries()
+        if not queries:
+            self.stdout.write(self.style.ERROR('No books found to build sample queries from'))
+            return
+
+        for query in queries:
+            self.stdout.write(f'Query "{query}"')
+            for label, strategy in (('legacy', legacy_search), ('indexed', indexed_search)):
+                timings = []
+                for _ in range(options['iterations']):
+                    started = time.perf_counter()
+                    total, _page = strategy(query)
+                    timings.append((time.perf_counter() - started) * 1000)
+                timings.sort()
+                p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+                self.stdout.write(
+                    f'  {label:<8} hits={total:<6} mean={statistics.mean(timings):.2f}ms '
+                    f'p50={statistics.median(timings):.2f}ms p95={p95:.2f}ms'
+                )
+
+        self.stdout.write(self.style.SUCCESS('Benchmark complete'))
+
+    def sample_queries(self):
+        """Use the first word of a few titles when no queries are given"""
+        titles = Book.objects.order_by('book_id').values_list('book_name', flat=True)[:3]
+        return [title.split()[0] for title in titles if title.split()]
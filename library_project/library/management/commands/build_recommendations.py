@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand
+from library.recommendations import TOP_K, build_recommendations
+
+class Command(BaseCommand):
+    help = 'Folds new rentals into the co-borrow matrix and refreshes book recommendations'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Rebuild from the whole rental history instead of only new rentals'
+        )
+        parser.add_argument(
+            '--top-k', type=int, default=TOP_K,
+            help='Recommendations stored per book'
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        run = build_recommendations(full=options['full'], top_k=options['top_k'])
+        elapsed = time.perf_counter() - started
+
+        if run is None:
+            self.stdout.write('No rentals queued since the last run')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {run.rentals_processed} rentals (highest #{run.last_rental_id}); '
+            f'refreshed recommendations for {run.books_updated} books in {elapsed:.2f}s'
+        ))
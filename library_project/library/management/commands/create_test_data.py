@@ -5,6 +5,7 @@ from library.models import (
     Book, Author, BookCopy, Customer, Rental, Invoice, Payment,
     Topic
 )
+from library.inventory import adjust_counters, set_copy_status
 from datetime import timedelta
 import random
 
@@ -46,19 +47,20 @@ class Command(BaseCommand):
         for i in range(10):
             book = Book.objects.create(
                 book_name=f'Test Book {i+1}',
-                topic=random.choice(topics),
-                isbn=f'978-{random.randint(100000, 999999)}-{random.randint(100, 999)}'
+                topic=random.choice(topics)
             )
             book.authors.add(random.choice(authors))
             books.append(book)
 
         # Create book copies
         for book in books:
-            for i in range(random.randint(2, 5)):
+            num_copies = random.randint(2, 5)
+            for i in range(num_copies):
                 BookCopy.objects.create(
                     book=book,
                     status='available'
                 )
+            adjust_counters(book.book_id, available=num_copies, total=num_copies)
 
         # Create customers
         customers = []
@@ -73,8 +75,7 @@ class Command(BaseCommand):
                 fname=f'Customer{i+1}',
                 lname='Test',
                 email=f'customer{i+1}@example.com',
-                phone=f'555-{random.randint(1000, 9999)}',
-                postal_code=f'{random.randint(10000, 99999)}'
+                phone=f'555-{random.randint(1000, 9999)}'
             )
             customers.append(customer)
 
@@ -98,8 +99,7 @@ class Command(BaseCommand):
                     exp_return_dt=exp_return_dt,
                     status='Borrowed'
                 )
-                book_copy.status = 'unavailable'
-                book_copy.save()
+                set_copy_status(book_copy, 'unavailable')
 
                 # Create invoice
                 invoice = Invoice.objects.create(
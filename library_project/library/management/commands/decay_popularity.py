@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from library import dashboard, leaderboard
+
+class Command(BaseCommand):
+    help = 'Drops checkouts that left the 7/30/365-day windows from the popular-books leaderboard; run daily'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lookback-days', type=int, default=leaderboard.DECAY_LOOKBACK_DAYS,
+            help='Days of expired checkouts to look for; raise it after missed runs'
+        )
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Rebuild the leaderboard from rental history instead'
+        )
+
+    def handle(self, *args, **options):
+        if options['lookback_days'] < 1:
+            raise CommandError('--lookback-days must be at least 1.')
+
+        with transaction.atomic():
+            if options['rebuild']:
+                ranked = leaderboard.rebuild()
+                message = f'Leaderboard rebuilt for {ranked} books'
+            else:
+                updated = leaderboard.decay(lookback=options['lookback_days'])
+                for window, books in updated.items():
+                    self.stdout.write(f'{window}: {books} books updated')
+                message = 'Leaderboard decayed'
+            dashboard.touch('popular_books')
+
+        self.stdout.write(self.style.SUCCESS(message))
@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
+from library.exhibitions import ExhibitionFull, RegistrationError, register
 from library.models import Event, Exhibition, Customer, ExhibitionAttendance
 
 class Command(BaseCommand):
@@ -18,36 +19,35 @@ class Command(BaseCommand):
             return
 
         exhibition = Exhibition.objects.get(event=exhibition_event)
-        current_attendees = exhibition.attendees.count()
+        current_attendees = exhibition.registered_count
         capacity = exhibition_event.attd_no
 
         if current_attendees >= capacity:
             self.stdout.write(self.style.SUCCESS(f'Exhibition "{exhibition_event.event_name}" is already full ({current_attendees}/{capacity})'))
             return
 
-        # Get all customers
-        customers = Customer.objects.all()
+        # Customers not registered yet
+        customers = Customer.objects.exclude(
+            cust_id__in=ExhibitionAttendance.objects.filter(exhibition=exhibition).values('customer_id')
+        )
         if not customers:
-            self.stdout.write(self.style.ERROR('No customers found in the database'))
+            self.stdout.write(self.style.ERROR('No unregistered customers found in the database'))
             return
 
-        # Register customers until capacity is reached
-        registrations_needed = capacity - current_attendees
+        # Register customers until the exhibition reports it is full
         registrations_made = 0
-
         for customer in customers:
-            if registrations_made >= registrations_needed:
+            try:
+                register(exhibition_event, customer)
+            except ExhibitionFull:
                 break
+            except RegistrationError as e:
+                self.stdout.write(self.style.ERROR(str(e)))
+                return
+            registrations_made += 1
 
-            # Check if customer is already registered
-            if not exhibition.attendees.filter(cust_id=customer.cust_id).exists():
-                ExhibitionAttendance.objects.create(
-                    exhibition=exhibition,
-                    customer=customer
-                )
-                registrations_made += 1
-
+        exhibition.refresh_from_db()
         self.stdout.write(self.style.SUCCESS(
             f'Successfully registered {registrations_made} customers for "{exhibition_event.event_name}"\n'
-            f'Current attendance: {current_attendees + registrations_made}/{capacity}'
-        )) 
\ No newline at end of file
+            f'Current attendance: {exhibition.registered_count}/{capacity}'
+        ))
@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from library.catalog_import import DEFAULT_BATCH_SIZE, CatalogImportError, CatalogImporter, read_rows
+
+class Command(BaseCommand):
+    help = 'Bulk imports books, authors, topics and copies from a CSV or JSON Lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import ("-" for stdin)')
+        parser.add_argument(
+            '--format', choices=['csv', 'jsonl'],
+            help='Input format (default: guessed from the file extension)'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Books written per transaction'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format']
+        if fmt is None:
+            extension = os.path.splitext(path)[1].lower()
+            fmt = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}.get(extension)
+            if fmt is None:
+                raise CommandError('Cannot guess the input format; pass --format')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        started = time.perf_counter()
+
+        def report(importer):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'{importer.books} books, {importer.copies} copies '
+                f'({importer.books / elapsed:.0f} rows/s)'
+            )
+
+        importer = CatalogImporter(batch_size=options['batch_size'], progress=report)
+        try:
+            if path == '-':
+                importer.run(read_rows(sys.stdin, fmt))
+            else:
+                with open(path, newline='', encoding='utf-8') as stream:
+                    importer.run(read_rows(stream, fmt))
+        except CatalogImportError as e:
+            raise CommandError(
+                f'Import stopped at {e}. {importer.books} books imported before it were kept.'
+            )
+        except OSError as e:
+            raise CommandError(str(e))
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {importer.books} books and {importer.copies} copies '
+            f'({importer.topics_created} new topics, {importer.authors_created} new authors) '
+            f'in {elapsed:.1f}s: {importer.books / elapsed if elapsed else 0:.0f} rows/s, '
+            f'{importer.copies / elapsed if elapsed else 0:.0f} copies/s'
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from library.idempotency import purge_expired
+
+class Command(BaseCommand):
+    help = 'Deletes idempotency keys whose TTL has passed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Keys deleted per statement'
+        )
+
+    def handle(self, *args, **options):
+        purged = purge_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Purged {purged} expired idempotency keys'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from library.search import REINDEX_BATCH_SIZE, rebuild_index
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search documents for every book'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=REINDEX_BATCH_SIZE,
+            help='Number of books reindexed per batch'
+        )
+
+    def handle(self, *args, **options):
+        indexed = 0
+        for indexed in rebuild_index(batch_size=options['batch_size']):
+            self.stdout.write(f'Indexed {indexed} books...')
+
+        self.stdout.write(self.style.SUCCESS(f'Search index rebuilt for {indexed} books'))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from library.inventory import recount_books
+from library.models import Book
+
+class Command(BaseCommand):
+    help = 'Recomputes the available/total copy counters on every book'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Number of books recounted per transaction'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        repaired = 0
+
+        while True:
+            bounds = list(
+                Book.objects.filter(book_id__gt=last_id)
+                .order_by('book_id')
+                .values_list('book_id', flat=True)[:batch_size]
+            )
+            if not bounds:
+                break
+
+            with transaction.atomic():
+                repaired += recount_books(
+                    Book.objects.filter(book_id__gte=bounds[0], book_id__lte=bounds[-1])
+                )
+            last_id = bounds[-1]
+            self.stdout.write(f'Recounted {repaired} books...')
+
+        self.stdout.write(self.style.SUCCESS(f'Copy counters repaired for {repaired} books'))
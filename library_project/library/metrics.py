@@ -0,0 +1,44 @@
+"""
+Lightweight operational counters.
+
+Counters live in the Django cache, so every worker process adds to the same
+totals when the cache is shared (Redis, Memcached, database cache). With the
+default local-memory cache they are per process. Modules declare their
+counters with ``register()`` so ``snapshot()`` can report them, zero or not.
+"""
+from django.core.cache import cache
+
+KEY_PREFIX = 'library:metrics:'
+
+_registered = []
+
+
+def register(*names):
+    for name in names:
+        if name not in _registered:
+            _registered.append(name)
+
+
+def incr(name, delta=1):
+    key = KEY_PREFIX + name
+    # add() is a no-op when the key exists, so concurrent first hits don't reset it
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # Evicted between add() and incr()
+        cache.set(key, delta, None)
+
+
+def get(name):
+    return cache.get(KEY_PREFIX + name, 0)
+
+
+def snapshot():
+    """Return ``{name: value}`` for every registered counter"""
+    values = cache.get_many([KEY_PREFIX + name for name in _registered])
+    return {name: values.get(KEY_PREFIX + name, 0) for name in _registered}
+
+
+def reset(*names):
+    cache.delete_many([KEY_PREFIX + name for name in (names or _registered)])
@@ -0,0 +1,93 @@
+# Generated by Django 4.2.21 on 2026-10-18 10:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+SQLITE_FTS_SQL = [
+    "CREATE VIRTUAL TABLE PJI_BOOK_SEARCH_FTS USING fts5("
+    "title, keywords, content='PJI_BOOK_SEARCH', content_rowid='PJI_BOOK_BOOK_ID')",
+    "CREATE TRIGGER PJI_BOOK_SEARCH_AI AFTER INSERT ON PJI_BOOK_SEARCH BEGIN "
+    "INSERT INTO PJI_BOOK_SEARCH_FTS(rowid, title, keywords) "
+    "VALUES (new.PJI_BOOK_BOOK_ID, new.TITLE, new.KEYWORDS); END",
+    "CREATE TRIGGER PJI_BOOK_SEARCH_AD AFTER DELETE ON PJI_BOOK_SEARCH BEGIN "
+    "INSERT INTO PJI_BOOK_SEARCH_FTS(PJI_BOOK_SEARCH_FTS, rowid, title, keywords) "
+    "VALUES ('delete', old.PJI_BOOK_BOOK_ID, old.TITLE, old.KEYWORDS); END",
+    "CREATE TRIGGER PJI_BOOK_SEARCH_AU AFTER UPDATE ON PJI_BOOK_SEARCH BEGIN "
+    "INSERT INTO PJI_BOOK_SEARCH_FTS(PJI_BOOK_SEARCH_FTS, rowid, title, keywords) "
+    "VALUES ('delete', old.PJI_BOOK_BOOK_ID, old.TITLE, old.KEYWORDS); "
+    "INSERT INTO PJI_BOOK_SEARCH_FTS(rowid, title, keywords) "
+    "VALUES (new.PJI_BOOK_BOOK_ID, new.TITLE, new.KEYWORDS); END",
+]
+
+SQLITE_FTS_DROP_SQL = [
+    "DROP TRIGGER IF EXISTS PJI_BOOK_SEARCH_AI",
+    "DROP TRIGGER IF EXISTS PJI_BOOK_SEARCH_AD",
+    "DROP TRIGGER IF EXISTS PJI_BOOK_SEARCH_AU",
+    "DROP TABLE IF EXISTS PJI_BOOK_SEARCH_FTS",
+]
+
+MYSQL_FULLTEXT_SQL = [
+    "ALTER TABLE PJI_BOOK_SEARCH ADD FULLTEXT INDEX PJI_BOOK_SEARCH_TITLE_FT (TITLE)",
+    "ALTER TABLE PJI_BOOK_SEARCH ADD FULLTEXT INDEX PJI_BOOK_SEARCH_DOC_FT (TITLE, KEYWORDS)",
+]
+
+MYSQL_FULLTEXT_DROP_SQL = [
+    "ALTER TABLE PJI_BOOK_SEARCH DROP INDEX PJI_BOOK_SEARCH_TITLE_FT",
+    "ALTER TABLE PJI_BOOK_SEARCH DROP INDEX PJI_BOOK_SEARCH_DOC_FT",
+]
+
+
+def create_fulltext_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    statements = {'mysql': MYSQL_FULLTEXT_SQL, 'sqlite': SQLITE_FTS_SQL}.get(vendor, [])
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+def drop_fulltext_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    statements = {'mysql': MYSQL_FULLTEXT_DROP_SQL, 'sqlite': SQLITE_FTS_DROP_SQL}.get(vendor, [])
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+def populate_search_documents(apps, schema_editor):
+    Book = apps.get_model('library', 'Book')
+    BookSearchDocument = apps.get_model('library', 'BookSearchDocument')
+
+    documents = []
+    for book in Book.objects.select_related('topic').prefetch_related('authors').iterator(chunk_size=500):
+        names = [f"{author.fname} {author.lname}" for author in book.authors.all()]
+        if book.topic is not None:
+            names.append(book.topic.topic_name)
+        documents.append(BookSearchDocument(book=book, title=book.book_name, keywords=' '.join(names)))
+        if len(documents) >= 500:
+            BookSearchDocument.objects.bulk_create(documents)
+            documents = []
+    BookSearchDocument.objects.bulk_create(documents)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0007_alter_bookcopy_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookSearchDocument',
+            fields=[
+                ('book', models.OneToOneField(db_column='PJI_BOOK_BOOK_ID', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='library.book')),
+                ('title', models.CharField(db_column='TITLE', max_length=100)),
+                ('keywords', models.TextField(db_column='KEYWORDS')),
+                ('updated_at', models.DateTimeField(auto_now=True, db_column='UPDATED_AT')),
+            ],
+            options={
+                'db_table': 'PJI_BOOK_SEARCH',
+                'managed': True,
+            },
+        ),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+        migrations.RunPython(populate_search_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.21 on 2026-10-18 10:54
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_copy_counters(apps, schema_editor):
+    Book = apps.get_model('library', 'Book')
+    BookCopy = apps.get_model('library', 'BookCopy')
+
+    def copy_count(**filters):
+        return Coalesce(Subquery(
+            BookCopy.objects.filter(book=OuterRef('pk'), **filters)
+            .order_by().values('book').annotate(count=Count('pk')).values('count')
+        ), 0)
+
+    Book.objects.update(
+        available_copies=copy_count(status='available'),
+        total_copies=copy_count(),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0008_book_search_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='available_copies',
+            field=models.PositiveIntegerField(db_column='AVAILABLE_COPIES', default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='total_copies',
+            field=models.PositiveIntegerField(db_column='TOTAL_COPIES', default=0),
+        ),
+        migrations.AddIndex(
+            model_name='bookcopy',
+            index=models.Index(fields=['book', 'status'], name='PJI_BOOK_COPY_BOOK_STATUS_IX'),
+        ),
+        migrations.RunPython(backfill_copy_counters, migrations.RunPython.noop),
+    ]
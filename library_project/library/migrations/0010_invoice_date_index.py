@@ -0,0 +1,17 @@
+# Generated by Django 4.2.21 on 2026-10-18 10:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0009_book_copy_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['invoice_date', 'invoice_id'], name='PJI_INVOICE_DATE_IX'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 4.2.21 on 2026-10-18 11:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0010_invoice_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendationRun',
+            fields=[
+                ('run_id', models.BigAutoField(db_column='RUN_ID', primary_key=True, serialize=False)),
+                ('last_rental_id', models.BigIntegerField(db_column='LAST_RENTAL_ID')),
+                ('rentals_processed', models.PositiveIntegerField(db_column='RENTALS_PROCESSED', default=0)),
+                ('books_updated', models.PositiveIntegerField(db_column='BOOKS_UPDATED', default=0)),
+                ('finished_at', models.DateTimeField(auto_now_add=True, db_column='FINISHED_AT')),
+            ],
+            options={
+                'db_table': 'PJI_RECOMMENDATION_RUN',
+                'managed': True,
+            },
+        ),
+        migrations.CreateModel(
+            name='BookRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField(db_column='RANK')),
+                ('score', models.FloatField(db_column='SCORE')),
+                ('book', models.ForeignKey(db_column='PJI_BOOK_BOOK_ID', on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='library.book')),
+                ('recommended', models.ForeignKey(db_column='RECOMMENDED_BOOK_ID', on_delete=django.db.models.deletion.CASCADE, related_name='+', to='library.book')),
+            ],
+            options={
+                'db_table': 'PJI_BOOK_RECOMMENDATION',
+                'ordering': ['book', 'rank'],
+                'managed': True,
+            },
+        ),
+        migrations.CreateModel(
+            name='BookCoBorrow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('customers', models.PositiveIntegerField(db_column='CUSTOMERS', default=0)),
+                ('book', models.ForeignKey(db_column='PJI_BOOK_BOOK_ID', on_delete=django.db.models.deletion.CASCADE, related_name='+', to='library.book')),
+                ('other_book', models.ForeignKey(db_column='OTHER_BOOK_ID', on_delete=django.db.models.deletion.CASCADE, related_name='+', to='library.book')),
+            ],
+            options={
+                'db_table': 'PJI_BOOK_CO_BORROW',
+                'managed': True,
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='bookrecommendation',
+            constraint=models.UniqueConstraint(fields=('book', 'rank'), name='PJI_BOOK_RECOMMENDATION_UQ'),
+        ),
+        migrations.AddConstraint(
+            model_name='bookcoborrow',
+            constraint=models.UniqueConstraint(fields=('book', 'other_book'), name='PJI_BOOK_CO_BORROW_UQ'),
+        ),
+    ]
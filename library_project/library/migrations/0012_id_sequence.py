@@ -0,0 +1,24 @@
+# Generated by Django 4.2.21 on 2026-10-18 11:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0011_book_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdSequence',
+            fields=[
+                ('name', models.CharField(db_column='SEQ_NAME', max_length=64, primary_key=True, serialize=False)),
+                ('next_hi', models.BigIntegerField(db_column='NEXT_HI')),
+            ],
+            options={
+                'db_table': 'PJI_ID_SEQUENCE',
+                'managed': True,
+            },
+        ),
+    ]
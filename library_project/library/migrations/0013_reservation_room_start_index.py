@@ -0,0 +1,17 @@
+# Generated by Django 4.2.21 on 2026-10-18 11:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0012_id_sequence'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['study_room', 'start_dt'], name='PJI_RESERVATION_ROOM_START_IX'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.21 on 2026-10-18 11:16
+
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def dedupe_and_count_registrations(apps, schema_editor):
+    Exhibition = apps.get_model('library', 'Exhibition')
+    ExhibitionAttendance = apps.get_model('library', 'ExhibitionAttendance')
+
+    # Keep the earliest of any duplicate registrations so the unique
+    # constraint can be added
+    duplicates = (
+        ExhibitionAttendance.objects.values('exhibition', 'customer')
+        .annotate(rows=Count('pk'), first=Min('pk'))
+        .filter(rows__gt=1)
+    )
+    for row in duplicates:
+        ExhibitionAttendance.objects.filter(
+            exhibition=row['exhibition'], customer=row['customer']
+        ).exclude(pk=row['first']).delete()
+
+    Exhibition.objects.update(registered_count=Coalesce(Subquery(
+        ExhibitionAttendance.objects.filter(exhibition=OuterRef('pk'))
+        .order_by().values('exhibition').annotate(count=Count('pk')).values('count')
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0013_reservation_room_start_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exhibition',
+            name='registered_count',
+            field=models.PositiveIntegerField(db_column='REGISTERED_COUNT', default=0),
+        ),
+        migrations.RunPython(dedupe_and_count_registrations, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='exhibitionattendance',
+            constraint=models.UniqueConstraint(fields=('exhibition', 'customer'), name='PJI_EXH_ATTD_UQ'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.21 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0014_exhibition_registered_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('key_hash', models.CharField(db_column='KEY_HASH', max_length=64, primary_key=True, serialize=False)),
+                ('request_hash', models.CharField(db_column='REQUEST_HASH', max_length=64)),
+                ('status_code', models.PositiveSmallIntegerField(db_column='STATUS_CODE', null=True)),
+                ('headers', models.TextField(db_column='HEADERS', default='{}')),
+                ('body', models.BinaryField(db_column='BODY', null=True)),
+                ('created_at', models.DateTimeField(db_column='CREATED_AT')),
+                ('expires_at', models.DateTimeField(db_column='EXPIRES_AT')),
+            ],
+            options={
+                'db_table': 'PJI_IDEMPOTENCY_KEY',
+                'managed': True,
+                'indexes': [models.Index(fields=['expires_at'], name='PJI_IDEMPOTENCY_EXPIRES_IX')],
+            },
+        ),
+    ]
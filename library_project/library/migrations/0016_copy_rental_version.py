@@ -0,0 +1,23 @@
+# Generated by Django 4.2.21 on 2026-10-18 11:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0015_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookcopy',
+            name='version',
+            field=models.PositiveIntegerField(db_column='VERSION', default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='rental',
+            name='version',
+            field=models.PositiveIntegerField(db_column='VERSION', default=0, editable=False),
+        ),
+    ]
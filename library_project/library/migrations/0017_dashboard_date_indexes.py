@@ -0,0 +1,25 @@
+# Generated by Django 4.2.21 on 2026-10-18 11:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0016_copy_rental_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(fields=['borrow_date'], name='PJI_RENTAL_BORROW_DATE_IX'),
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(fields=['actual_return_dt'], name='PJI_RENTAL_RETURN_DT_IX'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['start_dt'], name='PJI_RESERVATION_START_IX'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.21 on 2026-10-18 11:37
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0017_dashboard_date_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyLibraryStats',
+            fields=[
+                ('stat_id', models.BigAutoField(db_column='STAT_ID', primary_key=True, serialize=False)),
+                ('stat_date', models.DateField(db_column='STAT_DATE')),
+                ('slot', models.PositiveSmallIntegerField(db_column='SLOT', default=0)),
+                ('rentals_opened', models.IntegerField(db_column='RENTALS_OPENED', default=0)),
+                ('returns', models.IntegerField(db_column='RETURNS', default=0)),
+                ('lost', models.IntegerField(db_column='LOST', default=0)),
+                ('invoices_issued', models.IntegerField(db_column='INVOICES_ISSUED', default=0)),
+                ('revenue_invoiced', models.DecimalField(db_column='REVENUE_INVOICED', decimal_places=2, default=0, max_digits=14)),
+                ('payments_received', models.DecimalField(db_column='PAYMENTS_RECEIVED', decimal_places=2, default=0, max_digits=14)),
+                ('reservations', models.IntegerField(db_column='RESERVATIONS', default=0)),
+                ('exhibition_registrations', models.IntegerField(db_column='EXHIBITION_REGISTRATIONS', default=0)),
+            ],
+            options={
+                'db_table': 'PJI_DAILY_LIBRARY_STATS',
+                'managed': True,
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailylibrarystats',
+            constraint=models.UniqueConstraint(fields=('stat_date', 'slot'), name='PJI_DAILY_STATS_DATE_SLOT_UQ'),
+        ),
+        # Existing registrations have no known date; only new rows get one
+        migrations.AddField(
+            model_name='exhibitionattendance',
+            name='registered_at',
+            field=models.DateTimeField(blank=True, db_column='REGISTERED_AT', null=True),
+        ),
+        migrations.AlterField(
+            model_name='exhibitionattendance',
+            name='registered_at',
+            field=models.DateTimeField(blank=True, db_column='REGISTERED_AT', default=django.utils.timezone.now, null=True),
+        ),
+    ]
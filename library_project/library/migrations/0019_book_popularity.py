@@ -0,0 +1,46 @@
+# Generated by Django 4.2.21 on 2026-10-18 11:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0018_daily_library_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookPopularity',
+            fields=[
+                ('book', models.OneToOneField(db_column='PJI_BOOK_BOOK_ID', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularity', serialize=False, to='library.book')),
+                ('checkouts_7d', models.IntegerField(db_column='CHECKOUTS_7D', default=0)),
+                ('checkouts_30d', models.IntegerField(db_column='CHECKOUTS_30D', default=0)),
+                ('checkouts_365d', models.IntegerField(db_column='CHECKOUTS_365D', default=0)),
+            ],
+            options={
+                'db_table': 'PJI_BOOK_POPULARITY',
+                'managed': True,
+                'indexes': [models.Index(fields=['checkouts_7d', 'book'], name='PJI_BOOK_POPULARITY_7D_IX'), models.Index(fields=['checkouts_30d', 'book'], name='PJI_BOOK_POPULARITY_30D_IX'), models.Index(fields=['checkouts_365d', 'book'], name='PJI_BOOK_POPULARITY_365D_IX')],
+            },
+        ),
+        migrations.CreateModel(
+            name='BookDailyCheckouts',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checkout_date', models.DateField(db_column='CHECKOUT_DATE')),
+                ('checkouts', models.IntegerField(db_column='CHECKOUTS', default=0)),
+                ('book', models.ForeignKey(db_column='PJI_BOOK_BOOK_ID', on_delete=django.db.models.deletion.CASCADE, related_name='+', to='library.book')),
+            ],
+            options={
+                'db_table': 'PJI_BOOK_DAILY_CHECKOUTS',
+                'managed': True,
+                'indexes': [models.Index(fields=['checkout_date'], name='PJI_BOOK_DAILY_CHK_DATE_IX')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='bookdailycheckouts',
+            constraint=models.UniqueConstraint(fields=('book', 'checkout_date'), name='PJI_BOOK_DAILY_CHECKOUTS_UQ'),
+        ),
+    ]
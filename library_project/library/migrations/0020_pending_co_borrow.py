@@ -0,0 +1,48 @@
+# Generated by Django 4.2.21 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def queue_unfolded_rentals(apps, schema_editor):
+    """Queue the rentals past the last run's watermark.
+
+    Rentals below it that the watermark skipped stay missing until
+    ``build_recommendations --full``.
+    """
+    Rental = apps.get_model('library', 'Rental')
+    PendingCoBorrow = apps.get_model('library', 'PendingCoBorrow')
+    RecommendationRun = apps.get_model('library', 'RecommendationRun')
+
+    last_run = RecommendationRun.objects.order_by('-run_id').first()
+    rentals = Rental.objects.all()
+    if last_run is not None:
+        rentals = rentals.filter(rental_id__gt=last_run.last_rental_id)
+    pending = []
+    for rental_id in rentals.values_list('rental_id', flat=True).iterator(chunk_size=1000):
+        pending.append(PendingCoBorrow(rental_id=rental_id))
+        if len(pending) >= 1000:
+            PendingCoBorrow.objects.bulk_create(pending)
+            pending = []
+    PendingCoBorrow.objects.bulk_create(pending)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0019_book_popularity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingCoBorrow',
+            fields=[
+                ('rental', models.OneToOneField(db_column='PJI_RENTAL_RENTAL_ID', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='library.rental')),
+            ],
+            options={
+                'db_table': 'PJI_PENDING_CO_BORROW',
+                'managed': True,
+            },
+        ),
+        migrations.RunPython(queue_unfolded_rentals, migrations.RunPython.noop),
+    ]
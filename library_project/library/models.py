@@ -2,6 +2,8 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+from .versioning import VersionedModel
+
 class Topic(models.Model):
     """Maps to PJI_TOPIC table"""
     topic_id = models.BigAutoField(primary_key=True, db_column='TOPIC_ID')
@@ -49,6 +51,9 @@ class Book(models.Model):
         blank=True
     )
     authors = models.ManyToManyField(Author, through='BookAuthor')
+    # Denormalized copy counters, maintained by library.inventory
+    available_copies = models.PositiveIntegerField(default=0, db_column='AVAILABLE_COPIES')
+    total_copies = models.PositiveIntegerField(default=0, db_column='TOTAL_COPIES')
     
     class Meta:
         db_table = 'PJI_BOOK'
@@ -56,9 +61,19 @@ class Book(models.Model):
         
     def __str__(self):
         return self.book_name
-    
+
+    def save(self, *args, **kwargs):
+        # Counters only move through library.inventory; saving an already
+        # loaded book must not write back a stale copy of them.
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in ('available_copies', 'total_copies')
+            ]
+        super().save(*args, **kwargs)
+
     def available_copies_count(self):
-        return self.bookcopy_set.filter(status='available').count()
+        return self.available_copies
 
 class BookAuthor(models.Model):
     """Maps to PJI_BOOK_AUTHOR table"""
@@ -78,7 +93,27 @@ class BookAuthor(models.Model):
         managed = True
         unique_together = (('book', 'author'),)
 
-class BookCopy(models.Model):
+class BookSearchDocument(models.Model):
+    """Maps to PJI_BOOK_SEARCH table (full-text search document per book)"""
+    book = models.OneToOneField(
+        Book,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='search_document',
+        db_column='PJI_BOOK_BOOK_ID'
+    )
+    title = models.CharField(max_length=100, db_column='TITLE')
+    keywords = models.TextField(db_column='KEYWORDS')
+    updated_at = models.DateTimeField(auto_now=True, db_column='UPDATED_AT')
+
+    class Meta:
+        db_table = 'PJI_BOOK_SEARCH'
+        managed = True
+
+    def __str__(self):
+        return f"Search document for {self.title}"
+
+class BookCopy(VersionedModel, models.Model):
     """Maps to PJI_BOOK_COPY table"""
     STATUS_CHOICES = (
         ('available', 'Available'),
@@ -87,6 +122,7 @@ class BookCopy(models.Model):
     
     copy_id = models.BigAutoField(primary_key=True, db_column='COPY_ID')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, db_column='STATUS')
+    version = models.PositiveIntegerField(default=0, editable=False, db_column='VERSION')
     book = models.ForeignKey(
         Book, 
         on_delete=models.CASCADE, 
@@ -97,6 +133,9 @@ class BookCopy(models.Model):
         db_table = 'PJI_BOOK_COPY'
         managed = True
         verbose_name_plural = 'Book copies'
+        indexes = [
+            models.Index(fields=['book', 'status'], name='PJI_BOOK_COPY_BOOK_STATUS_IX'),
+        ]
         
     def __str__(self):
         return f"{self.book.book_name} (Copy #{self.copy_id})"
@@ -169,6 +208,8 @@ class Exhibition(models.Model):
     )
     expenses = models.DecimalField(max_digits=10, decimal_places=2, db_column='EXPENSES')
     attendees = models.ManyToManyField(Customer, through='ExhibitionAttendance')
+    # Number of PJI_EXH_ATTD rows, maintained by library.exhibitions
+    registered_count = models.PositiveIntegerField(default=0, db_column='REGISTERED_COUNT')
     
     class Meta:
         db_table = 'PJI_EXHIBITION'
@@ -194,10 +235,15 @@ class ExhibitionAttendance(models.Model):
         blank=True,
         db_column='PJI_CUSTOMER_CUST_ID'
     )
+    # Null for registrations made before the column existed
+    registered_at = models.DateTimeField(null=True, blank=True, default=timezone.now, db_column='REGISTERED_AT')
     
     class Meta:
         db_table = 'PJI_EXH_ATTD'
         managed = True
+        constraints = [
+            models.UniqueConstraint(fields=['exhibition', 'customer'], name='PJI_EXH_ATTD_UQ'),
+        ]
         
     def __str__(self):
         if self.exhibition and self.customer:
@@ -362,6 +408,10 @@ class Reservation(models.Model):
     class Meta:
         db_table = 'PJI_RESERVATION'
         managed = True
+        indexes = [
+            models.Index(fields=['study_room', 'start_dt'], name='PJI_RESERVATION_ROOM_START_IX'),
+            models.Index(fields=['start_dt'], name='PJI_RESERVATION_START_IX'),
+        ]
         
     def __str__(self):
         if self.customer and self.study_room:
@@ -377,6 +427,9 @@ class Invoice(models.Model):
     class Meta:
         db_table = 'PJI_INVOICE'
         managed = True
+        indexes = [
+            models.Index(fields=['invoice_date', 'invoice_id'], name='PJI_INVOICE_DATE_IX'),
+        ]
         
     def __str__(self):
         return f"Invoice #{self.invoice_id}"
@@ -415,7 +468,7 @@ class Payment(models.Model):
     def __str__(self):
         return f"Payment #{self.payment_id} ({self.payment_amt})"
 
-class Rental(models.Model):
+class Rental(VersionedModel, models.Model):
     """Maps to PJI_RENTAL table"""
     RENTAL_STATUS = (
         ('Borrowed', 'Borrowed'),
@@ -426,6 +479,7 @@ class Rental(models.Model):
     
     rental_id = models.BigAutoField(primary_key=True, db_column='RENTAL_ID')
     status = models.CharField(max_length=25, choices=RENTAL_STATUS, db_column='STATUS')
+    version = models.PositiveIntegerField(default=0, editable=False, db_column='VERSION')
     borrow_date = models.DateTimeField(db_column='BORROW_DATE')
     exp_return_dt = models.DateTimeField(db_column='EXP_RETURN_DT')
     actual_return_dt = models.DateTimeField(null=True, blank=True, db_column='ACTUAL_RETURN_DT')
@@ -454,6 +508,10 @@ class Rental(models.Model):
     class Meta:
         db_table = 'PJI_RENTAL'
         managed = True
+        indexes = [
+            models.Index(fields=['borrow_date'], name='PJI_RENTAL_BORROW_DATE_IX'),
+            models.Index(fields=['actual_return_dt'], name='PJI_RENTAL_RETURN_DT_IX'),
+        ]
         
     def __str__(self):
         if self.customer and self.book_copy:
@@ -473,4 +531,198 @@ class Rental(models.Model):
             days = (self.actual_return_dt - self.exp_return_dt).days
         else:
             days = (timezone.now() - self.exp_return_dt).days
-        return max(0, days)
\ No newline at end of file
+        return max(0, days)
+
+class BookCoBorrow(models.Model):
+    """Maps to PJI_BOOK_CO_BORROW table (distinct customers who borrowed both books).
+
+    Pairs are stored in both directions. The diagonal row (book, book) holds
+    the number of distinct customers who borrowed the book at all.
+    """
+    book = models.ForeignKey(
+        Book,
+        on_delete=models.CASCADE,
+        related_name='+',
+        db_column='PJI_BOOK_BOOK_ID'
+    )
+    other_book = models.ForeignKey(
+        Book,
+        on_delete=models.CASCADE,
+        related_name='+',
+        db_column='OTHER_BOOK_ID'
+    )
+    customers = models.PositiveIntegerField(default=0, db_column='CUSTOMERS')
+
+    class Meta:
+        db_table = 'PJI_BOOK_CO_BORROW'
+        managed = True
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'other_book'], name='PJI_BOOK_CO_BORROW_UQ'),
+        ]
+
+class BookRecommendation(models.Model):
+    """Maps to PJI_BOOK_RECOMMENDATION table (top-K co-borrowed books per book)"""
+    book = models.ForeignKey(
+        Book,
+        on_delete=models.CASCADE,
+        related_name='recommendations',
+        db_column='PJI_BOOK_BOOK_ID'
+    )
+    rank = models.PositiveSmallIntegerField(db_column='RANK')
+    recommended = models.ForeignKey(
+        Book,
+        on_delete=models.CASCADE,
+        related_name='+',
+        db_column='RECOMMENDED_BOOK_ID'
+    )
+    score = models.FloatField(db_column='SCORE')
+
+    class Meta:
+        db_table = 'PJI_BOOK_RECOMMENDATION'
+        managed = True
+        ordering = ['book', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'rank'], name='PJI_BOOK_RECOMMENDATION_UQ'),
+        ]
+
+    def __str__(self):
+        return f"{self.book_id} -> {self.recommended_id} (#{self.rank})"
+
+class BookDailyCheckouts(models.Model):
+    """Maps to PJI_BOOK_DAILY_CHECKOUTS table (rentals of a book borrowed on a day, see library.leaderboard)"""
+    book = models.ForeignKey(
+        Book,
+        on_delete=models.CASCADE,
+        related_name='+',
+        db_column='PJI_BOOK_BOOK_ID'
+    )
+    checkout_date = models.DateField(db_column='CHECKOUT_DATE')
+    checkouts = models.IntegerField(default=0, db_column='CHECKOUTS')
+
+    class Meta:
+        db_table = 'PJI_BOOK_DAILY_CHECKOUTS'
+        managed = True
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'checkout_date'], name='PJI_BOOK_DAILY_CHECKOUTS_UQ'),
+        ]
+        indexes = [
+            models.Index(fields=['checkout_date'], name='PJI_BOOK_DAILY_CHK_DATE_IX'),
+        ]
+
+    def __str__(self):
+        return f"{self.book_id} on {self.checkout_date}: {self.checkouts}"
+
+class BookPopularity(models.Model):
+    """Maps to PJI_BOOK_POPULARITY table (checkouts per book over rolling windows, see library.leaderboard)"""
+    book = models.OneToOneField(
+        Book,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='popularity',
+        db_column='PJI_BOOK_BOOK_ID'
+    )
+    checkouts_7d = models.IntegerField(default=0, db_column='CHECKOUTS_7D')
+    checkouts_30d = models.IntegerField(default=0, db_column='CHECKOUTS_30D')
+    checkouts_365d = models.IntegerField(default=0, db_column='CHECKOUTS_365D')
+
+    class Meta:
+        db_table = 'PJI_BOOK_POPULARITY'
+        managed = True
+        indexes = [
+            models.Index(fields=['checkouts_7d', 'book'], name='PJI_BOOK_POPULARITY_7D_IX'),
+            models.Index(fields=['checkouts_30d', 'book'], name='PJI_BOOK_POPULARITY_30D_IX'),
+            models.Index(fields=['checkouts_365d', 'book'], name='PJI_BOOK_POPULARITY_365D_IX'),
+        ]
+
+    def __str__(self):
+        return f"{self.book_id}: {self.checkouts_7d}/{self.checkouts_30d}/{self.checkouts_365d}"
+
+class PendingCoBorrow(models.Model):
+    """Maps to PJI_PENDING_CO_BORROW table (rentals not yet folded into the co-borrow counts, see library.recommendations)"""
+    rental = models.OneToOneField(
+        Rental,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='+',
+        db_column='PJI_RENTAL_RENTAL_ID'
+    )
+
+    class Meta:
+        db_table = 'PJI_PENDING_CO_BORROW'
+        managed = True
+
+    def __str__(self):
+        return f"Rental {self.rental_id} pending"
+
+class RecommendationRun(models.Model):
+    """Maps to PJI_RECOMMENDATION_RUN table (rentals folded into the co-borrow counts)"""
+    run_id = models.BigAutoField(primary_key=True, db_column='RUN_ID')
+    last_rental_id = models.BigIntegerField(db_column='LAST_RENTAL_ID')
+    rentals_processed = models.PositiveIntegerField(default=0, db_column='RENTALS_PROCESSED')
+    books_updated = models.PositiveIntegerField(default=0, db_column='BOOKS_UPDATED')
+    finished_at = models.DateTimeField(auto_now_add=True, db_column='FINISHED_AT')
+
+    class Meta:
+        db_table = 'PJI_RECOMMENDATION_RUN'
+        managed = True
+
+    def __str__(self):
+        return f"Recommendation run #{self.run_id} (highest rental {self.last_rental_id})"
+
+class IdSequence(models.Model):
+    """Maps to PJI_ID_SEQUENCE table (next unreserved id block per table, see library.ids)"""
+    name = models.CharField(max_length=64, primary_key=True, db_column='SEQ_NAME')
+    next_hi = models.BigIntegerField(db_column='NEXT_HI')
+
+    class Meta:
+        db_table = 'PJI_ID_SEQUENCE'
+        managed = True
+
+    def __str__(self):
+        return f"{self.name}: {self.next_hi}"
+
+class IdempotencyKey(models.Model):
+    """Maps to PJI_IDEMPOTENCY_KEY table (first response to a keyed request, see library.idempotency)"""
+    key_hash = models.CharField(max_length=64, primary_key=True, db_column='KEY_HASH')
+    request_hash = models.CharField(max_length=64, db_column='REQUEST_HASH')
+    # Null while the first request is still running
+    status_code = models.PositiveSmallIntegerField(null=True, db_column='STATUS_CODE')
+    headers = models.TextField(default='{}', db_column='HEADERS')
+    body = models.BinaryField(null=True, db_column='BODY')
+    created_at = models.DateTimeField(db_column='CREATED_AT')
+    expires_at = models.DateTimeField(db_column='EXPIRES_AT')
+
+    class Meta:
+        db_table = 'PJI_IDEMPOTENCY_KEY'
+        managed = True
+        indexes = [
+            models.Index(fields=['expires_at'], name='PJI_IDEMPOTENCY_EXPIRES_IX'),
+        ]
+
+    def __str__(self):
+        return f"{self.key_hash[:12]}... ({self.status_code or 'in progress'})"
+
+class DailyLibraryStats(models.Model):
+    """Maps to PJI_DAILY_LIBRARY_STATS table (activity per day and slot, see library.stats)"""
+    stat_id = models.BigAutoField(primary_key=True, db_column='STAT_ID')
+    stat_date = models.DateField(db_column='STAT_DATE')
+    # Writers spread over several rows per day; a day's figures are their sum
+    slot = models.PositiveSmallIntegerField(default=0, db_column='SLOT')
+    rentals_opened = models.IntegerField(default=0, db_column='RENTALS_OPENED')
+    returns = models.IntegerField(default=0, db_column='RETURNS')
+    lost = models.IntegerField(default=0, db_column='LOST')
+    invoices_issued = models.IntegerField(default=0, db_column='INVOICES_ISSUED')
+    revenue_invoiced = models.DecimalField(max_digits=14, decimal_places=2, default=0, db_column='REVENUE_INVOICED')
+    payments_received = models.DecimalField(max_digits=14, decimal_places=2, default=0, db_column='PAYMENTS_RECEIVED')
+    reservations = models.IntegerField(default=0, db_column='RESERVATIONS')
+    exhibition_registrations = models.IntegerField(default=0, db_column='EXHIBITION_REGISTRATIONS')
+
+    class Meta:
+        db_table = 'PJI_DAILY_LIBRARY_STATS'
+        managed = True
+        constraints = [
+            models.UniqueConstraint(fields=['stat_date', 'slot'], name='PJI_DAILY_STATS_DATE_SLOT_UQ'),
+        ]
+
+    def __str__(self):
+        return f"Stats for {self.stat_date} (slot {self.slot})"
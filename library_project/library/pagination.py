@@ -0,0 +1,273 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of ``OFFSET n`` plus a ``COUNT(*)``, each page is fetched with a
+``WHERE (sort_col, pk) > (last_sort_col, last_pk)`` predicate so deep pages
+cost the same as the first one. Cursors are opaque url-safe tokens holding
+the sort key of the page boundary and the paging direction.
+
+``KeysetPaginator`` serves the HTML list views; ``KeysetPagination`` plugs
+the same logic into DRF viewsets.
+"""
+import base64
+import binascii
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# Total row count modes
+COUNT_NONE = 'none'
+COUNT_EXACT = 'exact'
+COUNT_ESTIMATE = 'estimate'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def estimate_count(queryset):
+    """Return the planner's row estimate for a queryset, or None if unavailable.
+
+    Only MySQL exposes a cheap estimate: table statistics for an unfiltered
+    queryset, the EXPLAIN row estimate otherwise.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'mysql':
+        return None
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute(
+                "SELECT TABLE_ROWS FROM information_schema.TABLES "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+            return int(row[0]) if row and row[0] is not None else None
+
+        sql, params = queryset.order_by().query.sql_with_params()
+        cursor.execute('EXPLAIN ' + sql, params)
+        columns = [column[0].lower() for column in cursor.description]
+        row = cursor.fetchone()
+        if row is None or 'rows' not in columns:
+            return None
+        return int(row[columns.index('rows')] or 0)
+
+
+class KeysetPage:
+    """One page of results plus the cursors of its neighbours"""
+
+    def __init__(self, object_list, next_cursor, previous_cursor, total=None, total_is_estimate=False):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.total = total
+        self.total_is_estimate = total_is_estimate
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """Paginate a queryset on a unique ordering, e.g. ``('-invoice_date', '-invoice_id')``.
+
+    The last ordering field must be unique (normally the primary key) so
+    that every row has a distinct position. Fields may also name queryset
+    annotations, such as the search rank.
+    """
+
+    def __init__(self, queryset, per_page, ordering=('pk',), count=COUNT_NONE):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = [
+            (field[1:], True) if field.startswith('-') else (field, False)
+            for field in ordering
+        ]
+        self.count = count
+
+    def _model_field(self, name):
+        opts = self.queryset.model._meta
+        if name == 'pk':
+            return opts.pk
+        try:
+            return opts.get_field(name)
+        except FieldDoesNotExist:
+            return None
+
+    def _key(self, obj):
+        values = []
+        for name, _descending in self.ordering:
+            field = self._model_field(name)
+            values.append(getattr(obj, field.attname if field is not None else name))
+        return values
+
+    def encode_cursor(self, direction, key):
+        payload = json.dumps({'d': direction, 'k': key}, cls=DjangoJSONEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, token):
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+            direction, raw_key = payload['d'], payload['k']
+        except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError):
+            raise InvalidCursor(token)
+        if direction not in ('n', 'p') or not isinstance(raw_key, list) or len(raw_key) != len(self.ordering):
+            raise InvalidCursor(token)
+
+        key = []
+        for (name, _descending), value in zip(self.ordering, raw_key):
+            field = self._model_field(name)
+            if field is not None and value is not None:
+                try:
+                    value = field.to_python(value)
+                except ValidationError:
+                    raise InvalidCursor(token)
+            key.append(value)
+        return direction, key
+
+    def _after(self, key, forward):
+        """Q matching rows strictly after ``key`` in the paging direction"""
+        condition = Q()
+        equal = Q()
+        for (name, descending), value in zip(self.ordering, key):
+            greater = descending != forward
+            condition |= equal & Q(**{f"{name}__{'gt' if greater else 'lt'}": value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def _order(self, forward):
+        return [
+            ('-' if descending == forward else '') + name
+            for name, descending in self.ordering
+        ]
+
+    def _total(self):
+        if self.count == COUNT_EXACT:
+            return self.queryset.count(), False
+        if self.count == COUNT_ESTIMATE:
+            return estimate_count(self.queryset), True
+        return None, False
+
+    def page(self, cursor=None):
+        """Return the page a cursor points at (the first page when cursor is None)"""
+        if cursor:
+            direction, key = self.decode_cursor(cursor)
+        else:
+            direction, key = 'n', None
+        forward = direction == 'n'
+
+        queryset = self.queryset
+        if key is not None:
+            queryset = queryset.filter(self._after(key, forward))
+        rows = list(queryset.order_by(*self._order(forward))[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+
+        if forward:
+            has_next, has_previous = has_more, key is not None
+        else:
+            has_next, has_previous = True, has_more
+
+        next_cursor = self.encode_cursor('n', self._key(rows[-1])) if rows and has_next else None
+        previous_cursor = self.encode_cursor('p', self._key(rows[0])) if rows and has_previous else None
+        total, is_estimate = self._total()
+        return KeysetPage(rows, next_cursor, previous_cursor, total, is_estimate)
+
+    def get_page(self, cursor=None):
+        """Like ``page()`` but falls back to the first page on a bad cursor"""
+        try:
+            return self.page(cursor)
+        except InvalidCursor:
+            return self.page(None)
+
+
+class KeysetPagination(BasePagination):
+    """DRF pagination class backed by KeysetPaginator.
+
+    Views set ``keyset_ordering`` (or override ``get_keyset_ordering()``);
+    the default orders on the primary key.
+    """
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    count = COUNT_NONE
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_ordering(self, view):
+        if hasattr(view, 'get_keyset_ordering'):
+            return view.get_keyset_ordering()
+        return getattr(view, 'keyset_ordering', ('pk',))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        paginator = KeysetPaginator(
+            queryset,
+            self.get_page_size(request),
+            ordering=self.get_ordering(view),
+            count=getattr(view, 'keyset_count', self.count),
+        )
+        try:
+            self.page = paginator.page(request.query_params.get(self.cursor_query_param))
+        except InvalidCursor:
+            raise NotFound('Invalid cursor')
+        return list(self.page)
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        body = {
+            'next': self._link(self.page.next_cursor),
+            'previous': self._link(self.page.previous_cursor),
+        }
+        if self.page.total is not None:
+            body['count'] = self.page.total
+            body['count_is_estimate'] = self.page.total_is_estimate
+        body['results'] = data
+        return Response(body)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'count': {'type': 'integer'},
+                'count_is_estimate': {'type': 'boolean'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,245 @@
+"""
+"Customers who borrowed this also borrowed" recommendations.
+
+An offline job (``manage.py build_recommendations``) keeps an item-item
+co-occurrence matrix over rental history in PJI_BOOK_CO_BORROW. Only the
+non-zero cells are stored, each counting the distinct customers who borrowed
+both books. Neighbours are scored by cosine similarity,
+
+    score(a, b) = co(a, b) / sqrt(n(a) * n(b))
+
+where n(x) is the diagonal cell, i.e. how many customers borrowed x. The top
+K neighbours of each book go to PJI_BOOK_RECOMMENDATION, which pages read
+with a single lookup on its (book, rank) index.
+
+Runs are incremental. Saving a new rental also queues it in
+PJI_PENDING_CO_BORROW, in the same transaction. Each run folds in the
+queued rentals, re-ranks just the books whose scores moved, and removes
+the rentals it folded from the queue. Rental ids come from per-process
+blocks (see library.ids) and do not grow in commit order, so a "rentals
+above the last id seen" watermark would skip rentals with ids from an
+older block. The queue does not depend on id order. ``bulk_create``
+sends no signals, so after a bulk load of rentals, run
+``build_recommendations --full``.
+
+Runs take turns on a lock row in PJI_ID_SEQUENCE, which exists from the
+first run on, so two runs never fold the same queued rentals.
+"""
+import heapq
+import math
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import (
+    Book, BookCoBorrow, BookRecommendation, IdSequence, PendingCoBorrow, RecommendationRun, Rental,
+)
+
+TOP_K = getattr(settings, 'LIBRARY_RECOMMENDATIONS_TOP_K', 10)
+
+# Ids per IN (...) clause when reading or writing in bulk
+CHUNK_SIZE = 1000
+
+# PJI_ID_SEQUENCE row that runs lock; not a table name, so ids never use it
+RUN_LOCK = 'build_recommendations'
+
+
+def _chunks(values, size=CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _borrowings(**filters):
+    """Distinct (customer_id, book_id) pairs for the matching rentals"""
+    return Rental.objects.filter(
+        customer__isnull=False, book_copy__isnull=False, **filters
+    ).values_list('customer_id', 'book_copy__book_id').distinct()
+
+
+def count_new_borrowings(rental_ids=None):
+    """Return the co-borrow deltas contributed by the given queued rentals.
+
+    A customer counts once per pair of books, so a rental only adds to the
+    matrix when it is the customer's first borrowing of that book. The
+    customer's history is their rentals that are no longer queued. With no
+    ``rental_ids`` every rental is new and there is no history (a full
+    rebuild).
+    """
+    new_books = defaultdict(set)
+    if rental_ids is None:
+        pairs = _borrowings()
+    else:
+        pairs = (pair for ids in _chunks(rental_ids) for pair in _borrowings(rental_id__in=ids))
+    for customer_id, book_id in pairs:
+        new_books[customer_id].add(book_id)
+
+    history = defaultdict(set)
+    if rental_ids is not None:
+        folded = _borrowings().filter(~Exists(PendingCoBorrow.objects.filter(rental_id=OuterRef('rental_id'))))
+        for customers in _chunks(new_books):
+            for customer_id, book_id in folded.filter(customer_id__in=customers):
+                history[customer_id].add(book_id)
+
+    deltas = Counter()
+    for customer_id, books in new_books.items():
+        seen = history[customer_id]
+        fresh = sorted(books - seen)
+        for position, book_id in enumerate(fresh):
+            deltas[book_id, book_id] += 1
+            for other_id in seen:
+                deltas[book_id, other_id] += 1
+                deltas[other_id, book_id] += 1
+            for other_id in fresh[position + 1:]:
+                deltas[book_id, other_id] += 1
+                deltas[other_id, book_id] += 1
+    return deltas
+
+
+def apply_deltas(deltas):
+    """Add co-borrow deltas to the stored matrix"""
+    by_book = defaultdict(dict)
+    for (book_id, other_id), delta in deltas.items():
+        by_book[book_id][other_id] = delta
+
+    existing_books = set()
+    for book_ids in _chunks(by_book):
+        existing_books.update(Book.objects.filter(book_id__in=book_ids).values_list('book_id', flat=True))
+
+    for book_ids in _chunks(existing_books):
+        changed, created = [], []
+        current = {
+            (row.book_id, row.other_book_id): row
+            for row in BookCoBorrow.objects.filter(book_id__in=book_ids)
+        }
+        for book_id in book_ids:
+            for other_id, delta in by_book[book_id].items():
+                if other_id not in existing_books:
+                    continue
+                row = current.get((book_id, other_id))
+                if row is None:
+                    created.append(BookCoBorrow(book_id=book_id, other_book_id=other_id, customers=delta))
+                else:
+                    row.customers += delta
+                    changed.append(row)
+        BookCoBorrow.objects.bulk_update(changed, ['customers'], batch_size=CHUNK_SIZE)
+        BookCoBorrow.objects.bulk_create(created, batch_size=CHUNK_SIZE)
+
+
+def rank_neighbours(book_ids, top_k=TOP_K):
+    """Recompute the stored top-K recommendations of the given books"""
+    for chunk in _chunks(book_ids):
+        cells = defaultdict(list)
+        for book_id, other_id, customers in BookCoBorrow.objects.filter(
+            book_id__in=chunk
+        ).values_list('book_id', 'other_book_id', 'customers'):
+            cells[book_id].append((other_id, customers))
+
+        neighbours = {other_id for row in cells.values() for other_id, _ in row}
+        borrowers = {}
+        for ids in _chunks(neighbours | set(chunk)):
+            borrowers.update(
+                BookCoBorrow.objects.filter(book_id__in=ids, other_book_id=F('book_id'))
+                .values_list('book_id', 'customers')
+            )
+
+        recommendations = []
+        for book_id in chunk:
+            own = borrowers.get(book_id)
+            if not own:
+                continue
+            scored = (
+                (customers / math.sqrt(own * borrowers[other_id]), -other_id)
+                for other_id, customers in cells[book_id]
+                if other_id != book_id and borrowers.get(other_id)
+            )
+            for rank, (score, negated_id) in enumerate(heapq.nlargest(top_k, scored), start=1):
+                recommendations.append(BookRecommendation(
+                    book_id=book_id, rank=rank, recommended_id=-negated_id, score=score
+                ))
+
+        BookRecommendation.objects.filter(book_id__in=chunk).delete()
+        BookRecommendation.objects.bulk_create(recommendations, batch_size=CHUNK_SIZE)
+
+
+def _lock_runs():
+    """Hold the run lock row until the transaction ends, creating it on the first run"""
+    while True:
+        # A no-op UPDATE locks the row on every backend
+        if IdSequence.objects.filter(name=RUN_LOCK).update(next_hi=F('next_hi')):
+            return
+        try:
+            with transaction.atomic():
+                IdSequence.objects.create(name=RUN_LOCK, next_hi=0)
+        except IntegrityError:
+            # Another run created it first; wait for its lock
+            pass
+
+
+def build_recommendations(full=False, top_k=TOP_K):
+    """Fold queued rentals into the matrix and refresh the affected recommendations.
+
+    With ``full`` the matrix is rebuilt from the whole rental history.
+    Returns the RecommendationRun recorded, or None when there was nothing new.
+    """
+    with transaction.atomic():
+        # One run at a time
+        _lock_runs()
+        if full:
+            PendingCoBorrow.objects.all().delete()
+            BookCoBorrow.objects.all().delete()
+            BookRecommendation.objects.all().delete()
+            rental_ids = None
+            processed = Rental.objects.count()
+            last_rental_id = Rental.objects.order_by('-rental_id').values_list('rental_id', flat=True).first()
+        else:
+            # Rentals queued after this read wait for the next run
+            rental_ids = list(PendingCoBorrow.objects.order_by('rental_id').values_list('rental_id', flat=True))
+            if not rental_ids:
+                return None
+            processed = len(rental_ids)
+            last_rental_id = rental_ids[-1]
+
+        deltas = count_new_borrowings(rental_ids)
+        apply_deltas(deltas)
+
+        # A book's scores move when one of its cells changes or when a
+        # neighbour gains borrowers (the neighbour's n(b) term changed)
+        affected = {book_id for book_id, _other in deltas}
+        grown = {book_id for book_id, other_id in deltas if book_id == other_id}
+        for ids in _chunks(grown):
+            affected.update(
+                BookCoBorrow.objects.filter(other_book_id__in=ids).values_list('book_id', flat=True)
+            )
+        rank_neighbours(sorted(affected), top_k)
+
+        for ids in _chunks(rental_ids or []):
+            PendingCoBorrow.objects.filter(rental_id__in=ids).delete()
+
+        return RecommendationRun.objects.create(
+            last_rental_id=last_rental_id or 0,
+            rentals_processed=processed,
+            books_updated=len(affected),
+        )
+
+
+def recommendations_for(book_id):
+    """The stored recommendations of a book, best first (one indexed lookup)"""
+    return BookRecommendation.objects.filter(book_id=book_id).order_by('rank')
+
+
+def recommended_books(book_id, limit=TOP_K):
+    return [
+        recommendation.recommended
+        for recommendation in recommendations_for(book_id).select_related('recommended')[:limit]
+    ]
+
+
+@receiver(post_save, sender=Rental)
+def queue_new_rental(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        PendingCoBorrow.objects.create(rental_id=instance.rental_id)
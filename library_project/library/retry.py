@@ -0,0 +1,223 @@
+"""
+Transactions that retry on lock conflicts.
+
+Views opt in with ``@transactional``. It runs the view in
+``transaction.atomic()``. When the database reports a retriable conflict,
+it rolls back and runs the view again, up to the policy's attempt limit.
+Retriable conflicts are a MySQL deadlock (1213), a MySQL lock wait timeout
+(1205), SQLite's "database is locked", or a lost versioned transition
+(``ConcurrentUpdateError``, see library.versioning). Read-only requests
+(GET, HEAD, OPTIONS by default) skip the transaction entirely.
+
+Waits between attempts use full jitter: a random delay between zero and an
+exponentially growing cap. Transactions that collided therefore don't
+collide again in lockstep. The waits block the worker, so two limits keep
+a burst of deadlocks from stalling the pool:
+
+* ``max_delay`` caps every single wait.
+* A process-wide retry budget allows retries only while they stay a small
+  fraction of the transactional calls. Once the budget runs out, conflicts
+  fail immediately instead of queueing up behind sleeps.
+
+Policies have defaults. The ``LIBRARY_RETRY`` setting overrides them for
+every view. ``LIBRARY_RETRY_POLICIES`` overrides them for one view, keyed by
+name: the view's ``module.function`` unless the decorator names it.
+Decorator arguments override both.
+
+Retries, exhausted attempts, budget refusals and the time lost to failed
+attempts and waits are reported through ``library.metrics``.
+"""
+import functools
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+
+from . import deferred, metrics
+from .versioning import ConcurrentUpdateError
+
+logger = logging.getLogger(__name__)
+
+# 1213: Deadlock found when trying to get lock
+# 1205: Lock wait timeout exceeded
+RETRIABLE_MYSQL_ERRORS = (1213, 1205)
+
+READ_ONLY_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+DEFAULTS = {
+    'attempts': 3,       # Total runs, the first one included
+    'base_delay': 0.02,  # Seconds; cap of the first wait
+    'max_delay': 0.25,   # Seconds; cap of any wait
+}
+
+RETRIES = 'retry.retries'
+EXHAUSTED = 'retry.exhausted'
+BUDGET_DENIED = 'retry.budget_denied'
+WASTED_MS = 'retry.wasted_ms'
+metrics.register(RETRIES, EXHAUSTED, BUDGET_DENIED, WASTED_MS)
+
+
+def error_code(exc):
+    """The numeric MySQL error code of a database exception, if it has one"""
+    args = getattr(exc, 'args', None)
+    if args:
+        try:
+            return int(args[0])
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+def is_retriable(exc):
+    if isinstance(exc, ConcurrentUpdateError):
+        return True
+    if not isinstance(exc, DatabaseError):
+        return False
+    if error_code(exc) in RETRIABLE_MYSQL_ERRORS:
+        return True
+    return 'database is locked' in str(exc)
+
+
+class RetryBudget:
+    """Token bucket that limits retries to a fraction of calls.
+
+    Each call deposits ``ratio`` tokens and each retry spends one, so in
+    steady state at most ``ratio`` retries happen per call. ``reserve``
+    tokens (also the bucket's capacity) let a quiet process absorb a short
+    burst of conflicts.
+    """
+
+    def __init__(self, ratio=0.2, reserve=10):
+        self.ratio = ratio
+        self.reserve = reserve
+        self._tokens = float(reserve)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.reserve, self._tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+budget = RetryBudget(
+    ratio=getattr(settings, 'LIBRARY_RETRY_BUDGET_RATIO', 0.2),
+    reserve=getattr(settings, 'LIBRARY_RETRY_BUDGET_RESERVE', 10),
+)
+
+
+def policy_for(name, **overrides):
+    policy = dict(DEFAULTS)
+    policy.update(getattr(settings, 'LIBRARY_RETRY', {}))
+    policy.update(getattr(settings, 'LIBRARY_RETRY_POLICIES', {}).get(name, {}))
+    policy.update({key: value for key, value in overrides.items() if value is not None})
+    return policy
+
+
+def backoff(attempt, base_delay, max_delay):
+    """Full-jitter wait before the given retry (1 for the first)"""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+def _record_waste(started):
+    """Add the time since ``started`` (a failed attempt and its wait) to WASTED_MS"""
+    metrics.incr(WASTED_MS, int((time.perf_counter() - started) * 1000))
+
+
+def run_in_transaction(func, *args, name=None, attempts=None, base_delay=None, max_delay=None, **kwargs):
+    """Call ``func`` inside ``transaction.atomic()``, retrying on lock conflicts.
+
+    Inside an enclosing transaction a conflict has already rolled that
+    transaction back, so nothing can be retried here; the call simply joins
+    the outer transaction.
+    """
+    if connection.in_atomic_block:
+        with transaction.atomic():
+            return func(*args, **kwargs)
+
+    name = name or f'{func.__module__}.{func.__qualname__}'
+    policy = policy_for(name, attempts=attempts, base_delay=base_delay, max_delay=max_delay)
+    budget.deposit()
+    attempt = 1
+    while True:
+        started = time.perf_counter()
+        try:
+            # Hot-row counter updates run last, just before the commit
+            with transaction.atomic(), deferred.collect():
+                return func(*args, **kwargs)
+        except (DatabaseError, ConcurrentUpdateError) as e:
+            if not is_retriable(e):
+                raise
+            if attempt >= policy['attempts']:
+                _record_waste(started)
+                metrics.incr(EXHAUSTED)
+                logger.error('%s: giving up after %d attempts: %s', name, attempt, e)
+                raise
+            if not budget.withdraw():
+                _record_waste(started)
+                metrics.incr(BUDGET_DENIED)
+                logger.error('%s: retry budget exhausted, not retrying: %s', name, e)
+                raise
+            delay = backoff(attempt, policy['base_delay'], policy['max_delay'])
+            logger.warning(
+                '%s: database conflict (%s), retry %d/%d in %.3fs',
+                name, error_code(e) or e, attempt, policy['attempts'] - 1, delay,
+            )
+            time.sleep(delay)
+            _record_waste(started)
+            metrics.incr(RETRIES)
+            attempt += 1
+
+
+def transactional(view=None, *, name=None, attempts=None, base_delay=None, max_delay=None,
+                  read_only_methods=READ_ONLY_METHODS):
+    """Run a function view in a retrying transaction unless the request is read-only.
+
+    Use bare (``@transactional``) or with per-view settings
+    (``@transactional(attempts=5)``). Views that write on GET pass
+    ``read_only_methods=()``.
+    """
+    def decorator(view_func):
+        view_name = name or f'{view_func.__module__}.{view_func.__qualname__}'
+
+        @functools.wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method in read_only_methods:
+                return view_func(request, *args, **kwargs)
+            return run_in_transaction(
+                view_func, request, *args, name=view_name, attempts=attempts,
+                base_delay=base_delay, max_delay=max_delay, **kwargs
+            )
+        return wrapper
+
+    if view is not None:
+        return decorator(view)
+    return decorator
+
+
+class TransactionalViewSetMixin:
+    """Run a viewset's unsafe methods in a retrying transaction.
+
+    Per-viewset settings go in ``retry_policy``, e.g.
+    ``retry_policy = {'attempts': 5}``.
+    """
+    retry_policy = {}
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method in READ_ONLY_METHODS:
+            return super().dispatch(request, *args, **kwargs)
+        # Buffer the body so a retried attempt can parse it again
+        request.body
+        return run_in_transaction(
+            super().dispatch, request, *args,
+            name=f'{type(self).__module__}.{type(self).__qualname__}',
+            **self.retry_policy, **kwargs
+        )
@@ -0,0 +1,293 @@
+"""
+Full-text search over the book catalog.
+
+Every book has a row in PJI_BOOK_SEARCH holding its title and a keyword blob
+(author names and topic). The row is kept current by the signal handlers at
+the bottom of this module. The database indexes that table for full-text
+lookup:
+
+* MySQL uses FULLTEXT indexes on (TITLE) and (TITLE, KEYWORDS).
+* SQLite uses an FTS5 table kept in sync by triggers (see migration 0008).
+* Any other backend falls back to a LIKE match on the search document.
+
+Searches filter, rank and order in one query, and no id list goes through
+Python. On MySQL the books are joined once to a derived table of the hits
+and their scores, computed by one full-text search; a correlated lookup
+would run the search again for every hit, since every hit is ranked
+before the LIMIT. On SQLite each hit's score is a correlated lookup by
+rowid, which is a seek in the FTS5 table.
+"""
+import re
+
+from django.db import connection, transaction
+from django.db.models import Case, F, FloatField, Func, OuterRef, Q, Subquery, Value, When
+from django.db.models.expressions import Expression, RawSQL
+from django.db.models.sql.constants import INNER
+from django.db.models.sql.datastructures import Join
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Author, Book, BookAuthor, BookSearchDocument, Topic
+
+FTS_TABLE = 'PJI_BOOK_SEARCH_FTS'
+
+# Books reindexed per batch during bulk rebuilds
+REINDEX_BATCH_SIZE = 500
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    """Split a user query into lower-case search terms"""
+    return _TOKEN_RE.findall(query.lower())
+
+
+def build_document(book):
+    """Return the (title, keywords) pair indexed for a book.
+
+    Expects ``topic`` and ``authors`` to be loaded already when called in bulk.
+    """
+    names = [f"{author.fname} {author.lname}" for author in book.authors.all()]
+    if book.topic is not None:
+        names.append(book.topic.topic_name)
+    return book.book_name, ' '.join(names)
+
+
+def reindex_books(book_ids):
+    """Rebuild the search documents of the given books.
+
+    Books that no longer exist simply lose their document.
+    """
+    book_ids = list({int(pk) for pk in book_ids})
+    for start in range(0, len(book_ids), REINDEX_BATCH_SIZE):
+        batch = book_ids[start:start + REINDEX_BATCH_SIZE]
+        books = Book.objects.filter(book_id__in=batch).select_related(
+            'topic'
+        ).prefetch_related('authors')
+
+        documents = []
+        for book in books:
+            title, keywords = build_document(book)
+            documents.append(BookSearchDocument(book=book, title=title, keywords=keywords))
+
+        BookSearchDocument.objects.filter(book_id__in=batch).delete()
+        BookSearchDocument.objects.bulk_create(documents)
+
+
+def rebuild_index(batch_size=REINDEX_BATCH_SIZE):
+    """Reindex the whole catalog, yielding the running count of books indexed"""
+    last_id = 0
+    indexed = 0
+    while True:
+        batch = list(
+            Book.objects.filter(book_id__gt=last_id)
+            .order_by('book_id')
+            .values_list('book_id', flat=True)[:batch_size]
+        )
+        if not batch:
+            break
+        reindex_books(batch)
+        last_id = batch[-1]
+        indexed += len(batch)
+        yield indexed
+
+
+class _IndexRank(Func):
+    """Score of the outer query's book from a correlated lookup in the index (SQLite FTS5 by rowid)"""
+    output_field = FloatField()
+
+    def __init__(self, sql, params):
+        super().__init__(F('book_id'))
+        self.sql = sql
+        self.params = params
+
+    def as_sql(self, compiler, connection, **extra_context):
+        book_id, book_id_params = compiler.compile(self.source_expressions[0])
+        return f'({self.sql.format(book_id=book_id)})', [*self.params, *book_id_params]
+
+
+class _HitScore(Expression):
+    """The SCORE column of an _IndexHits join"""
+    output_field = FloatField()
+
+    def __init__(self, alias):
+        super().__init__()
+        self.alias = alias
+
+    def as_sql(self, compiler, connection):
+        return f'{compiler.quote_name_unless_alias(self.alias)}.SCORE', []
+
+    def relabeled_clone(self, change_map):
+        return self.__class__(change_map.get(self.alias, self.alias))
+
+    def get_group_by_cols(self):
+        return [self]
+
+
+class _IndexHits(Join):
+    """INNER JOIN of the books to a derived table of (PJI_BOOK_BOOK_ID, SCORE) index hits"""
+
+    def __init__(self, sql, params, parent_alias=None, table_alias=None):
+        self.sql = sql
+        self.params = tuple(params)
+        self.table_name = 'search_hits'
+        self.parent_alias = parent_alias
+        self.table_alias = table_alias
+        self.join_type = INNER
+        self.join_field = None
+        self.nullable = False
+        self.filtered_relation = None
+
+    def as_sql(self, compiler, connection):
+        qn = compiler.quote_name_unless_alias
+        book_id = connection.ops.quote_name(Book._meta.pk.column)
+        return (
+            f'INNER JOIN ({self.sql}) {qn(self.table_alias)} '
+            f'ON ({qn(self.table_alias)}.PJI_BOOK_BOOK_ID = {qn(self.parent_alias)}.{book_id})',
+            list(self.params),
+        )
+
+    def relabeled_clone(self, change_map):
+        return self.__class__(
+            self.sql, self.params,
+            change_map.get(self.parent_alias, self.parent_alias),
+            change_map.get(self.table_alias, self.table_alias),
+        )
+
+    @property
+    def identity(self):
+        return self.__class__, self.sql, self.params, self.parent_alias
+
+    def annotate(self, queryset, name):
+        """``queryset`` restricted to the hits and annotated with their score as ``name``"""
+        queryset = queryset.all()
+        query = queryset.query
+        alias = query.join(self.relabeled_clone({None: query.get_initial_alias()}))
+        return queryset.annotate(**{name: _HitScore(alias)})
+
+
+def _mysql_index(terms):
+    expression = ' '.join(f'+{term}*' for term in terms)
+    match = "MATCH(TITLE, KEYWORDS) AGAINST (%s IN BOOLEAN MODE)"
+    matches = RawSQL(f"SELECT PJI_BOOK_BOOK_ID FROM PJI_BOOK_SEARCH WHERE {match}", [expression])
+    # Title hits weigh twice as much
+    rank = _IndexHits(
+        f"SELECT PJI_BOOK_BOOK_ID, MATCH(TITLE) AGAINST (%s IN BOOLEAN MODE) * 2 + {match} AS SCORE "
+        f"FROM PJI_BOOK_SEARCH WHERE {match}",
+        [expression, expression, expression],
+    )
+    return matches, rank
+
+
+def _sqlite_index(terms):
+    expression = ' '.join('"{}"*'.format(term.replace('"', '')) for term in terms)
+    matches = RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [expression])
+    # bm25() scores better matches lower; title hits weigh twice as much
+    rank = _IndexRank(
+        f"SELECT -bm25({FTS_TABLE}, 2.0, 1.0) FROM {FTS_TABLE} "
+        f"WHERE {FTS_TABLE} MATCH %s AND rowid = {{book_id}}",
+        [expression],
+    )
+    return matches, rank
+
+
+def _fallback_index(terms):
+    documents = BookSearchDocument.objects.all()
+    for term in terms:
+        documents = documents.filter(Q(title__icontains=term) | Q(keywords__icontains=term))
+    score = sum(
+        Case(When(title__icontains=term, then=Value(2.0)), default=Value(1.0), output_field=FloatField())
+        for term in terms
+    )
+    rank = Subquery(documents.filter(book_id=OuterRef('book_id')).annotate(score=score).values('score'))
+    return documents.values('book_id'), rank
+
+
+def _index(terms):
+    """(ids of the matching books, rank) for a list of search terms.
+
+    The rank is an expression scoring one book, or on MySQL the join to the
+    scored hits.
+    """
+    if connection.vendor == 'mysql':
+        return _mysql_index(terms)
+    if connection.vendor == 'sqlite':
+        return _sqlite_index(terms)
+    return _fallback_index(terms)
+
+
+def matching_book_ids(query):
+    """A subquery of the ids of every book matching a query, for ``book_id__in``"""
+    terms = tokenize(query)
+    if not terms:
+        return Book.objects.none().values('book_id')
+    return _index(terms)[0]
+
+
+def search_books(query, queryset=None):
+    """Filter a Book queryset down to index hits, ordered by relevance.
+
+    The returned queryset carries a ``search_rank`` annotation, computed by
+    the database for each hit, so every match is returned and the caller's
+    slice is the only limit.
+    """
+    if queryset is None:
+        queryset = Book.objects.all()
+    terms = tokenize(query)
+    if not terms:
+        # Keep the annotation; callers order on it
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField())).none()
+    matches, rank = _index(terms)
+    if isinstance(rank, _IndexHits):
+        queryset = rank.annotate(queryset, 'search_rank')
+    else:
+        queryset = queryset.filter(book_id__in=matches).annotate(search_rank=rank)
+    return queryset.order_by('-search_rank', 'book_id')
+
+
+# Incremental reindexing
+
+@receiver(post_save, sender=Book)
+def reindex_saved_book(sender, instance, raw=False, **kwargs):
+    if not raw:
+        reindex_books([instance.book_id])
+
+@receiver(post_save, sender=BookAuthor)
+def reindex_book_author(sender, instance, raw=False, **kwargs):
+    if not raw:
+        reindex_books([instance.book_id])
+
+@receiver(post_delete, sender=BookAuthor)
+def reindex_removed_book_author(sender, instance, **kwargs):
+    # Deferred: when the book itself is being deleted, reindexing here would
+    # recreate its document in the middle of the cascade.
+    book_id = instance.book_id
+    transaction.on_commit(lambda: reindex_books([book_id]))
+
+@receiver(m2m_changed, sender=Book.authors.through)
+def reindex_book_authors_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # The author's books are unknown once the clear has happened
+        book_ids = list(Book.objects.filter(authors=instance).values_list('book_id', flat=True))
+        transaction.on_commit(lambda: reindex_books(book_ids))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            reindex_books([instance.book_id])
+        elif pk_set:
+            reindex_books(pk_set)
+
+@receiver(post_save, sender=Author)
+def reindex_author_books(sender, instance, created=False, raw=False, **kwargs):
+    if created or raw:
+        return
+    reindex_books(
+        BookAuthor.objects.filter(author=instance).values_list('book_id', flat=True)
+    )
+
+@receiver(post_save, sender=Topic)
+def reindex_topic_books(sender, instance, created=False, raw=False, **kwargs):
+    if created or raw:
+        return
+    reindex_books(
+        Book.objects.filter(topic=instance).values_list('book_id', flat=True)
+    )
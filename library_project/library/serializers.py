@@ -18,14 +18,11 @@ class AuthorSerializer(serializers.ModelSerializer):
 class BookSerializer(serializers.ModelSerializer):
     topic = TopicSerializer(read_only=True)
     authors = AuthorSerializer(many=True, read_only=True)
-    available_copies = serializers.SerializerMethodField()
 
     class Meta:
         model = Book
-        fields = ['book_id', 'book_name', 'topic', 'authors', 'available_copies']
-
-    def get_available_copies(self, obj):
-        return obj.available_copies_count()
+        fields = ['book_id', 'book_name', 'topic', 'authors', 'available_copies', 'total_copies']
+        read_only_fields = ['available_copies', 'total_copies']
 
 class BookCopySerializer(serializers.ModelSerializer):
     book = BookSerializer(read_only=True)
@@ -42,6 +39,8 @@ class CustomerSerializer(serializers.ModelSerializer):
 class RentalSerializer(serializers.ModelSerializer):
     customer = CustomerSerializer(read_only=True)
     book_copy = BookCopySerializer(read_only=True)
+    # New rentals name a book; the checkout engine picks the copy
+    book_id = serializers.IntegerField(write_only=True, required=False)
     is_overdue = serializers.SerializerMethodField()
     days_overdue = serializers.SerializerMethodField()
 
@@ -49,9 +48,19 @@ class RentalSerializer(serializers.ModelSerializer):
         model = Rental
         fields = [
             'rental_id', 'status', 'borrow_date', 'exp_return_dt',
-            'actual_return_dt', 'customer', 'book_copy',
+            'actual_return_dt', 'customer', 'book_copy', 'book_id',
             'is_overdue', 'days_overdue'
         ]
+        extra_kwargs = {
+            'status': {'required': False},
+            'borrow_date': {'required': False},
+            'exp_return_dt': {'required': False},
+        }
+
+    def validate(self, attrs):
+        if self.instance is None and 'book_id' not in attrs:
+            raise serializers.ValidationError({'book_id': 'This field is required.'})
+        return attrs
 
     def get_is_overdue(self, obj):
         return obj.is_overdue
@@ -89,14 +98,20 @@ class StudyRoomSerializer(serializers.ModelSerializer):
 class ReservationSerializer(serializers.ModelSerializer):
     customer = CustomerSerializer(read_only=True)
     study_room = StudyRoomSerializer(read_only=True)
+    room_id = serializers.IntegerField(write_only=True, required=False)
 
     class Meta:
         model = Reservation
         fields = [
             'reserve_id', 'topic_desc', 'start_dt', 'end_dt',
-            'group_size', 'customer', 'study_room'
+            'group_size', 'customer', 'study_room', 'room_id'
         ]
 
+    def validate(self, attrs):
+        if self.instance is None and 'room_id' not in attrs:
+            raise serializers.ValidationError({'room_id': 'This field is required.'})
+        return attrs
+
 class InvoiceSerializer(serializers.ModelSerializer):
     is_paid = serializers.SerializerMethodField()
 
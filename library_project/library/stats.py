@@ -0,0 +1,283 @@
+"""
+Daily activity rollup.
+
+PJI_DAILY_LIBRARY_STATS holds the activity of each day: rentals opened,
+returns, books lost, invoices issued and the amount invoiced, payments
+received, reservations and exhibition registrations. Reports read a few
+rows per day instead of scanning the rental, invoice and payment history.
+
+Each source row counts towards one day: a rental towards the day it was
+borrowed, its return or loss towards the day it was closed, an invoice or
+payment towards its date, a reservation towards the day it starts. Saves,
+deletes and ``transition()`` calls apply the difference between the row's
+old and new contributions,
+
+    UPDATE PJI_DAILY_LIBRARY_STATS SET RETURNS = RETURNS + 1 WHERE STAT_DATE = %s AND SLOT = %s
+
+inside the writer's transaction, so the rollup commits or rolls back with
+the write that changed it. Days are dates in the current time zone.
+
+The UPDATE locks its row until the writer commits. With one row per day,
+every rental, invoice and payment of the day would queue behind that lock,
+so each day is split into ``LIBRARY_STATS_SLOTS`` rows and a write updates
+one of them at random. Readers sum a day's slots; ``daily()`` and
+``totals()`` do it for them.
+
+``bulk_create`` and queryset ``update()`` send no signals. After a bulk
+load, or to seed the table, ``manage.py backfill_stats`` recomputes any
+range of days from the source tables.
+"""
+import random
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, F, Max, Min, Sum
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import DailyLibraryStats, ExhibitionAttendance, Invoice, Payment, Rental, Reservation
+from .versioning import transitioned
+
+# Rows per day that writers spread over
+SLOTS = getattr(settings, 'LIBRARY_STATS_SLOTS', 8)
+
+# Rental status -> the counter a rental closed with that status adds to
+CLOSING_COLUMNS = {'Returned': 'returns', 'Lost': 'lost'}
+
+COLUMNS = (
+    'rentals_opened', 'returns', 'lost', 'invoices_issued', 'revenue_invoiced',
+    'payments_received', 'reservations', 'exhibition_registrations',
+)
+
+
+def start_of_day(day):
+    """Midnight at the start of ``day`` in the current time zone"""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _day(value):
+    if value is None:
+        return None
+    return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+
+
+def _money(value):
+    # Views create invoices with float amounts
+    return Decimal(str(value)) if value is not None else Decimal(0)
+
+
+def _rental(values):
+    yield _day(values['borrow_date']), 'rentals_opened', 1
+    column = CLOSING_COLUMNS.get(values['status'])
+    if column is not None:
+        yield _day(values['actual_return_dt']), column, 1
+
+
+def _invoice(values):
+    day = _day(values['invoice_date'])
+    yield day, 'invoices_issued', 1
+    yield day, 'revenue_invoiced', _money(values['invoice_amt'])
+
+
+def _payment(values):
+    yield _day(values['payment_date']), 'payments_received', _money(values['payment_amt'])
+
+
+def _reservation(values):
+    yield _day(values['start_dt']), 'reservations', 1
+
+
+def _registration(values):
+    yield _day(values['registered_at']), 'exhibition_registrations', 1
+
+
+# Model -> (fields a row's contribution depends on, contribution function)
+TRACKED = {
+    Rental: (('status', 'borrow_date', 'actual_return_dt'), _rental),
+    Invoice: (('invoice_date', 'invoice_amt'), _invoice),
+    Payment: (('payment_date', 'payment_amt'), _payment),
+    Reservation: (('start_dt',), _reservation),
+    ExhibitionAttendance: (('registered_at',), _registration),
+}
+
+
+def _add(deltas, model, values, sign):
+    if values is None:
+        return
+    for day, column, amount in TRACKED[model][1](values):
+        if day is not None:
+            deltas[day][column] += sign * amount
+
+
+def _values(instance):
+    return {name: getattr(instance, name) for name in TRACKED[type(instance)][0]}
+
+
+def apply(deltas, using=DEFAULT_DB_ALIAS):
+    """Add ``deltas`` ({day: {column: amount}}) to one random slot of each day, creating missing rows"""
+    slot = random.randrange(SLOTS)
+    # Days in order, so writers that touch the same days lock them in the same order
+    for day in sorted(deltas):
+        updates = {column: F(column) + amount for column, amount in deltas[day].items() if amount}
+        if not updates:
+            continue
+        rows = DailyLibraryStats.objects.using(using).filter(stat_date=day, slot=slot)
+        if not rows.update(**updates):
+            # First write to this slot; another writer may be creating it too
+            DailyLibraryStats.objects.using(using).bulk_create(
+                [DailyLibraryStats(stat_date=day, slot=slot)], ignore_conflicts=True
+            )
+            rows.update(**updates)
+
+
+def record_change(model, old, new, using=DEFAULT_DB_ALIAS):
+    """Move a row's contribution from its ``old`` field values to its ``new`` ones (either may be None)"""
+    deltas = defaultdict(lambda: defaultdict(int))
+    _add(deltas, model, old, -1)
+    _add(deltas, model, new, 1)
+    apply(deltas, using)
+
+
+# Model -> more fields other modules need from old_values() (see library.leaderboard)
+_EXTRA_FIELDS = defaultdict(set)
+
+
+def remember_fields(model, *fields):
+    """Also read ``fields`` of a tracked model's row before it is saved, for ``old_values()``"""
+    _EXTRA_FIELDS[model].update(fields)
+
+
+def old_values(instance):
+    """The tracked and remembered fields of ``instance``'s row before the save in progress.
+
+    None for a new row. Read once per save, in a pre_save receiver, and
+    shared by every post_save receiver that needs it.
+    """
+    return getattr(instance, '_stats_old_values', None)
+
+
+def _remember_old_values(sender, instance, raw, using, **kwargs):
+    instance._stats_old_values = None
+    if raw or instance._state.adding:
+        return
+    fields = (*TRACKED[sender][0], *sorted(_EXTRA_FIELDS[sender]))
+    instance._stats_old_values = sender._default_manager.using(using).filter(pk=instance.pk).values(*fields).first()
+
+
+def _record_save(sender, instance, raw, using, **kwargs):
+    if not raw:
+        record_change(sender, old_values(instance), _values(instance), using)
+
+
+def _record_delete(sender, instance, using, **kwargs):
+    record_change(sender, _values(instance), None, using)
+
+
+for _model in TRACKED:
+    pre_save.connect(_remember_old_values, sender=_model, dispatch_uid=f'stats_pre_save_{_model.__name__}')
+    post_save.connect(_record_save, sender=_model, dispatch_uid=f'stats_post_save_{_model.__name__}')
+    post_delete.connect(_record_delete, sender=_model, dispatch_uid=f'stats_post_delete_{_model.__name__}')
+
+
+@receiver(transitioned, sender=Rental)
+def _record_rental_transition(sender, instance, previous, **kwargs):
+    new = _values(instance)
+    old = dict(new, **{name: value for name, value in previous.items() if name in new})
+    record_change(Rental, old, new, instance._state.db or DEFAULT_DB_ALIAS)
+
+
+# Rebuilding from the source tables
+
+def _sources():
+    """(queryset, date field, {column: aggregate}) for every rollup column"""
+    return (
+        (Rental.objects.all(), 'borrow_date', {'rentals_opened': Count('pk')}),
+        (Rental.objects.filter(status='Returned'), 'actual_return_dt', {'returns': Count('pk')}),
+        (Rental.objects.filter(status='Lost'), 'actual_return_dt', {'lost': Count('pk')}),
+        (Invoice.objects.all(), 'invoice_date', {
+            'invoices_issued': Count('pk'), 'revenue_invoiced': Sum('invoice_amt'),
+        }),
+        (Payment.objects.all(), 'payment_date', {'payments_received': Sum('payment_amt')}),
+        (Reservation.objects.all(), 'start_dt', {'reservations': Count('pk')}),
+        (ExhibitionAttendance.objects.all(), 'registered_at', {'exhibition_registrations': Count('pk')}),
+    )
+
+
+def activity_range(using=DEFAULT_DB_ALIAS):
+    """(first, last) day any source row counts towards, or None if there are none.
+
+    The last day can be in the future: reservations count towards the day
+    they start.
+    """
+    days = []
+    for queryset, field, _aggregates in _sources():
+        bounds = queryset.using(using).aggregate(first=Min(field), last=Max(field))
+        days += [_day(value) for value in bounds.values() if value is not None]
+    return (min(days), max(days)) if days else None
+
+
+def rebuild(start, end, using=DEFAULT_DB_ALIAS):
+    """Recompute the rows for the days in [start, end) from the source tables.
+
+    Returns the number of days with activity. Each day is written to slot
+    0. The old rows are deleted before the sources are read, so a
+    concurrent write to one of these days waits on the deleted rows and
+    applies its increment after the rebuild commits, on top of totals that
+    did not include it.
+    """
+    lower, upper = start_of_day(start), start_of_day(end)
+    with transaction.atomic(using=using):
+        DailyLibraryStats.objects.using(using).filter(stat_date__gte=start, stat_date__lt=end).delete()
+
+        rows = defaultdict(dict)
+        for queryset, field, aggregates in _sources():
+            grouped = (
+                queryset.using(using)
+                .filter(**{f'{field}__gte': lower, f'{field}__lt': upper})
+                .annotate(day=TruncDate(field, tzinfo=timezone.get_current_timezone()))
+                .values('day')
+                .annotate(**aggregates)
+            )
+            for group in grouped:
+                rows[group['day']].update({column: group[column] or 0 for column in aggregates})
+
+        DailyLibraryStats.objects.using(using).bulk_create(
+            [DailyLibraryStats(stat_date=day, **values) for day, values in rows.items()]
+        )
+    return len(rows)
+
+
+# Reading
+
+def by_day(rows):
+    """``rows`` summed per day, as dicts with ``stat_date`` and every column"""
+    return rows.order_by().values('stat_date').annotate(**{column: Sum(column) for column in COLUMNS})
+
+
+def daily(start, end):
+    """One row per day in [start, end), oldest first, in one query; days without activity are zeros.
+
+    The rows are unsaved DailyLibraryStats holding the sum of the day's slots.
+    """
+    rows = {
+        row['stat_date']: DailyLibraryStats(**row)
+        for row in by_day(DailyLibraryStats.objects.filter(stat_date__gte=start, stat_date__lt=end))
+    }
+    days = (start + timedelta(days=i) for i in range((end - start).days))
+    return [rows.get(day) or DailyLibraryStats(stat_date=day) for day in days]
+
+
+def totals(start=None, end=None):
+    """Every column summed over [start, end), or over all days, in one query"""
+    rows = DailyLibraryStats.objects.all()
+    if start is not None:
+        rows = rows.filter(stat_date__gte=start)
+    if end is not None:
+        rows = rows.filter(stat_date__lt=end)
+    summed = rows.aggregate(**{column: Sum(column) for column in COLUMNS})
+    return {column: value or 0 for column, value in summed.items()}
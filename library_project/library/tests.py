@@ -1,3 +1,1707 @@
-from django.test import TestCase
+import os
+import queue
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import (
+    async_views, availability, book_cache, booking, dashboard, db_router, deferred, exhibitions, facets, idempotency,
+    ids, kpis, leaderboard, retry, search, stats, typeahead,
+)
+from .booking import BookingError, RoomUnavailable, book_room
+from .catalog_import import CatalogImportError, CatalogImporter, read_rows
+from .checkout import CopyUnavailable, checkout_copy
+from .inventory import add_copies, set_copy_status
+from .models import (
+    Author, Book, BookAuthor, BookCoBorrow, BookCopy, BookDailyCheckouts, BookPopularity, Customer,
+    DailyLibraryStats, Event, Exhibition, ExhibitionAttendance, IdempotencyKey, Invoice, Payment, Rental, Reservation,
+    StudyRoom, Topic
+)
+from .pagination import InvalidCursor, KeysetPaginator
+from .recommendations import build_recommendations, recommendations_for
+from .retry import is_retriable, run_in_transaction
+from .search import search_books
+from .versioning import ConcurrentUpdateError
+
+
+class APIQueryBudgetTests(TestCase):
+    """Each API endpoint must serve a page in a fixed number of queries.
+
+    Every endpoint is requested once, then again after more rows have been
+    added; the query count has to stay the same (no N+1) and within the
+    budget below. Raise a budget only when an endpoint legitimately needs
+    another query.
+    """
+
+    QUERY_BUDGETS = {
+        '/api/books/': 2,
+        '/api/books/?search=volume': 3,
+        '/api/books/{book_id}/available_copies/': 3,
+        '/api/books/{book_id}/recommendations/': 4,
+        '/api/books/popular/': 3,
+        '/api/rentals/': 3,
+        '/api/reservations/': 2,
+        '/api/customers/': 2,
+        '/api/customers/{cust_id}/rentals/': 4,
+        '/api/invoices/': 3,
+        '/api/payments/': 3,
+        '/api/events/': 1,
+        '/api/study-rooms/': 1,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.employee = User.objects.create_user('employee', password='pw')
+        cls.employee.groups.add(Group.objects.get_or_create(name='Employees')[0])
+        user = User.objects.create_user('reader', password='pw')
+        cls.customer = Customer.objects.create(
+            user=user, fname='Ada', lname='Reader', phone='5550100',
+            email='reader@example.com', id_type='Passport', id_no='X1'
+        )
+        cls.topic = Topic.objects.create(topic_name='Fiction')
+        cls.room = StudyRoom.objects.create(capacity=4)
+        cls.book = cls.add_rows(0, 3)
+
+    @classmethod
+    def add_rows(cls, start, count):
+        """Add ``count`` books, each with authors, copies, a paid rental and a reservation"""
+        now = timezone.now()
+        book = None
+        for n in range(start, start + count):
+            book = Book.objects.create(book_name=f'Volume {n}', topic=cls.topic)
+            for i in range(2):
+                author = Author.objects.create(
+                    fname=f'Author{n}', lname=f'No{i}', street='1 Main St', city='Springfield',
+                    country='USA', postal_code='00000', email=f'a{n}_{i}@example.com'
+                )
+                BookAuthor.objects.create(book=book, author=author)
+            copy = BookCopy.objects.create(book=book, status='not available')
+            BookCopy.objects.create(book=book, status='available')
+            invoice = Invoice.objects.create(invoice_date=now, invoice_amt=Decimal('5.00'))
+            Payment.objects.create(
+                payment_date=now, pay_method='Cash', payment_amt=Decimal('5.00'), invoice=invoice
+            )
+            Rental.objects.create(
+                status='Borrowed', borrow_date=now, exp_return_dt=now + timedelta(days=14),
+                customer=cls.customer, invoice=invoice, book_copy=copy
+            )
+            Reservation.objects.create(
+                topic_desc=f'Study {n}', start_dt=now + timedelta(days=n + 1),
+                end_dt=now + timedelta(days=n + 1, hours=2), group_size=2,
+                customer=cls.customer, study_room=cls.room
+            )
+        return book
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.employee)
+
+    def count_queries(self, url):
+        url = url.format(book_id=self.book.book_id, cust_id=self.customer.cust_id)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        # Savepoints opened by the request transaction are not data queries
+        return sum(1 for query in queries if 'SAVEPOINT' not in query['sql'])
+
+    def test_query_counts_do_not_grow_with_rows(self):
+        baseline = {url: self.count_queries(url) for url in self.QUERY_BUDGETS}
+        self.add_rows(3, 12)
+        for url, budget in self.QUERY_BUDGETS.items():
+            with self.subTest(url=url):
+                queries = self.count_queries(url)
+                self.assertEqual(queries, baseline[url], f'{url} query count grows with the data')
+                self.assertLessEqual(queries, budget, f'{url} exceeds its query budget')
+
+
+class SearchTests(TestCase):
+    """Catalog search returns every index hit, best match first"""
+
+    def setUp(self):
+        topic = Topic.objects.create(topic_name='Science')
+        self.keyword_hit = Book.objects.create(book_name='Gardens of the Moon', topic=topic)
+        author = Author.objects.create(
+            fname='Dune', lname='Keeper', street='1 Main St', city='Springfield',
+            country='USA', postal_code='00000', email='dune@example.com'
+        )
+        BookAuthor.objects.create(book=self.keyword_hit, author=author)
+        self.title_hit = Book.objects.create(book_name='Dune Messiah', topic=topic)
+        Book.objects.create(book_name='Unrelated', topic=topic)
+
+    def test_title_matches_rank_above_keyword_matches(self):
+        books = list(search_books('dune'))
+        self.assertEqual([book.book_id for book in books], [self.title_hit.book_id, self.keyword_hit.book_id])
+        self.assertGreater(books[0].search_rank, books[1].search_rank)
+        # Prefix match, and every term has to match
+        self.assertEqual([book.book_id for book in search_books('mess')], [self.title_hit.book_id])
+        self.assertEqual(list(search_books('dune gardens')), [self.keyword_hit])
+
+    def test_hits_join(self):
+        # The MySQL form, joined to a derived table of scored hits, with FTS5 standing in for MATCH
+        fts = search.FTS_TABLE
+        hits = search._IndexHits(
+            f'SELECT rowid AS PJI_BOOK_BOOK_ID, -bm25({fts}, 2.0, 1.0) AS SCORE FROM {fts} WHERE {fts} MATCH %s',
+            ['"dune"*'],
+        )
+        books = hits.annotate(Book.objects.select_related('topic'), 'search_rank').order_by('-search_rank', 'book_id')
+        self.assertEqual(list(books), list(search_books('dune')))
+        self.assertEqual(books.count(), 2)
+        self.assertEqual(list(books.filter(search_rank__lt=books[0].search_rank)), [self.keyword_hit])
+        self.assertEqual(set(Book.objects.filter(book_id__in=books.values('book_id'))), {self.title_hit, self.keyword_hit})
+
+    def test_ranking_is_one_query(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(len(search_books('dune').select_related('topic')), 2)
+
+    def test_no_hits(self):
+        for query in ('nothing', '?!'):
+            with self.subTest(query=query):
+                books = search_books(query)
+                self.assertEqual(list(books.order_by('-search_rank', 'book_id')), [])
+        self.assertEqual(facets.compute_facets(facets.normalize_filters(search='nothing'))['availability']['total'], 0)
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('reader', password='pw'))
+        response = client.get('/api/books/', {'search': 'nothing'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], [])
+        self.assertEqual(len(client.get('/api/books/', {'search': 'dune'}).json()['results']), 2)
+
+
+class FacetTests(TestCase):
+    """Facet counts for a filter set"""
+
+    def setUp(self):
+        cache.clear()
+        self.authors = [
+            Author.objects.create(
+                fname='Author', lname=f'{n:02}', street='1 Main St', city='Springfield',
+                country='USA', postal_code='00000', email=f'a{n}@example.com'
+            )
+            for n in range(facets.AUTHOR_FACET_LIMIT + 1)
+        ]
+        # Every author but the last has two books, so the last one falls outside the top
+        for author in self.authors:
+            for n in range(1 if author is self.authors[-1] else 2):
+                BookAuthor.objects.create(book=Book.objects.create(book_name=f'{author.lname} {n}'), author=author)
+
+    def author_counts(self, **filters):
+        return {row['id']: row['count'] for row in facets.compute_facets(facets.normalize_filters(**filters))['authors']}
+
+    def test_author_facet_is_capped(self):
+        counts = self.author_counts()
+        self.assertEqual(len(counts), facets.AUTHOR_FACET_LIMIT)
+        self.assertNotIn(self.authors[-1].author_id, counts)
+
+    def test_selected_author_is_always_listed(self):
+        last = self.authors[-1]
+        counts = self.author_counts(author=last.author_id)
+        self.assertEqual(len(counts), facets.AUTHOR_FACET_LIMIT + 1)
+        self.assertEqual(counts[last.author_id], 1)
+        self.assertEqual(list(counts)[-1], last.author_id)
+        # Listed with no books when the other filters leave none of theirs
+        counts = self.author_counts(search='01', author=last.author_id)
+        self.assertEqual(counts, {self.authors[1].author_id: 2, last.author_id: 0})
+        # A selected author already in the top is not listed twice
+        self.assertEqual(len(self.author_counts(author=self.authors[0].author_id)), facets.AUTHOR_FACET_LIMIT)
+
+
+class TypeaheadTests(TestCase):
+    """Prefix completion, kept current by signals and rebuilt without blocking lookups"""
+
+    def setUp(self):
+        self.potter = Book.objects.create(book_name='Harry Potter')
+        self.pottery = Book.objects.create(book_name='Pottery Basics')
+        Author.objects.create(
+            fname='Beatrix', lname='Potter', street='1 Main St', city='Springfield',
+            country='USA', postal_code='00000', email='bp@example.com'
+        )
+        self.index = typeahead.PrefixIndex()
+
+    def labels(self, prefix, index=None):
+        return [match['label'] for match in (index or self.index).complete(prefix)]
+
+    def test_whole_name_matches_come_first(self):
+        self.assertEqual(self.labels('pot'), ['Pottery Basics', 'Harry Potter', 'Beatrix Potter'])
+        self.assertEqual(self.labels('Harry  P'), ['Harry Potter'])
+        self.assertEqual(self.labels('potters'), [])
+        self.assertEqual(self.index.complete('pot', limit=1)[0]['id'], self.pottery.book_id)
+        self.assertEqual(self.labels('!!'), [])
+
+    def test_signals_and_invalidation(self):
+        typeahead.index.invalidate()
+        self.labels('pot', typeahead.index)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.potter.book_name = 'Harry Houdini'
+            self.potter.save()
+            self.pottery.delete()
+        self.assertEqual(self.labels('pot', typeahead.index), ['Beatrix Potter'])
+
+        # Queryset updates send no signal; they show up after a rebuild
+        Book.objects.filter(pk=self.potter.pk).update(book_name='Potted Plants')
+        self.assertEqual(self.labels('pot', typeahead.index), ['Beatrix Potter'])
+        typeahead.index.invalidate()
+        self.assertEqual(self.labels('pot', typeahead.index), ['Potted Plants', 'Beatrix Potter'])
+
+        response = self.client.get(reverse('library:book_search'), {'q': 'potted'})
+        self.assertEqual(response.json()['results'][0]['url'], reverse('library:book_detail', args=[self.potter.pk]))
+
+    def test_lookups_use_old_entries_while_rebuilding(self):
+        self.labels('pot')
+        self.index.invalidate()
+        started, release = threading.Event(), threading.Event()
+
+        def slow_catalog():
+            started.set()
+            release.wait(5)
+            yield from [('book', 1, 'Pottery Basics'), ('book', 99, 'Potions')]
+
+        with mock.patch.object(self.index, '_read_catalog', slow_catalog):
+            rebuild = threading.Thread(target=self.index.complete, args=('pot',))
+            rebuild.start()
+            self.assertTrue(started.wait(5))
+            began = time.monotonic()
+            self.assertEqual(len(self.labels('pot')), 3)
+            self.assertLess(time.monotonic() - began, 1)
+            # Changes made during the rebuild survive the swap
+            self.index.update('book', 100, 'Pots and Pans')
+            release.set()
+            rebuild.join(5)
+        self.assertEqual(self.labels('pot'), ['Potions', 'Pots and Pans', 'Pottery Basics'])
+
+    def test_build_stops_reading_at_the_cap(self):
+        # Two keys per book title; the cap is reached before the authors are read
+        index = typeahead.PrefixIndex(max_entries=3)
+        with self.assertLogs(typeahead.logger, 'WARNING'), self.assertNumQueries(1):
+            self.assertEqual(self.labels('pot', index), ['Harry Potter'])
+
+
+class KeysetPaginationTests(TestCase):
+    """Cursor pages cover every row once, in order, even with duplicate sort keys"""
+
+    def setUp(self):
+        self.now = timezone.now().replace(microsecond=0)
+        # Three invoices share each date, so the date alone does not order them
+        for n in range(7):
+            Invoice.objects.create(invoice_date=self.now - timedelta(days=n // 3), invoice_amt=Decimal('1.00'))
+        self.expected = list(Invoice.objects.order_by('-invoice_date', '-invoice_id').values_list('pk', flat=True))
+        employee = User.objects.create_user('employee', password='pw')
+        employee.groups.add(Group.objects.get_or_create(name='Employees')[0])
+        self.client = APIClient()
+        self.client.force_authenticate(employee)
+
+    def walk(self, paginator):
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        return pages
+
+    def test_pages_forward_and_back(self):
+        paginator = KeysetPaginator(Invoice.objects.all(), 2, ordering=('-invoice_date', '-invoice_id'))
+        pages = self.walk(paginator)
+        self.assertEqual([invoice.pk for page in pages for invoice in page], self.expected)
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+        self.assertFalse(pages[0].has_previous())
+
+        # Walking back from the last page returns the same pages
+        page = pages[-1]
+        for previous in reversed(pages[:-1]):
+            page = paginator.page(page.previous_cursor)
+            self.assertEqual(list(page), list(previous))
+        self.assertFalse(page.has_previous())
+
+    def test_cursor_round_trip_and_invalid_cursor(self):
+        paginator = KeysetPaginator(Invoice.objects.all(), 2, ordering=('-invoice_date', '-invoice_id'))
+        cursor = paginator.page().next_cursor
+        direction, key = paginator.decode_cursor(cursor)
+        self.assertEqual(direction, 'n')
+        self.assertEqual(paginator.encode_cursor(direction, key), cursor)
+        self.assertEqual(key[0], self.now)
+
+        for bad in ('garbage!', paginator.encode_cursor('x', key), paginator.encode_cursor('n', key[:1])):
+            with self.subTest(cursor=bad):
+                with self.assertRaises(InvalidCursor):
+                    paginator.page(bad)
+                self.assertEqual(list(paginator.get_page(bad)), list(paginator.page()))
+                self.assertEqual(self.client.get('/api/invoices/', {'cursor': bad}).status_code, 404)
+
+        response = self.client.get('/api/invoices/', {'page_size': 3})
+        seen = [row['invoice_id'] for row in response.json()['results']]
+        while response.json()['next']:
+            response = self.client.get(response.json()['next'])
+            seen += [row['invoice_id'] for row in response.json()['results']]
+        self.assertEqual(seen, self.expected)
+
+    def test_search_rank_ordering(self):
+        # Equal titles score the same
+        for name in ('Tide', 'Tide Tide', 'Tide of Tides', 'Low Tide', 'Tide'):
+            Book.objects.create(book_name=name)
+        expected = [book.book_id for book in search_books('tide')]
+        self.assertEqual(len(expected), 5)
+
+        response = self.client.get('/api/books/', {'search': 'tide', 'page_size': 2})
+        seen = [row['book_id'] for row in response.json()['results']]
+        while response.json()['next']:
+            response = self.client.get(response.json()['next'])
+            seen += [row['book_id'] for row in response.json()['results']]
+        self.assertEqual(seen, expected)
+
+
+class CatalogImportTests(TestCase):
+    """Bulk import reuses known names, writes in batches and reports bad rows by line"""
+
+    def setUp(self):
+        self.fiction = Topic.objects.create(topic_name='Fiction')
+        self.austen = Author.objects.create(
+            fname='Jane', lname='Austen', street='1 Main St', city='Bath',
+            country='UK', postal_code='00000', email='jane@example.com'
+        )
+
+    def run_import(self, text, fmt, batch_size=2):
+        batches = []
+        importer = CatalogImporter(batch_size=batch_size, progress=lambda importer: batches.append(importer.books))
+        importer.run(read_rows(StringIO(text), fmt))
+        return importer, batches
+
+    def test_csv(self):
+        importer, batches = self.run_import(
+            'title,topic,authors,copies\n'
+            'Emma,fiction,Jane Austen,2\n'
+            'Frankenstein,Horror,Mary Shelley; jane austen,\n'
+            'Sanditon,Fiction,Jane Austen,0\n'
+            'Dracula,horror,Bram Stoker,3\n'
+            'Persuasion,,Jane Austen,1\n',
+            'csv',
+        )
+        self.assertEqual(batches, [2, 4, 5])
+        self.assertEqual((importer.books, importer.copies, importer.topics_created, importer.authors_created), (5, 7, 1, 2))
+
+        emma = Book.objects.get(book_name='Emma')
+        self.assertEqual(emma.topic, self.fiction)
+        self.assertEqual(list(emma.authors.all()), [self.austen])
+        self.assertEqual((emma.available_copies, emma.total_copies, emma.bookcopy_set.count()), (2, 2, 2))
+        frankenstein = Book.objects.get(book_name='Frankenstein')
+        self.assertEqual(frankenstein.topic, Book.objects.get(book_name='Dracula').topic)
+        self.assertEqual(sorted(a.lname for a in frankenstein.authors.all()), ['Austen', 'Shelley'])
+        self.assertEqual(frankenstein.total_copies, 1)
+        self.assertIsNone(Book.objects.get(book_name='Persuasion').topic)
+        self.assertEqual(Author.objects.filter(lname='Austen').count(), 1)
+        self.assertEqual(list(search_books('shelley')), [frankenstein])
+
+    def test_jsonl(self):
+        importer, _batches = self.run_import(
+            '{"title": "Mansfield Park", "topic": "Fiction", "authors": ["Jane Austen"], "copies": 1}\n'
+            '\n'
+            '{"title": "Middlemarch", "authors": [{"fname": "George", "lname": "Eliot", "email": "ge@example.com"}]}\n',
+            'jsonl',
+        )
+        self.assertEqual((importer.books, importer.authors_created, importer.topics_created), (2, 1, 0))
+        self.assertEqual(Author.objects.get(lname='Eliot').email, 'ge@example.com')
+        self.assertEqual(Book.objects.get(book_name='Mansfield Park').authors.get(), self.austen)
+
+    def test_bad_rows_report_their_line(self):
+        long_name = 'x' * 51
+        cases = [
+            ('title,authors\nEmma,Jane Austen\n,Jane Austen\n', 'missing title'),
+            (f'title,authors\nEmma,Jane Austen\nLong,Jane {long_name}\n', 'author last name'),
+            (f'title,topic\nEmma,Fiction\nLong,{long_name}\n', 'topic'),
+            ('title,copies\nEmma,1\nLong,many\n', 'copies'),
+        ]
+        for text, message in cases:
+            with self.subTest(message=message):
+                with self.assertRaises(CatalogImportError) as raised:
+                    self.run_import(text, 'csv', batch_size=1)
+                self.assertEqual(raised.exception.line, 3)
+                self.assertIn(message, str(raised.exception))
+        # Rows before the bad one were committed batch by batch
+        self.assertEqual(Book.objects.filter(book_name='Emma').count(), len(cases))
+
+        with self.assertRaises(CatalogImportError) as raised:
+            self.run_import(f'{{"title": "Emma", "authors": [{{"fname": "{long_name}"}}]}}\n', 'jsonl')
+        self.assertEqual(raised.exception.line, 1)
+
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as upload:
+            upload.write(f'title\n{"y" * 101}\n')
+            upload.flush()
+            with self.assertRaisesMessage(CommandError, 'line 2: title longer than 100 characters'):
+                call_command('import_catalog', upload.name, stdout=StringIO())
+
+
+class IdAllocationConcurrencyTests(TransactionTestCase):
+    """Parallel writers must never be handed the same primary key"""
+
+    WRITERS = 50
+    ROWS_PER_WRITER = 4
+
+    def run_writers(self, allocator):
+        previous = ids.set_allocator(allocator)
+        self.addCleanup(ids.set_allocator, previous)
+        barrier = threading.Barrier(self.WRITERS)
+        errors = []
+
+        def write(writer):
+            try:
+                barrier.wait()
+                for row in range(self.ROWS_PER_WRITER):
+                    Topic.objects.create(topic_name=f'Writer {writer} row {row}')
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=write, args=(n,)) for n in range(self.WRITERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Topic.objects.count(), self.WRITERS * self.ROWS_PER_WRITER)
+
+    def test_hilo_allocator(self):
+        # Small blocks so writers keep reserving new ones while others insert
+        self.run_writers(ids.HiLoAllocator(block_size=3))
+
+    def test_hilo_blocks_start_above_existing_rows(self):
+        Topic.objects.create(topic_id=500, topic_name='Inserted with an explicit id')
+        allocator = ids.HiLoAllocator(block_size=10)
+        self.assertEqual(allocator.next_id(Topic), 501)
+        self.assertEqual(allocator.next_id(Topic), 502)
+        # A second process reserves the following block
+        self.assertEqual(ids.HiLoAllocator(block_size=10).next_id(Topic), 511)
+
+    def test_auto_increment_allocator(self):
+        self.run_writers(ids.AutoIncrementAllocator())
+
+
+class RecommendationTests(TestCase):
+    """Incremental runs count every rental once, whatever order their ids arrive in"""
+
+    def setUp(self):
+        self.books = [Book.objects.create(book_name=f'Volume {n}') for n in range(2)]
+        self.customers = [
+            Customer.objects.create(
+                fname=f'Reader{n}', lname='Test', phone='555', email=f'r{n}@example.com', id_type='SSN', id_no=str(n)
+            )
+            for n in range(2)
+        ]
+        self.now = timezone.now()
+
+    def borrow(self, allocator, customer, book):
+        previous = ids.set_allocator(allocator)
+        try:
+            return Rental.objects.create(
+                book_copy=BookCopy.objects.create(book=book, status='not available'), customer=customer,
+                status='Borrowed', borrow_date=self.now, exp_return_dt=self.now + timedelta(days=14),
+            )
+        finally:
+            ids.set_allocator(previous)
+
+    def co_borrowers(self, book, other):
+        return BookCoBorrow.objects.get(book=book, other_book=other).customers
+
+    def test_rentals_from_older_id_blocks_are_counted(self):
+        first, second = self.books
+        process_a, process_b = ids.HiLoAllocator(block_size=50), ids.HiLoAllocator(block_size=50)
+        self.borrow(process_a, self.customers[0], first)
+        self.assertIsNotNone(build_recommendations())
+        late = self.borrow(process_b, self.customers[0], second)
+        build_recommendations()
+        self.assertEqual(self.co_borrowers(first, second), 1)
+
+        # Process A keeps handing out ids from its older, lower block
+        self.assertLess(self.borrow(process_a, self.customers[1], first).rental_id, late.rental_id)
+        self.borrow(process_a, self.customers[1], second)
+        run = build_recommendations()
+        self.assertEqual(run.rentals_processed, 2)
+        self.assertEqual(self.co_borrowers(first, second), 2)
+        self.assertEqual(self.co_borrowers(second, second), 2)
+        self.assertIsNone(build_recommendations())
+
+        # Borrowing a book again does not count the customer twice
+        self.borrow(process_b, self.customers[1], first)
+        build_recommendations()
+        self.assertEqual(self.co_borrowers(first, second), 2)
+        self.assertEqual(recommendations_for(first.book_id).get().recommended, second)
+
+        incremental = sorted(BookCoBorrow.objects.values_list('book_id', 'other_book_id', 'customers'))
+        build_recommendations(full=True)
+        self.assertEqual(sorted(BookCoBorrow.objects.values_list('book_id', 'other_book_id', 'customers')), incremental)
+
+
+class RecommendationConcurrencyTests(TransactionTestCase):
+    """Concurrent runs, the very first ones included, fold each queued rental once"""
+
+    RUNS = 4
+
+    def test_concurrent_first_runs(self):
+        books = [Book.objects.create(book_name=f'Volume {n}') for n in range(2)]
+        now = timezone.now()
+        for n in range(3):
+            customer = Customer.objects.create(
+                fname=f'Reader{n}', lname='Test', phone='555', email=f'r{n}@example.com', id_type='SSN', id_no=str(n)
+            )
+            for book in books:
+                Rental.objects.create(
+                    book_copy=BookCopy.objects.create(book=book, status='not available'), customer=customer,
+                    status='Borrowed', borrow_date=now, exp_return_dt=now + timedelta(days=14),
+                )
+        barrier = threading.Barrier(self.RUNS)
+        runs, errors = [], []
+
+        def run():
+            try:
+                barrier.wait()
+                runs.append(build_recommendations())
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=run) for _ in range(self.RUNS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual([run.rentals_processed for run in runs if run is not None], [6])
+        self.assertEqual(BookCoBorrow.objects.get(book=books[0], other_book=books[1]).customers, 3)
+        self.assertEqual(BookCoBorrow.objects.get(book=books[0], other_book=books[0]).customers, 3)
+
+
+class ExhibitionRegistrationConcurrencyTests(TransactionTestCase):
+    """A rush of registrations must never overfill an exhibition"""
+
+    CAPACITY = 10
+    CUSTOMERS = 30
+
+    def setUp(self):
+        now = timezone.now()
+        self.event = Event.objects.create(
+            event_name='Opening day', start_dt=now + timedelta(days=1), end_dt=now + timedelta(days=2),
+            attd_no=self.CAPACITY, event_type='E'
+        )
+        Exhibition.objects.create(event=self.event, expenses=Decimal('0.00'))
+        self.customers = [
+            Customer.objects.create(
+                fname='Guest', lname=str(n), phone='555', email=f'guest{n}@example.com',
+                id_type='SSN', id_no=str(n)
+            )
+            for n in range(self.CUSTOMERS)
+        ]
+
+    def register_all(self, customers):
+        barrier = threading.Barrier(len(customers))
+        outcomes, errors = [], []
+
+        def register(customer):
+            try:
+                barrier.wait()
+                exhibitions.register(self.event, customer)
+                outcomes.append('registered')
+            except exhibitions.RegistrationError as e:
+                outcomes.append(type(e).__name__)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=register, args=(customer,)) for customer in customers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return outcomes
+
+    def test_capacity_holds_under_a_rush(self):
+        outcomes = self.register_all(self.customers)
+        self.assertEqual(outcomes.count('registered'), self.CAPACITY)
+        self.assertEqual(outcomes.count('ExhibitionFull'), self.CUSTOMERS - self.CAPACITY)
+        self.assertEqual(ExhibitionAttendance.objects.filter(exhibition_id=self.event.event_id).count(), self.CAPACITY)
+        self.assertEqual(Exhibition.objects.get(pk=self.event.event_id).registered_count, self.CAPACITY)
+
+    def test_duplicate_registrations_take_one_place(self):
+        outcomes = self.register_all([self.customers[0]] * 5)
+        self.assertEqual(outcomes.count('registered'), 1)
+        self.assertEqual(outcomes.count('AlreadyRegistered'), 4)
+        self.assertEqual(Exhibition.objects.get(pk=self.event.event_id).registered_count, 1)
+
+        exhibitions.unregister(self.event, self.customers[0])
+        self.assertEqual(Exhibition.objects.get(pk=self.event.event_id).registered_count, 0)
+
+
+class BookingTests(TestCase):
+    """A room is booked only for slots no other reservation overlaps"""
+
+    def setUp(self):
+        self.room = StudyRoom.objects.create(capacity=4)
+        self.other_room = StudyRoom.objects.create(capacity=6)
+        self.start = timezone.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=1)
+
+    def book(self, start, end, room=None, reservation=None):
+        reservation = reservation or Reservation(topic_desc='Study', group_size=2)
+        reservation.study_room_id = (room or self.room).room_id
+        reservation.start_dt, reservation.end_dt = self.start + start, self.start + end
+        return book_room(reservation)
+
+    def test_duration_bounds(self):
+        for end in (timedelta(minutes=59), booking.MAX_DURATION + timedelta(minutes=1)):
+            with self.subTest(end=end), self.assertRaises(BookingError):
+                self.book(timedelta(0), end)
+        self.book(timedelta(0), booking.MIN_DURATION)
+        self.book(timedelta(days=1), timedelta(days=1) + booking.MAX_DURATION)
+        self.assertEqual(Reservation.objects.count(), 2)
+
+    def test_overlapping_slots_are_refused(self):
+        self.book(timedelta(hours=10), timedelta(hours=12))
+        for start, end in ((11, 13), (9, 11), (10, 12), (10.5, 11.5), (9, 13)):
+            with self.subTest(start=start, end=end), self.assertRaises(RoomUnavailable):
+                self.book(timedelta(hours=start), timedelta(hours=end))
+        # Back-to-back slots and other rooms are free
+        self.book(timedelta(hours=12), timedelta(hours=13))
+        self.book(timedelta(hours=9), timedelta(hours=10))
+        self.book(timedelta(hours=10), timedelta(hours=12), room=self.other_room)
+        self.assertEqual(Reservation.objects.count(), 4)
+
+    def test_long_reservation_within_the_lower_bound_overlaps(self):
+        # Starts MAX_DURATION - 1h before the slot and runs into it
+        self.book(timedelta(hours=1), timedelta(hours=1) + booking.MAX_DURATION)
+        with self.assertRaises(RoomUnavailable):
+            self.book(booking.MAX_DURATION, booking.MAX_DURATION + timedelta(hours=1))
+        # Ends exactly when the next slot starts
+        self.book(timedelta(hours=1) + booking.MAX_DURATION, timedelta(hours=2) + booking.MAX_DURATION)
+
+    def test_reschedule_ignores_its_own_slot(self):
+        reservation = self.book(timedelta(hours=10), timedelta(hours=12))
+        self.book(timedelta(hours=11), timedelta(hours=13), reservation=reservation)
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.end_dt, self.start + timedelta(hours=13))
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_unknown_room(self):
+        reservation = Reservation(
+            topic_desc='Study', group_size=2, study_room_id=self.other_room.room_id + 100,
+            start_dt=self.start, end_dt=self.start + timedelta(hours=2),
+        )
+        with self.assertRaisesMessage(BookingError, 'No such study room.'):
+            book_room(reservation)
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_api(self):
+        user = User.objects.create_user('reader', password='pw')
+        Customer.objects.create(
+            user=user, fname='Ada', lname='Reader', phone='555', email='ada@example.com', id_type='SSN', id_no='1'
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        slot = {
+            'topic_desc': 'Study', 'group_size': 2,
+            'start_dt': self.start.isoformat(), 'end_dt': (self.start + timedelta(hours=2)).isoformat(),
+        }
+
+        response = client.post('/api/reservations/', slot, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('room_id', response.json())
+
+        response = client.post('/api/reservations/', dict(slot, room_id=self.room.room_id), format='json')
+        self.assertEqual(response.status_code, 201)
+        reserve_id = response.json()['reserve_id']
+        response = client.post('/api/reservations/', dict(slot, room_id=self.room.room_id), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('non_field_errors', response.json())
+
+        response = client.patch(f'/api/reservations/{reserve_id}/', {'room_id': self.other_room.room_id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['study_room']['room_id'], self.other_room.room_id)
+        self.assertEqual(Reservation.objects.get(pk=reserve_id).study_room_id, self.other_room.room_id)
+
+
+class BookingConcurrencyTests(TransactionTestCase):
+    """Concurrent requests for one slot book it once"""
+
+    REQUESTS = 8
+
+    def test_one_slot(self):
+        room = StudyRoom.objects.create(capacity=4)
+        start = timezone.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=1)
+        barrier = threading.Barrier(self.REQUESTS)
+        outcomes, errors = [], []
+
+        def request(n):
+            try:
+                barrier.wait()
+                reservation = Reservation(
+                    topic_desc=f'Study {n}', group_size=2, study_room_id=room.room_id,
+                    start_dt=start + timedelta(minutes=n), end_dt=start + timedelta(hours=2),
+                )
+                run_in_transaction(book_room, reservation, attempts=50, base_delay=0.005)
+                outcomes.append('booked')
+            except RoomUnavailable:
+                outcomes.append('unavailable')
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        # SQLite reports concurrent writers as "database is locked"; let them all retry
+        with mock.patch.object(retry, 'budget', retry.RetryBudget(ratio=1, reserve=1000)), \
+                mock.patch.object(retry.logger, 'warning'):
+            threads = [threading.Thread(target=request, args=(n,)) for n in range(self.REQUESTS)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual((outcomes.count('booked'), outcomes.count('unavailable')), (1, self.REQUESTS - 1))
+        self.assertEqual(Reservation.objects.filter(study_room=room).count(), 1)
+
+
+class CheckoutConcurrencyTests(TransactionTestCase):
+    """Borrowers racing for the last copies never share one, and the counters stay exact"""
+
+    COPIES = 3
+    BORROWERS = 8
+
+    def setUp(self):
+        self.book = Book.objects.create(book_name='Hot title', available_copies=0, total_copies=0)
+        add_copies(self.book, self.COPIES)
+        self.customer = Customer.objects.create(
+            fname='Ada', lname='Reader', phone='555', email='ada@example.com', id_type='SSN', id_no='1'
+        )
+
+    def borrow(self):
+        book_copy = checkout_copy(self.book.book_id)
+        now = timezone.now()
+        Rental.objects.create(
+            book_copy=book_copy, customer=self.customer, status='Borrowed',
+            borrow_date=now, exp_return_dt=now + timedelta(days=14),
+        )
+        return book_copy.copy_id
+
+    def test_last_copies(self):
+        barrier = threading.Barrier(self.BORROWERS)
+        claimed, unavailable, errors = [], [], []
+
+        def borrower():
+            try:
+                barrier.wait()
+                claimed.append(run_in_transaction(self.borrow, attempts=50, base_delay=0.005))
+            except CopyUnavailable:
+                unavailable.append(True)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        # SQLite reports concurrent writers as "database is locked"; let them all retry
+        with mock.patch.object(retry, 'budget', retry.RetryBudget(ratio=1, reserve=1000)), \
+                mock.patch.object(retry.logger, 'warning'):
+            threads = [threading.Thread(target=borrower) for _ in range(self.BORROWERS)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(claimed), sorted(set(claimed)))
+        self.assertEqual((len(claimed), len(unavailable)), (self.COPIES, self.BORROWERS - self.COPIES))
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.available_copies, self.book.total_copies), (0, self.COPIES))
+        self.assertFalse(BookCopy.objects.filter(book=self.book, status='available').exists())
+        self.assertEqual(Rental.objects.filter(book_copy__book=self.book).count(), self.COPIES)
+        self.assertEqual(BookPopularity.objects.get(book=self.book).checkouts_7d, self.COPIES)
+
+
+class DeferredWritesTests(TestCase):
+    """Hot-row counter updates run once per row at the end of the collecting block"""
+
+    def setUp(self):
+        self.book = Book.objects.create(book_name='Hot title', available_copies=0, total_copies=0)
+        add_copies(self.book, 3)
+
+    def book_updates(self, queries):
+        return [query for query in queries if query['sql'].startswith('UPDATE "PJI_BOOK" ')]
+
+    def test_counters_are_written_once_at_the_end(self):
+        with CaptureQueriesContext(connection) as queries, transaction.atomic(), deferred.collect():
+            checkout_copy(self.book.book_id)
+            checkout_copy(self.book.book_id)
+            self.assertEqual(self.book_updates(queries), [])
+            self.assertEqual(Book.objects.get(pk=self.book.pk).available_copies, 3)
+        self.assertEqual(len(self.book_updates(queries)), 1)
+        self.assertEqual(Book.objects.get(pk=self.book.pk).available_copies, 1)
+
+    def test_rolled_back_savepoint_drops_its_deltas(self):
+        with transaction.atomic(), deferred.collect():
+            checkout_copy(self.book.book_id)
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                checkout_copy(self.book.book_id)
+                raise RuntimeError
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 2)
+        self.assertEqual(BookCopy.objects.filter(book=self.book, status='available').count(), 2)
+
+        # Outside a collecting block the update runs at once
+        checkout_copy(self.book.book_id)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 1)
+
+
+class VersionedTransitionTests(TestCase):
+    """State changes of copies and rentals must not overwrite each other"""
+
+    def setUp(self):
+        book = Book.objects.create(book_name='Volume', available_copies=1, total_copies=1)
+        self.copy = BookCopy.objects.create(book=book, status='not available')
+        now = timezone.now()
+        self.rental = Rental.objects.create(
+            book_copy=self.copy, status='Borrowed', borrow_date=now, exp_return_dt=now + timedelta(days=14)
+        )
+
+    def test_stale_transition_raises(self):
+        stale = Rental.objects.get(pk=self.rental.pk)
+        self.rental.transition(status='Returned', actual_return_dt=timezone.now())
+        with self.assertRaises(ConcurrentUpdateError):
+            stale.transition(status='Lost')
+        self.rental.refresh_from_db()
+        self.assertEqual((self.rental.status, self.rental.version), ('Returned', 1))
+        self.assertTrue(is_retriable(ConcurrentUpdateError()))
+
+    def test_transition_writes_only_changed_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            set_copy_status(self.copy, 'available')
+        update = queries.captured_queries[0]['sql']
+        self.assertIn('"VERSION"', update)
+        self.assertNotIn('PJI_BOOK_BOOK_ID', update.split('WHERE')[0])
+        self.assertEqual(BookCopy.objects.get(pk=self.copy.pk).version, self.copy.version)
+
+    def test_save_invalidates_stale_copies(self):
+        stale = BookCopy.objects.get(pk=self.copy.pk)
+        self.copy.save()
+        with self.assertRaises(ConcurrentUpdateError):
+            stale.transition(status='available')
+
+    def test_stale_save_raises(self):
+        admin = BookCopy.objects.get(pk=self.copy.pk)
+        reader = BookCopy.objects.get(pk=self.copy.pk)
+        set_copy_status(self.copy, 'available')
+        reader.refresh_from_db()
+        set_copy_status(self.copy, 'not available')
+
+        admin.status = 'damaged'
+        with self.assertRaises(ConcurrentUpdateError), transaction.atomic():
+            admin.save()
+        self.assertEqual(admin.version, 0)
+        # The reader's version was not reused, so its write fails too
+        with self.assertRaises(ConcurrentUpdateError):
+            reader.transition(status='lost')
+        self.copy.refresh_from_db()
+        self.assertEqual((self.copy.status, self.copy.version), ('not available', 2))
+
+
+class BookDetailCacheTests(TestCase):
+    """The cached detail page must follow returns, which send no post_save"""
+
+    def setUp(self):
+        cache.clear()
+        self.employee = User.objects.create_user('desk', password='pw')
+        self.employee.groups.add(Group.objects.get_or_create(name='Employees')[0])
+        self.book = Book.objects.create(book_name='Volume', available_copies=0, total_copies=0)
+        add_copies(self.book, 1)
+        customer = Customer.objects.create(
+            fname='Ada', lname='Reader', phone='555', email='ada@example.com', id_type='SSN', id_no='1'
+        )
+        now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.invoice = Invoice.objects.create(invoice_date=now, invoice_amt=Decimal('2.50'))
+            Rental.objects.create(
+                book_copy=checkout_copy(self.book.book_id), customer=customer, invoice=self.invoice,
+                status='Borrowed', borrow_date=now, exp_return_dt=now + timedelta(days=14),
+            )
+
+    def detail(self):
+        detail = book_cache.get_book_detail(self.book.book_id, is_employee=True)
+        return detail['available_copies'], [rental.status for rental in detail['rental_history']]
+
+    def test_return_refreshes_detail(self):
+        self.assertEqual(self.detail(), (0, ['Borrowed']))
+        self.client.force_login(self.employee)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('library:process_payment', args=[self.invoice.invoice_id]))
+        self.assertRedirects(response, reverse('library:rental_list'), fetch_redirect_response=False)
+        self.assertEqual(self.detail(), (1, ['Returned']))
+
+        response = self.client.get(reverse('library:book_detail', args=[self.book.book_id]))
+        self.assertEqual(response.context['available_copies'], 1)
+
+
+class RetryTests(TransactionTestCase):
+    """Conflicts are retried within the attempt limit and the budget; other errors never are"""
+
+    def setUp(self):
+        budget = mock.patch.object(retry, 'budget', retry.RetryBudget())
+        budget.start()
+        self.addCleanup(budget.stop)
+        for level in ('warning', 'error'):
+            log = mock.patch.object(retry.logger, level)
+            log.start()
+            self.addCleanup(log.stop)
+
+    def failing(self, exc, failures=None):
+        """A function that raises ``exc`` the first ``failures`` times (always if None)"""
+        calls = []
+
+        def func():
+            calls.append(connection.in_atomic_block)
+            if failures is None or len(calls) <= failures:
+                raise exc
+            return 'done'
+        return func, calls
+
+    def test_deadlock_is_retried(self):
+        func, calls = self.failing(OperationalError(1213, 'Deadlock found when trying to get lock'), failures=2)
+        self.assertEqual(run_in_transaction(func, attempts=3, base_delay=0), 'done')
+        self.assertEqual(calls, [True, True, True])
+
+    def test_gives_up_after_last_attempt(self):
+        func, calls = self.failing(OperationalError(1205, 'Lock wait timeout exceeded'))
+        with self.assertRaises(OperationalError):
+            run_in_transaction(func, attempts=3, base_delay=0)
+        self.assertEqual(len(calls), 3)
+
+    def test_gives_up_when_budget_runs_out(self):
+        func, calls = self.failing(ConcurrentUpdateError())
+        with mock.patch.object(retry, 'budget', retry.RetryBudget(ratio=0, reserve=1)):
+            with self.assertRaises(ConcurrentUpdateError):
+                run_in_transaction(func, attempts=5, base_delay=0)
+        # One retry from the reserve, then the budget refuses
+        self.assertEqual(len(calls), 2)
+
+    def test_other_errors_are_not_retried(self):
+        for exc in (ValueError('bad input'), IntegrityError(1062, 'Duplicate entry'), CopyUnavailable('gone')):
+            with self.subTest(exc=exc):
+                func, calls = self.failing(exc)
+                with self.assertRaises(type(exc)):
+                    run_in_transaction(func, attempts=3, base_delay=0)
+                self.assertEqual(len(calls), 1)
+                self.assertFalse(is_retriable(exc))
+
+    def test_budget_refills_at_its_ratio(self):
+        budget = retry.RetryBudget(ratio=0.5, reserve=1)
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+
+    def test_read_only_requests_skip_the_transaction(self):
+        seen = []
+
+        @retry.transactional
+        def view(request):
+            seen.append(connection.in_atomic_block)
+            return HttpResponse()
+
+        factory = RequestFactory()
+        view(factory.get('/'))
+        view(factory.post('/'))
+        self.assertEqual(seen, [False, True])
+
+    def test_view_error_handler_lets_deadlocks_retry(self):
+        user = User.objects.create_user('reader', password='pw')
+        user.groups.add(Group.objects.get_or_create(name='Customers')[0])
+        Customer.objects.create(
+            user=user, fname='Ada', lname='Reader', phone='555', email='ada@example.com', id_type='SSN', id_no='1'
+        )
+        book = Book.objects.create(book_name='Volume', available_copies=0, total_copies=0)
+        add_copies(book, 1)
+        failed = []
+
+        def deadlock_once(book_id):
+            if not failed:
+                failed.append(True)
+                raise OperationalError(1213, 'Deadlock found when trying to get lock')
+            return checkout_copy(book_id)
+
+        self.client.force_login(user)
+        with mock.patch('library.views.checkout_copy', side_effect=deadlock_once):
+            response = self.client.post(reverse('library:borrow_book', args=[book.book_id]))
+        self.assertRedirects(response, reverse('library:rental_list'), fetch_redirect_response=False)
+        self.assertEqual(failed, [True])
+        self.assertEqual(Rental.objects.filter(book_copy__book=book, status='Borrowed').count(), 1)
+
+
+class IdempotencyTests(TestCase):
+    """A keyed request runs once; repeats get its response back"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='pw')
+        self.user.groups.add(Group.objects.get_or_create(name='Customers')[0])
+        Customer.objects.create(
+            user=self.user, fname='Ada', lname='Reader', phone='555', email='ada@example.com', id_type='SSN', id_no='1'
+        )
+        self.book = Book.objects.create(book_name='Volume', available_copies=0, total_copies=0)
+        self.other_book = Book.objects.create(book_name='Tome', available_copies=0, total_copies=0)
+        add_copies(self.book, 2)
+        add_copies(self.other_book, 2)
+        self.api = APIClient()
+        self.api.force_login(self.user)
+
+    def borrow(self, book, key):
+        return self.api.post('/api/rentals/', {'book_id': book.book_id}, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_repeat_replays_the_stored_response(self):
+        first = self.borrow(self.book, 'key-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertFalse(first.has_header(idempotency.REPLAYED_HEADER))
+        repeat = self.borrow(self.book, 'key-1')
+        self.assertEqual(repeat.status_code, 201)
+        self.assertEqual(repeat[idempotency.REPLAYED_HEADER], 'true')
+        self.assertEqual(repeat.json(), first.json())
+        self.assertEqual(Rental.objects.count(), 1)
+
+    def test_key_reused_for_another_request_is_refused(self):
+        self.assertEqual(self.borrow(self.book, 'key-1').status_code, 201)
+        self.assertEqual(self.borrow(self.other_book, 'key-1').status_code, 422)
+        self.assertEqual(Rental.objects.count(), 1)
+
+    def test_duplicate_in_flight_is_refused(self):
+        factory = RequestFactory()
+
+        def keyed_request():
+            request = factory.post('/keyed/', '{"n": 1}', content_type='application/json', HTTP_IDEMPOTENCY_KEY='key-1')
+            request.user = self.user
+            return request
+
+        duplicates = []
+
+        def view(request):
+            # The first request's key is claimed while it runs
+            duplicates.append(idempotency.run_idempotently(keyed_request(), view).status_code)
+            return HttpResponse('created', status=201)
+
+        self.assertEqual(idempotency.run_idempotently(keyed_request(), view).status_code, 201)
+        self.assertEqual(duplicates, [409])
+        replay = idempotency.run_idempotently(keyed_request(), view)
+        self.assertEqual((replay.status_code, replay.content), (201, b'created'))
+        self.assertEqual(duplicates, [409])
+
+    def test_failed_request_releases_its_key(self):
+        with mock.patch('library.views.checkout_copy', side_effect=RuntimeError('crash')):
+            with self.assertRaises(RuntimeError):
+                self.borrow(self.book, 'key-1')
+        self.assertEqual(self.borrow(self.book, 'key-1').status_code, 201)
+        self.assertEqual(Rental.objects.count(), 1)
+
+    def test_form_token_makes_the_form_idempotent(self):
+        self.client.force_login(self.user)
+        url = reverse('library:borrow_book', args=[self.book.book_id])
+        tokens = [self.client.get(url).context['idempotency_key'] for _ in range(2)]
+        self.assertNotEqual(str(tokens[0]), str(tokens[1]))
+
+        first = self.client.post(url, {'idempotency_key': tokens[0]})
+        repeat = self.client.post(url, {'idempotency_key': tokens[0]})
+        self.assertEqual((first.status_code, first['Location']), (302, reverse('library:rental_list')))
+        self.assertEqual((repeat.status_code, repeat['Location']), (302, reverse('library:rental_list')))
+        self.assertEqual(repeat[idempotency.REPLAYED_HEADER], 'true')
+        self.assertEqual(Rental.objects.count(), 1)
+
+    def test_purge_deletes_expired_keys(self):
+        now = timezone.now()
+        for n in range(5):
+            expires_at = now - timedelta(seconds=1) if n < 3 else now + timedelta(hours=1)
+            IdempotencyKey.objects.create(
+                key_hash=f'{n:064}', request_hash='0' * 64, status_code=201,
+                created_at=now - timedelta(days=1), expires_at=expires_at,
+            )
+        out = StringIO()
+        call_command('purge_idempotency_keys', '--batch-size', '2', stdout=out)
+        self.assertIn('Purged 3 expired idempotency keys', out.getvalue())
+        self.assertEqual(IdempotencyKey.objects.count(), 2)
+
+
+class AsyncViewTests(TestCase):
+    """The async read views must answer like the sync views they mirror"""
+
+    def setUp(self):
+        topic = Topic.objects.create(topic_name='History')
+        self.book = Book.objects.create(book_name='Volume', topic=topic, available_copies=0, total_copies=0)
+        now = timezone.now()
+        self.event = Event.objects.create(
+            event_name='Opening day', start_dt=now + timedelta(days=1), end_dt=now + timedelta(days=2),
+            attd_no=10, event_type='E'
+        )
+        self.user = User.objects.create_user('reader', password='x')
+
+    async def test_api_matches_sync_api(self):
+        await sync_to_async(self.client.force_login)(self.user)
+        await sync_to_async(self.async_client.force_login)(self.user)
+        for path in (
+            'books/', 'books/?search=volume', f'books/{self.book.book_id}/', 'books/0/',
+            'events/', f'events/{self.event.event_id}/',
+        ):
+            expected = await sync_to_async(self.client.get)(f'/api/{path}')
+            response = await self.async_client.get(f'/api/async/{path}')
+            self.assertEqual(response.status_code, expected.status_code, path)
+            self.assertEqual(response.json(), expected.json(), path)
+
+    async def test_api_lists_authenticate_first(self):
+        with mock.patch.object(async_views, '_book_page') as book_page, \
+                mock.patch.object(async_views, '_list') as list_events:
+            for path in ('books/', 'books/?search=volume', 'books/?cursor=bad', 'events/'):
+                response = await self.async_client.get(f'/api/async/{path}')
+                self.assertEqual(response.status_code, 403, path)
+        book_page.assert_not_called()
+        list_events.assert_not_called()
+        expected = await sync_to_async(self.client.get)('/api/books/?cursor=bad')
+        self.assertEqual(expected.status_code, 403)
+
+    async def test_pages_render(self):
+        for path in ('/async/books/', '/async/rooms/'):
+            response = await self.async_client.get(path)
+            self.assertEqual(response.status_code, 302)
+            self.assertIn('login', response['Location'])
+        await sync_to_async(self.async_client.force_login)(self.user)
+        for path in ('/async/', '/async/books/', f'/async/books/{self.book.book_id}/', '/async/events/', '/async/rooms/'):
+            response = await self.async_client.get(path)
+            self.assertEqual(response.status_code, 200, path)
+        response = await self.async_client.get('/async/books/')
+        self.assertContains(response, 'Volume')
+
+
+class AvailabilityStreamTests(TestCase):
+    """Changes must reach every subscriber with one read per burst"""
+
+    SUBSCRIBERS = 1000
+
+    def setUp(self):
+        # A broker without its publisher thread; the tests flush by hand
+        self.broker = availability.Broker(availability.InProcessBackend())
+        self.broker.started = True
+        self.broker.backend.start(self.broker.receive)
+        patcher = mock.patch.object(availability, '_broker', self.broker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.book = Book.objects.create(book_name='Volume', available_copies=0, total_copies=0)
+        self.room = StudyRoom.objects.create(capacity=4)
+
+    def test_burst_costs_one_read(self):
+        subscriptions = [availability.Subscription(books={self.book.book_id}, rooms=set()) for _ in range(self.SUBSCRIBERS)]
+        for subscription in subscriptions:
+            self.broker.subscribe(subscription)
+        with self.captureOnCommitCallbacks(execute=True):
+            add_copies(self.book, 3)
+            set_copy_status(BookCopy.objects.filter(book=self.book).first(), 'not available')
+
+        with self.assertNumQueries(1):
+            self.broker.flush()
+        for subscription in subscriptions:
+            _sequence, kind, data = subscription.get(0)
+            self.assertEqual((kind, data['available_copies'], data['total_copies']), ('book', 2, 3))
+            self.assertIsNone(subscription.get(0))
+
+    def test_rooms_are_republished_when_a_reservation_ends(self):
+        subscription = availability.Subscription()
+        self.broker.subscribe(subscription)
+        now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            Reservation.objects.create(
+                study_room=self.room, topic_desc='Revision', group_size=1,
+                start_dt=now - timedelta(hours=1), end_dt=now + timedelta(hours=1),
+            )
+        self.broker.flush()
+        _sequence, kind, data = subscription.get(0)
+        self.assertEqual((kind, data['room_id'], data['available']), ('room', self.room.room_id, False))
+        self.assertEqual(self.broker.boundaries, {self.room.room_id: now + timedelta(hours=1)})
+
+    def test_file_backend_reaches_other_processes(self):
+        path = os.path.join(tempfile.mkdtemp(), 'availability.log')
+        received = queue.Queue()
+        availability.FileBackend(path, poll_interval=0.01).start(received.put)
+        availability.FileBackend(path).publish(('book', self.book.book_id))
+        self.assertEqual(received.get(timeout=5), ('book', self.book.book_id))
+
+    def test_stream_starts_with_a_snapshot(self):
+        self.client.force_login(User.objects.create_user('desk', password='x'))
+        self.assertEqual(self.client.get('/availability/stream/?books=x').status_code, 400)
+        response = self.client.get(f'/availability/stream/?books={self.book.book_id}')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = iter(response.streaming_content)
+        self.assertTrue(next(chunks).startswith(b'retry:'))
+        snapshot = b''.join(next(chunks) for _ in range(2))
+        self.assertIn(b'event: book', snapshot)
+        self.assertIn(b'event: room', snapshot)
+
+class DashboardMetricsTests(TestCase):
+    """The management dashboard groups its series in the database"""
+
+    # Session, user, group check and profile; three metrics queries and two
+    # for the invoice KPIs; the template's two group lookups and the
+    # overdue list
+    QUERY_BUDGET = 12
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.employee = User.objects.create_user('employee', password='pw', is_staff=True)
+        cls.book = Book.objects.create(book_name='Volume', available_copies=0, total_copies=0)
+
+    def setUp(self):
+        # Invoice totals are cached KPIs
+        cache.clear()
+
+    def add_rentals(self, count, when, returned=None, paid=True):
+        for _ in range(count):
+            copy = BookCopy.objects.create(book=self.book, status='not available')
+            invoice = Invoice.objects.create(invoice_date=when, invoice_amt=Decimal('2.50'))
+            if paid:
+                Payment.objects.create(payment_date=when, pay_method='Cash', payment_amt=Decimal('2.50'), invoice=invoice)
+            Rental.objects.create(
+                book_copy=copy, invoice=invoice, status='Returned' if returned else 'Borrowed',
+                borrow_date=when, exp_return_dt=when + timedelta(days=14), actual_return_dt=returned,
+            )
+
+    def test_series_and_totals(self):
+        now = timezone.now()
+        self.add_rentals(2, now)
+        self.add_rentals(1, now - timedelta(days=1), returned=now, paid=False)
+        self.add_rentals(1, now - timedelta(days=8))
+        self.add_rentals(1, now - timedelta(days=62))
+        Reservation.objects.create(topic_desc='Study', start_dt=now, end_dt=now + timedelta(hours=1), group_size=1)
+
+        with self.assertNumQueries(5):
+            shown = dashboard.dashboard_metrics()
+        self.assertEqual(shown['weekly_rentals'][-2:], [1, 2])
+        self.assertEqual(sum(shown['weekly_rentals']), 3)
+        self.assertEqual(shown['weekly_returns'][-1], 1)
+        self.assertEqual(
+            (shown['new_rentals_today'], shown['returns_today'], shown['reservations_today']), (2, 1, 1)
+        )
+        self.assertEqual(
+            (shown['total_invoices'], shown['total_revenue'], shown['unpaid_invoices']), (5, 12.5, 1)
+        )
+        self.assertEqual(len(shown['monthly_revenue_data']), dashboard.REVENUE_MONTHS)
+        self.assertEqual(sum(shown['monthly_revenue_data']), 12.5)
+        # The rental from 62 days ago is outside the 30-day window
+        self.assertEqual(shown['popular_books_data'], [4])
+
+    def count_queries(self):
+        # Measure with the KPIs recomputed, the most a request can cost
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('library:dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_history(self):
+        self.client.force_login(self.employee)
+        now = timezone.now()
+        self.add_rentals(1, now)
+        baseline = self.count_queries()
+        for days in range(0, 200, 3):
+            self.add_rentals(2, now - timedelta(days=days), returned=now - timedelta(days=days // 2))
+        queries = self.count_queries()
+        self.assertEqual(queries, baseline, 'dashboard query count grows with the data')
+        self.assertLessEqual(queries, self.QUERY_BUDGET, 'dashboard exceeds its query budget')
+
+
+class DashboardAPITests(TestCase):
+    """Dashboard widgets are served with validators that cost no query"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('employee', password='pw', is_staff=True))
+
+    def test_unchanged_dashboard_is_not_modified_without_widget_queries(self):
+        response = self.client.get('/api/dashboard/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()['widgets']), set(dashboard.WIDGETS))
+        versions = {name: widget['version'] for name, widget in response.json()['widgets'].items()}
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/dashboard/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([query for query in queries if 'PJI_' in query['sql']])
+
+        now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            Reservation.objects.create(topic_desc='Study', start_dt=now, end_dt=now + timedelta(hours=1), group_size=1)
+        response = self.client.get('/api/dashboard/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        widgets = response.json()['widgets']
+        self.assertEqual(widgets['today']['data']['reservations'], 1)
+        self.assertNotEqual(widgets['today']['version'], versions['today'])
+        self.assertEqual(widgets['invoices']['version'], versions['invoices'])
+
+    def test_versions_expire(self):
+        response = self.client.get('/api/dashboard/invoices/')
+        self.assertEqual(
+            self.client.get('/api/dashboard/invoices/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304
+        )
+        # A worker whose cache missed a write still moves on once the times expire
+        with mock.patch('time.time', return_value=time.time() + dashboard.VERSION_TTL + 1):
+            response = self.client.get('/api/dashboard/invoices/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_single_widget(self):
+        response = self.client.get('/api/dashboard/weekly_activity/')
+        self.assertEqual(list(response.json()['widgets']), ['weekly_activity'])
+        self.assertEqual(len(response.json()['widgets']['weekly_activity']['data']['rentals']), dashboard.WEEK_DAYS)
+        self.assertEqual(
+            self.client.get('/api/dashboard/weekly_activity/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code,
+            304,
+        )
+        self.assertEqual(self.client.get('/api/dashboard/nonsense/').status_code, 404)
+
+        self.client.force_authenticate(User.objects.create_user('reader', password='pw'))
+        self.assertEqual(self.client.get('/api/dashboard/').status_code, 403)
+
+
+class LeaderboardTests(TestCase):
+    """Window counters follow rentals incrementally and decay to what a rebuild gives"""
+
+    def setUp(self):
+        self.customer = Customer.objects.create(
+            fname='Ada', lname='Reader', phone='555', email='ada@example.com', id_type='SSN', id_no='1'
+        )
+        self.books = [
+            Book.objects.create(book_name=f'Volume {n}', available_copies=0, total_copies=0) for n in range(3)
+        ]
+        self.now = timezone.now()
+        self.today = timezone.localdate()
+
+    def borrow(self, book, days_ago):
+        when = self.now - timedelta(days=days_ago)
+        return Rental.objects.create(
+            book_copy=BookCopy.objects.create(book=book, status='not available'), customer=self.customer,
+            status='Borrowed', borrow_date=when, exp_return_dt=when + timedelta(days=14),
+        )
+
+    def counters(self):
+        return {
+            row['book_id']: (row['checkouts_7d'], row['checkouts_30d'], row['checkouts_365d'])
+            for row in BookPopularity.objects.values()
+            if row['checkouts_365d']
+        }
+
+    def test_rentals_count_towards_the_windows_covering_their_day(self):
+        first, second, third = self.books
+        self.borrow(first, 0)
+        self.borrow(first, 6)
+        self.borrow(first, 10)
+        self.borrow(first, 20)
+        self.borrow(second, 0)
+        self.borrow(second, 1)
+        self.borrow(second, 2)
+        self.borrow(third, 100).delete()
+        self.borrow(third, 400)
+
+        self.assertEqual(self.counters(), {first.book_id: (2, 4, 4), second.book_id: (3, 3, 3)})
+        self.assertEqual(
+            [(book.book_id, checkouts) for book, checkouts in leaderboard.top_books('7d')],
+            [(second.book_id, 3), (first.book_id, 2)],
+        )
+        self.assertEqual([book.book_id for book, _checkouts in leaderboard.top_books('30d', 1)], [first.book_id])
+
+        with CaptureQueriesContext(connection) as queries:
+            leaderboard.top_books('365d')
+        self.assertFalse([query for query in queries if 'PJI_RENTAL' in query['sql']])
+
+        with self.assertRaises(ValueError):
+            leaderboard.top_books('1d')
+
+    def test_moved_rental_moves_its_checkout_with_one_read(self):
+        first, second, _third = self.books
+        rental = self.borrow(first, 0)
+        rental.book_copy = BookCopy.objects.create(book=second, status='not available')
+        rental.borrow_date = self.now - timedelta(days=10)
+        with CaptureQueriesContext(connection) as queries:
+            rental.save()
+        reads = [query for query in queries if query['sql'].startswith('SELECT') and 'FROM "PJI_RENTAL"' in query['sql']]
+        self.assertEqual(len(reads), 1)
+        self.assertEqual(self.counters(), {second.book_id: (0, 1, 1)})
+
+    def test_decay_drops_expired_days_and_matches_rebuild(self):
+        first, second, _third = self.books
+        self.borrow(first, 0)
+        self.borrow(first, 5)
+        self.borrow(second, 25)
+        self.borrow(second, 300)
+
+        later = self.today + timedelta(days=70)
+        leaderboard.decay(today=later, lookback=100)
+        self.assertEqual(self.counters(), {first.book_id: (0, 0, 2), second.book_id: (0, 0, 1)})
+        decayed = self.counters()
+        leaderboard.rebuild(today=later)
+        self.assertEqual(self.counters(), decayed)
+
+        call_command('decay_popularity', stdout=StringIO())
+        leaderboard.decay(today=self.today + timedelta(days=361), lookback=100)
+        self.assertEqual(self.counters(), {first.book_id: (0, 0, 1)})
+        self.assertFalse(BookDailyCheckouts.objects.filter(book=second).exists())
+
+    def test_popular_endpoint(self):
+        self.borrow(self.books[1], 0)
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('reader', password='pw'))
+        response = client.get('/api/books/popular/', {'window': '30d', 'limit': 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['window'], '30d')
+        self.assertEqual(
+            [(row['book']['book_id'], row['checkouts']) for row in response.json()['results']],
+            [(self.books[1].book_id, 1)],
+        )
+        self.assertEqual(client.get('/api/books/popular/', {'window': 'forever'}).status_code, 400)
+        self.assertEqual(client.get('/api/books/popular/', {'limit': 0}).status_code, 400)
+
+
+class DailyStatsTests(TestCase):
+    """The daily rollup follows every write and matches a rebuild from the source tables"""
+
+    def setUp(self):
+        self.book = Book.objects.create(book_name='Volume', available_copies=0, total_copies=0)
+        self.customer = Customer.objects.create(
+            fname='Ada', lname='Reader', phone='555', email='ada@example.com', id_type='SSN', id_no='1'
+        )
+        self.now = timezone.now()
+        self.today = timezone.localdate()
+
+    def borrow(self, when, amount='5.00'):
+        invoice = Invoice.objects.create(invoice_date=when, invoice_amt=float(amount))
+        return Rental.objects.create(
+            book_copy=BookCopy.objects.create(book=self.book, status='not available'), invoice=invoice,
+            customer=self.customer, status='Borrowed', borrow_date=when, exp_return_dt=when + timedelta(days=14),
+        )
+
+    def rollup(self):
+        return {
+            row.pop('stat_date'): row
+            for row in stats.by_day(DailyLibraryStats.objects.all())
+            if any(row[column] for column in stats.COLUMNS)
+        }
+
+    def test_incremental_rollup_matches_rebuild(self):
+        event = Event.objects.create(
+            event_name='Opening', start_dt=self.now, end_dt=self.now + timedelta(days=2), attd_no=5, event_type='E'
+        )
+        Exhibition.objects.create(event=event, expenses=Decimal('0.00'))
+        exhibitions.register(event, self.customer)
+
+        returned = self.borrow(self.now - timedelta(days=3))
+        returned.transition(status='Returned', actual_return_dt=self.now - timedelta(days=1))
+        lost = self.borrow(self.now - timedelta(days=40), amount='7.25')
+        lost.transition(status='Lost', actual_return_dt=self.now)
+        self.borrow(self.now)
+        invoice = lost.invoice
+        invoice.invoice_amt = Decimal('30.00')
+        invoice.save()
+        Payment.objects.create(payment_date=self.now, pay_method='Cash', payment_amt=Decimal('30.00'), invoice=invoice)
+        Reservation.objects.create(topic_desc='Kept', start_dt=self.now, end_dt=self.now, group_size=1)
+        Reservation.objects.create(topic_desc='Cancelled', start_dt=self.now, end_dt=self.now, group_size=1).delete()
+
+        today = stats.daily(self.today, self.today + timedelta(days=1))[0]
+        self.assertEqual(
+            (today.rentals_opened, today.lost, today.reservations, today.exhibition_registrations, today.invoices_issued),
+            (1, 1, 1, 1, 1),
+        )
+        self.assertEqual(today.payments_received, Decimal('30.00'))
+        self.assertEqual(stats.totals()['revenue_invoiced'], Decimal('40.00'))
+
+        incremental = self.rollup()
+        DailyLibraryStats.objects.all().delete()
+        call_command('backfill_stats', chunk_days=7, workers=1, stdout=StringIO())
+        self.assertEqual(self.rollup(), incremental)
+
+    def test_closing_again_moves_the_return_to_the_new_day(self):
+        rental = self.borrow(self.now - timedelta(days=5))
+        rental.transition(status='Returned', actual_return_dt=self.now - timedelta(days=2))
+        rental.transition(status='Returned', actual_return_dt=self.now)
+        returns = [row.returns for row in stats.daily(self.today - timedelta(days=2), self.today + timedelta(days=1))]
+        self.assertEqual(returns, [0, 0, 1])
+
+    def test_rolled_back_write_leaves_rollup_unchanged(self):
+        self.borrow(self.now)
+        before = self.rollup()
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.borrow(self.now)
+            raise RuntimeError
+        self.assertEqual(self.rollup(), before)
+
+    def test_slots_are_summed(self):
+        with mock.patch.object(stats.random, 'randrange', side_effect=[0, 1, 1]):
+            for n in range(3):
+                Reservation.objects.create(topic_desc=f'Study {n}', start_dt=self.now, end_dt=self.now, group_size=1)
+        self.assertEqual(DailyLibraryStats.objects.filter(stat_date=self.today).count(), 2)
+        self.assertEqual(stats.daily(self.today, self.today + timedelta(days=1))[0].reservations, 3)
+        self.assertEqual(stats.totals()['reservations'], 3)
+
+
+class DailyStatsConcurrencyTests(TransactionTestCase):
+    """Concurrent writers of one day spread over its slots and lose no increments"""
+
+    WRITERS = 8
+
+    def test_concurrent_invoices(self):
+        barrier = threading.Barrier(self.WRITERS)
+        errors = []
+
+        def invoice():
+            Invoice.objects.create(invoice_date=timezone.now(), invoice_amt=Decimal('2.50'))
+
+        def writer():
+            try:
+                barrier.wait()
+                run_in_transaction(invoice, attempts=50, base_delay=0.005)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        # SQLite reports concurrent writers as "database is locked"; let them all retry
+        with mock.patch.object(retry, 'budget', retry.RetryBudget(ratio=1, reserve=1000)), \
+                mock.patch.object(retry.logger, 'warning'):
+            threads = [threading.Thread(target=writer) for _ in range(self.WRITERS)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
+        today = timezone.localdate()
+        row = stats.daily(today, today + timedelta(days=1))[0]
+        self.assertEqual((row.invoices_issued, row.revenue_invoiced), (self.WRITERS, Decimal('20.00')))
+        self.assertLessEqual(DailyLibraryStats.objects.filter(stat_date=today).count(), stats.SLOTS)
+
+
+class KpiSnapshotTests(TestCase):
+    """Headline counters are served from the cache until a write makes them dirty"""
+
+    def setUp(self):
+        cache.clear()
+        Book.objects.create(book_name='Volume')
+
+    def test_cached_until_a_write_marks_the_group_dirty(self):
+        self.assertEqual(kpis.snapshot()['total_books'], 1)
+        with self.assertNumQueries(0):
+            kpis.snapshot()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.create(book_name='Another')
+        with self.assertNumQueries(1):
+            self.assertEqual(kpis.snapshot()['total_books'], 2)
+
+    def test_stale_value_is_served_while_another_request_recomputes(self):
+        kpis.snapshot(['catalog'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.create(book_name='Another')
+        cache.add(kpis._lock_key('catalog'), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(kpis.snapshot(['catalog'])['total_books'], 1)
+
+    def test_concurrent_misses_recompute_once(self):
+        calls = []
+
+        def slow_count():
+            calls.append(1)
+            time.sleep(0.2)
+            return {'total_books': 7}
+
+        with mock.patch.dict(kpis.GROUPS, {'catalog': (slow_count, (Book,))}), \
+                mock.patch.object(kpis, 'WAIT_INTERVAL', 0.01):
+            results = []
+            threads = [
+                threading.Thread(target=lambda: results.append(kpis.snapshot(['catalog'])['total_books']))
+                for _ in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual((len(calls), results), (1, [7] * 8))
+
+    def test_endpoint_shows_invoice_figures_to_employees_only(self):
+        public = self.client.get(reverse('library:kpis')).json()['kpis']
+        self.assertEqual(public['total_books'], 1)
+        self.assertNotIn('unpaid_invoices', public)
+
+        self.client.force_login(User.objects.create_user('employee', password='pw', is_staff=True))
+        self.assertIn('unpaid_invoices', self.client.get(reverse('library:kpis')).json()['kpis'])
+
+
+@override_settings(LIBRARY_READ_REPLICAS=['replica'])
+class ReplicaRouterTests(SimpleTestCase):
+    """Reads go to the replica unless they need to see the primary's latest writes"""
+
+    def setUp(self):
+        self.router = db_router.ReplicaRouter()
+
+    def read_alias_during(self, request):
+        seen = []
+
+        def view(request):
+            seen.append(self.router.db_for_read(Book))
+            return HttpResponse()
+
+        response = db_router.ReplicaRoutingMiddleware(view)(request)
+        return seen[0], response
+
+    def test_library_reads_use_replica(self):
+        self.assertEqual(self.router.db_for_read(Book), 'replica')
+        self.assertEqual(self.router.db_for_write(Book), 'default')
+
+    def test_other_apps_read_primary(self):
+        self.assertEqual(self.router.db_for_read(User), 'default')
+
+    @override_settings(LIBRARY_READ_REPLICAS=[])
+    def test_without_replicas_everything_uses_primary(self):
+        self.assertEqual(self.router.db_for_read(Book), 'default')
+
+    def test_pinned_reads_use_primary(self):
+        with db_router.primary():
+            self.assertEqual(self.router.db_for_read(Book), 'default')
+        self.assertEqual(db_router.use_primary(lambda: self.router.db_for_read(Book))(), 'default')
+        self.assertEqual(self.router.db_for_read(Book), 'replica')
+
+    def test_reads_inside_a_transaction_use_primary(self):
+        with mock.patch.object(connections['default'], 'in_atomic_block', True):
+            self.assertEqual(self.router.db_for_read(Book), 'default')
+
+    def test_client_sticks_to_primary_after_a_write(self):
+        factory = RequestFactory()
+        alias, _response = self.read_alias_during(factory.get('/books/'))
+        self.assertEqual(alias, 'replica')
+
+        alias, response = self.read_alias_during(factory.post('/books/create/'))
+        self.assertEqual(alias, 'default')
+        self.assertIn(db_router.STICKY_COOKIE, response.cookies)
+
+        request = factory.get('/books/')
+        request.COOKIES[db_router.STICKY_COOKIE] = '1'
+        alias, _response = self.read_alias_during(request)
+        self.assertEqual(alias, 'default')
+
+    def test_migrations_run_on_primary_only(self):
+        self.assertTrue(self.router.allow_migrate('default', 'library'))
+        self.assertFalse(self.router.allow_migrate('replica', 'library'))
@@ -0,0 +1,231 @@
+"""
+In-process prefix index backing the catalog typeahead.
+
+Book titles and author names are normalized into sorted keys so a prefix
+lookup is a ``bisect`` plus a short forward scan. Every word of a name is
+indexed, so "pot" finds "Harry Potter". The index is:
+
+* built lazily on first use,
+* kept current in this process by the Book/Author signal handlers below,
+* rebuilt after ``LIBRARY_TYPEAHEAD_TTL`` seconds so that writes made by other
+  worker processes show up eventually; lookups keep using the old entries
+  while the rebuild runs,
+* capped at ``LIBRARY_TYPEAHEAD_MAX_ENTRIES`` keys to bound memory; the
+  catalog is streamed and reading stops at the cap.
+"""
+import bisect
+import logging
+import re
+import threading
+import time
+from contextlib import closing
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Author, Book
+
+logger = logging.getLogger(__name__)
+
+MAX_ENTRIES = getattr(settings, 'LIBRARY_TYPEAHEAD_MAX_ENTRIES', 200000)
+INDEX_TTL = getattr(settings, 'LIBRARY_TYPEAHEAD_TTL', 300)
+
+# Only the first few words of a long title get their own key
+MAX_WORDS_PER_NAME = 5
+
+# Matches examined per lookup before ranking
+SCAN_LIMIT = 200
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize(text):
+    return ' '.join(_WORD_RE.findall(text.lower()))
+
+
+def index_keys(label):
+    """Return the keys a label is reachable under: the whole name, then each later word"""
+    words = normalize(label).split()[:MAX_WORDS_PER_NAME]
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+class PrefixIndex:
+    """Sorted-array prefix index over (kind, id, label) entries.
+
+    Lookups hold ``_lock`` only for the bisect and scan. A rebuild reads the
+    catalog without it, while lookups keep using the previous arrays, and
+    swaps the new ones in at the end. Updates and removals made meanwhile
+    are applied to both, so a rebuild that started before them cannot undo
+    them. Only the very first build makes lookups wait.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=INDEX_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._keys = []
+        self._entries = []
+        self._labels = {}
+        self._built = False
+        self._fresh_until = 0
+        # Changes to replay on the arrays being built, while a rebuild runs
+        self._pending = None
+
+    def _read_catalog(self):
+        """Yield every (kind, id, label) to index, streaming rows from the database"""
+        for book_id, book_name in Book.objects.values_list('book_id', 'book_name').iterator():
+            yield 'book', book_id, book_name
+        for author_id, fname, lname in Author.objects.values_list('author_id', 'fname', 'lname').iterator():
+            yield 'author', author_id, f"{fname} {lname}"
+
+    def _build(self):
+        """New (keys, entries, labels) arrays from the database"""
+        labels = {}
+        rows = []
+        # Closing the catalog at the cap stops reading it and closes its cursor
+        with closing(self._read_catalog()) as catalog:
+            for kind, pk, label in catalog:
+                keys = index_keys(label)
+                if len(rows) + len(keys) > self.max_entries:
+                    logger.warning(
+                        "Typeahead index capped at %s entries; remaining names are not indexed.",
+                        self.max_entries
+                    )
+                    break
+                labels[(kind, pk)] = label
+                rows.extend((key, kind, pk) for key in keys)
+
+        rows.sort()
+        return [row[0] for row in rows], [(row[1], row[2]) for row in rows], labels
+
+    def _is_stale(self):
+        return not self._built or time.monotonic() > self._fresh_until
+
+    def _refresh(self):
+        """Rebuild the index if it is stale and no other thread is rebuilding it.
+
+        Before the first build every caller waits for it; afterwards a
+        caller that finds a rebuild running returns at once and reads the
+        previous arrays.
+        """
+        if not self._build_lock.acquire(blocking=not self._built):
+            return
+        try:
+            if not self._is_stale():
+                return
+            with self._lock:
+                self._pending = []
+            keys, entries, labels = self._build()
+            with self._lock:
+                self._keys, self._entries, self._labels = keys, entries, labels
+                for change in self._pending:
+                    change()
+                self._built = True
+                self._fresh_until = time.monotonic() + self.ttl
+        finally:
+            with self._lock:
+                self._pending = None
+            self._build_lock.release()
+
+    def invalidate(self):
+        """Rebuild on the next lookup, serving the current entries until then"""
+        with self._lock:
+            self._fresh_until = 0
+
+    def _remove(self, kind, pk):
+        label = self._labels.pop((kind, pk), None)
+        if label is None:
+            return
+        for key in index_keys(label):
+            position = bisect.bisect_left(self._keys, key)
+            while position < len(self._keys) and self._keys[position] == key:
+                if self._entries[position] == (kind, pk):
+                    del self._keys[position]
+                    del self._entries[position]
+                    break
+                position += 1
+
+    def _update(self, kind, pk, label):
+        self._remove(kind, pk)
+        keys = index_keys(label)
+        if len(self._keys) + len(keys) > self.max_entries:
+            return
+        self._labels[(kind, pk)] = label
+        for key in keys:
+            position = bisect.bisect_right(self._keys, key)
+            self._keys.insert(position, key)
+            self._entries.insert(position, (kind, pk))
+
+    def _apply(self, change):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(change)
+            if self._built:
+                change()
+
+    def update(self, kind, pk, label):
+        """Add or replace one entry; no-op until the index has been built"""
+        self._apply(lambda: self._update(kind, pk, label))
+
+    def remove(self, kind, pk):
+        self._apply(lambda: self._remove(kind, pk))
+
+    def complete(self, prefix, limit=10):
+        """Return up to ``limit`` matches for a prefix, whole-name matches first"""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        if self._is_stale():
+            self._refresh()
+        with self._lock:
+            position = bisect.bisect_left(self._keys, prefix)
+            seen = {}
+            while (position < len(self._keys) and len(seen) < SCAN_LIMIT
+                   and self._keys[position].startswith(prefix)):
+                kind, pk = self._entries[position]
+                label = self._labels[(kind, pk)]
+                starts_name = normalize(label).startswith(prefix)
+                rank = (0 if starts_name else 1, len(label), label.lower())
+                if (kind, pk) not in seen or rank < seen[(kind, pk)][0]:
+                    seen[(kind, pk)] = (rank, label)
+                position += 1
+
+        matches = sorted(
+            ((rank, kind, pk, label) for (kind, pk), (rank, label) in seen.items())
+        )[:limit]
+        return [{'type': kind, 'id': pk, 'label': label} for _rank, kind, pk, label in matches]
+
+
+index = PrefixIndex()
+
+
+def complete(prefix, limit=10):
+    return index.complete(prefix, limit)
+
+
+# Keep this process' index in step with committed catalog writes
+
+@receiver(post_save, sender=Book)
+def index_saved_book(sender, instance, raw=False, **kwargs):
+    if not raw:
+        book_id, book_name = instance.book_id, instance.book_name
+        transaction.on_commit(lambda: index.update('book', book_id, book_name))
+
+@receiver(post_delete, sender=Book)
+def unindex_deleted_book(sender, instance, **kwargs):
+    book_id = instance.book_id
+    transaction.on_commit(lambda: index.remove('book', book_id))
+
+@receiver(post_save, sender=Author)
+def index_saved_author(sender, instance, raw=False, **kwargs):
+    if not raw:
+        author_id, full_name = instance.author_id, instance.full_name
+        transaction.on_commit(lambda: index.update('author', author_id, full_name))
+
+@receiver(post_delete, sender=Author)
+def unindex_deleted_author(sender, instance, **kwargs):
+    author_id = instance.author_id
+    transaction.on_commit(lambda: index.remove('author', author_id))
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 app_name = 'library'
 
@@ -7,6 +7,8 @@ urlpatterns = [
     # Home and Dashboard
     path('', views.home, name='home'),
     path('management/', views.library_management_dashboard, name='dashboard'),
+    path('management/metrics/', views.operational_metrics, name='operational_metrics'),
+    path('kpis/', views.kpi_snapshot, name='kpis'),
     
     # Author Authentication
     path('author/login/', views.author_login, name='author_login'),
@@ -55,6 +57,7 @@ urlpatterns = [
     path('reservations/', views.my_reservations, name='my_reservations'),
     path('reservations/<int:reserve_id>/cancel/', views.cancel_reservation, name='cancel_reservation'),
     path('rooms/bookings/', views.study_room_bookings, name='study_room_bookings'),
+    path('availability/stream/', views.availability_stream, name='availability_stream'),
     
     # Invoices and Payments
     path('invoices/', views.invoice_list, name='invoice_list'),
@@ -63,4 +66,11 @@ urlpatterns = [
     
     # Profile
     path('profile/', views.profile, name='profile'),
+    
+    # Async versions of the busiest read paths, for ASGI deployments
+    path('async/', async_views.home, name='async_home'),
+    path('async/books/', async_views.book_list, name='async_book_list'),
+    path('async/books/<int:book_id>/', async_views.book_detail, name='async_book_detail'),
+    path('async/events/', async_views.event_list, name='async_event_list'),
+    path('async/rooms/', async_views.study_room_list, name='async_study_room_list'),
 ]
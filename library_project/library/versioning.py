@@ -0,0 +1,89 @@
+"""
+Optimistic concurrency for copy and rental state changes.
+
+``BookCopy`` and ``Rental`` carry a ``version`` column. A state change
+goes through ``transition()``, which issues one UPDATE,
+
+    UPDATE PJI_RENTAL SET STATUS = %s, ..., VERSION = VERSION + 1
+    WHERE RENTAL_ID = %s AND VERSION = %s
+
+writing only the columns that change. If another transaction changed the
+row since it was read, the UPDATE matches nothing and
+``ConcurrentUpdateError`` is raised, instead of one write silently
+overwriting the other. No row lock is held between the read and the
+write.
+
+``ConcurrentUpdateError`` is retriable: ``@transactional`` views roll back,
+re-read the row and run again (see library.retry). A ``save()`` of an
+existing row is guarded the same way: it writes only if the row is still
+at the version the instance read, raising ``ConcurrentUpdateError``
+otherwise, and bumps the version, so an admin edit also invalidates stale
+copies held elsewhere.
+
+A successful transition sends ``transitioned`` with the values it replaced,
+since the UPDATE sends no ``post_save``.
+"""
+from django.db.models import F
+from django.dispatch import Signal
+
+from . import metrics
+
+CONFLICTS = 'versioning.conflicts'
+metrics.register(CONFLICTS)
+
+# Sent after a transition is written: sender, instance, and previous, the
+# replaced values by field name (ids for foreign keys)
+transitioned = Signal()
+
+
+class ConcurrentUpdateError(Exception):
+    """The row changed since it was read; re-read it and try again"""
+
+
+class VersionedModel:
+    """Mixin for models with a ``version`` field; list it before models.Model"""
+
+    def transition(self, **changes):
+        """Write ``changes`` if the row is still at the version this instance read.
+
+        Raises ConcurrentUpdateError otherwise. On success the instance
+        holds the new values and version.
+        """
+        previous = {name: getattr(self, self._meta.get_field(name).attname) for name in changes}
+        updated = type(self)._default_manager.filter(pk=self.pk, version=self.version).update(
+            version=F('version') + 1, **changes
+        )
+        if not updated:
+            metrics.incr(CONFLICTS)
+            raise ConcurrentUpdateError(
+                f'{type(self).__name__} {self.pk} was changed by another request.'
+            )
+        for name, value in changes.items():
+            setattr(self, name, value)
+        self.version += 1
+        transitioned.send(sender=type(self), instance=self, previous=previous)
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            super().save(*args, **kwargs)
+            return
+        self.version += 1
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'version'}
+        try:
+            super().save(*args, **kwargs)
+        except ConcurrentUpdateError:
+            self.version -= 1
+            raise
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        if self._state.adding:
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        # save() has already bumped the version this instance read
+        if super()._do_update(
+            base_qs.filter(version=self.version - 1), using, pk_val, values, update_fields, forced_update
+        ):
+            return True
+        metrics.incr(CONFLICTS)
+        raise ConcurrentUpdateError(f'{type(self).__name__} {self.pk} was changed by another request.')
@@ -1,13 +1,17 @@
 from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required, permission_required
-from django.db import transaction
-from django.db.models import Q, Count, Sum
-from django.core.paginator import Paginator
+from django.db.models import Q
 from django.contrib import messages
 from django.utils import timezone
-from django.http import JsonResponse, HttpResponseForbidden
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, HttpResponseForbidden, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 import json
 from datetime import timedelta
@@ -29,6 +33,18 @@ from .serializers import (
 )
 from .permissions import IsEmployee, IsCustomerOrEmployee, IsCustomerOrReadOnly
 from .decorators import employee_required, customer_required, admin_required, author_required
+from .search import search_books
+from .facets import filter_books, get_facets, normalize_filters
+from .recommendations import recommendations_for
+from .book_cache import get_book_detail
+from .inventory import MAX_NEW_COPIES, add_copies, set_copy_status
+from .booking import BookingError, book_room
+from .checkout import CopyUnavailable, checkout_copy, claim_copy
+from .retry import TransactionalViewSetMixin, is_retriable, transactional
+from .db_router import use_primary
+from .idempotency import IdempotentViewSetMixin, idempotent
+from .pagination import COUNT_ESTIMATE, KeysetPagination, KeysetPaginator
+from . import availability, book_cache, dashboard, exhibitions, kpis, leaderboard, metrics, typeahead
 
 # Home and Dashboard Views
 def home(request):
@@ -37,9 +53,8 @@ def home(request):
     if request.user.is_authenticated and request.user.groups.filter(name='Employees').exists():
         return redirect('library:dashboard')
     
-    # Get library statistics
-    total_books = Book.objects.count()
-    active_rentals = Rental.objects.filter(status='Borrowed').count()
+    # Get library statistics (cached, see library.kpis)
+    counters = kpis.snapshot(kpis.PUBLIC_GROUPS)
     
     # Get upcoming exhibitions only
     upcoming_events = Event.objects.filter(
@@ -47,27 +62,22 @@ def home(request):
         event_type='E'  # Only exhibitions
     ).order_by('start_dt')[:3]
     
-    # Get available study rooms (rooms without active reservations)
-    now = timezone.now()
-    available_rooms = StudyRoom.objects.exclude(
-        reservation__start_dt__lte=now,
-        reservation__end_dt__gt=now
-    ).count()
-    
     # Get featured books (books with available copies)
-    featured_books = Book.objects.filter(
-        bookcopy__status='available'
-    ).distinct()[:4]
+    featured_books = Book.objects.filter(available_copies__gt=0)[:4]
+    
+    # Most borrowed this week (see library.leaderboard)
+    trending_books = leaderboard.top_books('7d', 5)
     
     # Check if user is an author (has author_id in session)
     is_author = 'author_id' in request.session if request.user.is_authenticated else False
     
     context = {
-        'total_books': total_books,
-        'active_rentals': active_rentals,
-        'available_rooms': available_rooms,
+        'total_books': counters['total_books'],
+        'active_rentals': counters['active_rentals'],
+        'available_rooms': counters['available_rooms'],
         'upcoming_events': upcoming_events,
         'featured_books': featured_books,
+        'trending_books': trending_books,
         'is_authenticated': request.user.is_authenticated,
         'is_employee': request.user.groups.filter(name='Employees').exists() if request.user.is_authenticated else False,
         'is_author': is_author,
@@ -78,63 +88,7 @@ def home(request):
 @employee_required
 def library_management_dashboard(request):
     """Library management dashboard with key metrics and activities for staff"""
-    # Today's activity
-    today = timezone.now().date()
-    new_rentals_today = Rental.objects.filter(
-        borrow_date__date=today
-    ).count()
-    returns_today = Rental.objects.filter(
-        actual_return_dt__date=today
-    ).count()
-    reservations_today = Reservation.objects.filter(
-        start_dt__date=today
-    ).count()
-    
-    # Weekly activity data
-    week_dates = [(today - timezone.timedelta(days=i)) for i in range(6, -1, -1)]
-    weekly_rentals = []
-    weekly_returns = []
-    weekly_labels = []
-    
-    for date in week_dates:
-        weekly_rentals.append(
-            Rental.objects.filter(borrow_date__date=date).count()
-        )
-        weekly_returns.append(
-            Rental.objects.filter(actual_return_dt__date=date).count()
-        )
-        weekly_labels.append(date.strftime('%a'))
-    
-    # Popular books data
-    popular_books = Book.objects.annotate(
-        rental_count=Count('bookcopy__rental')
-    ).order_by('-rental_count')[:5]
-    
-    popular_books_labels = [f"{book.book_name[:20]}..." if len(book.book_name) > 20 
-                          else book.book_name for book in popular_books]
-    popular_books_data = [book.rental_count for book in popular_books]
-    
-    # Monthly revenue data
-    last_6_months = [(today - timezone.timedelta(days=30*i)) for i in range(5, -1, -1)]
-    monthly_revenue_data = []
-    monthly_revenue_labels = []
-    
-    for month_date in last_6_months:
-        month_start = month_date.replace(day=1)
-        if month_date.month == 12:
-            month_end = month_date.replace(year=month_date.year + 1, month=1, day=1)
-        else:
-            month_end = month_date.replace(month=month_date.month + 1, day=1)
-            
-        # Calculate monthly revenue using aggregation
-        month_revenue = Invoice.objects.filter(
-            invoice_date__range=[month_start, month_end]
-        ).aggregate(
-            total=Sum('invoice_amt')
-        )['total'] or 0.0  # Use 0.0 if no invoices found
-        
-        monthly_revenue_data.append(float(month_revenue))
-        monthly_revenue_labels.append(month_date.strftime('%b %Y'))
+    stats = dashboard.dashboard_metrics()
     
     # Overdue rentals
     overdue_rentals = Rental.objects.filter(
@@ -142,76 +96,79 @@ def library_management_dashboard(request):
         exp_return_dt__lt=timezone.now()
     ).select_related('customer', 'book_copy', 'book_copy__book')
     
-    # Revenue stats - Fixed calculations
-    total_invoices = Invoice.objects.count()
-    
-    # Calculate total revenue by summing all invoice amounts
-    total_revenue = float(sum(
-        invoice.invoice_amt for invoice in Invoice.objects.all()
-    ))
-    
-    # Calculate unpaid invoices by checking if there are any payments
-    unpaid_invoices = Invoice.objects.filter(
-        payment__isnull=True
-    ).count()
-    
     context = {
-        'new_rentals_today': new_rentals_today,
-        'returns_today': returns_today,
-        'reservations_today': reservations_today,
+        'new_rentals_today': stats['new_rentals_today'],
+        'returns_today': stats['returns_today'],
+        'reservations_today': stats['reservations_today'],
         'overdue_rentals': overdue_rentals,
-        'total_invoices': total_invoices,
-        'total_revenue': total_revenue,
-        'unpaid_invoices': unpaid_invoices,
-        'weekly_labels': json.dumps(weekly_labels),
-        'weekly_rentals': json.dumps(weekly_rentals),
-        'weekly_returns': json.dumps(weekly_returns),
-        'popular_books_labels': json.dumps(popular_books_labels),
-        'popular_books_data': json.dumps(popular_books_data),
-        'monthly_revenue_labels': json.dumps(monthly_revenue_labels),
-        'monthly_revenue_data': json.dumps(monthly_revenue_data),
+        'total_invoices': stats['total_invoices'],
+        'total_revenue': stats['total_revenue'],
+        'unpaid_invoices': stats['unpaid_invoices'],
+        'weekly_labels': json.dumps(stats['weekly_labels']),
+        'weekly_rentals': json.dumps(stats['weekly_rentals']),
+        'weekly_returns': json.dumps(stats['weekly_returns']),
+        'popular_books_labels': json.dumps(stats['popular_books_labels']),
+        'popular_books_data': json.dumps(stats['popular_books_data']),
+        'monthly_revenue_labels': json.dumps(stats['monthly_revenue_labels']),
+        'monthly_revenue_data': json.dumps(stats['monthly_revenue_data']),
     }
     
     return render(request, 'library/dashboard.html', context)
 
+def kpi_snapshot(request):
+    """Headline counters as JSON; invoice figures for employees only"""
+    is_employee = request.user.is_authenticated and request.user.groups.filter(name='Employees').exists()
+    return JsonResponse({'kpis': kpis.snapshot(None if is_employee else kpis.PUBLIC_GROUPS)})
+
+@employee_required
+def operational_metrics(request):
+    """Operational counters (cache hits and misses etc.) as JSON (employee only)"""
+    counters = metrics.snapshot()
+    hits = counters.get(book_cache.HITS, 0)
+    misses = counters.get(book_cache.MISSES, 0)
+    return JsonResponse({
+        'counters': counters,
+        'book_detail_cache_hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+    })
+
 # Book Views
 @login_required
 def book_list(request):
-    """Display list of books with search functionality"""
+    """Display list of books with search, filters and facet counts"""
     search_query = request.GET.get('search', '')
-    category_id = request.GET.get('category', '')
+    filters = normalize_filters(
+        search=search_query,
+        topic=request.GET.get('category'),
+        author=request.GET.get('author'),
+        available=request.GET.get('available'),
+    )
     
-    books = Book.objects.all()
+    books = Book.objects.select_related('topic').prefetch_related('authors')
     
-    # Apply search filter
+    # Apply search filter (ranked full-text lookup, best match first)
     if search_query:
-        books = books.filter(
-            Q(book_name__icontains=search_query) |
-            Q(authors__fname__icontains=search_query) |
-            Q(authors__lname__icontains=search_query) |
-            Q(topic__topic_name__icontains=search_query)
-        ).distinct()
-    
-    # Apply category filter
-    if category_id:
-        books = books.filter(topic_id=category_id)
-    
-    # Add availability information
-    books = books.annotate(
-        available_copies=Count('bookcopy', filter=Q(bookcopy__status='available'))
-    )
+        books = search_books(search_query, books)
     
-    # Get all categories for the filter dropdown
-    categories = Topic.objects.all()
+    # Apply category, author and availability filters
+    books = filter_books(dict(filters, search=''), books)
     
-    # Pagination
-    paginator = Paginator(books, 12)  # Show 12 books per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Counts per topic, author and availability for the current filters
+    facets = get_facets(filters)
+    
+    # Keyset pagination: relevance order when searching, catalog order otherwise
+    ordering = ('-search_rank', 'book_id') if search_query else ('book_id',)
+    paginator = KeysetPaginator(books, 12, ordering=ordering, count=COUNT_ESTIMATE)  # Show 12 books per page
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    
+    # Active filters, carried over by the pagination links
+    filter_params = request.GET.copy()
+    filter_params.pop('cursor', None)
     
     context = {
         'books': page_obj,
-        'categories': categories,
+        'facets': facets,
+        'filters': filters,
+        'filter_query': filter_params.urlencode(),
         'search_query': search_query,
         'is_employee': request.user.groups.filter(name='Employees').exists()
     }
@@ -220,46 +177,30 @@ def book_list(request):
 @login_required
 def book_detail(request, book_id):
     """Display book details with availability"""
-    book = get_object_or_404(Book, book_id=book_id)
-    
-    # Get similar books based on topic
-    similar_books = Book.objects.filter(
-        topic=book.topic
-    ).exclude(
-        book_id=book.book_id
-    )[:3]
-    
-    # Get availability information
-    available_copies = book.bookcopy_set.filter(status='available').count()
+    is_employee = request.user.groups.filter(name='Employees').exists()
     
-    # Get rental history for employees
-    rental_history = None
-    if request.user.groups.filter(name='Employees').exists():
-        rental_history = Rental.objects.filter(
-            book_copy__book=book
-        ).select_related('customer').order_by('-borrow_date')[:5]
-    
-    context = {
-        'book': book,
-        'similar_books': similar_books,
-        'available_copies': available_copies,
-        'rental_history': rental_history,
-        'is_employee': request.user.groups.filter(name='Employees').exists()
-    }
+    # Book, availability, similar books and rental history come from a
+    # per-book cache invalidated by catalog and rental writes
+    context = dict(get_book_detail(book_id, is_employee), is_employee=is_employee)
     return render(request, 'library/book_detail.html', context)
 
 def book_search(request):
+    """Typeahead endpoint: title and author-name completions for a prefix"""
     query = request.GET.get('q', '')
-    if query:
-        books = Book.objects.filter(title__icontains=query) | \
-                Book.objects.filter(author__name__icontains=query) | \
-                Book.objects.filter(topic__name__icontains=query)
-    else:
-        books = Book.objects.none()
-    return render(request, 'library/book_search.html', {'books': books, 'query': query})
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), 25)
+    except ValueError:
+        limit = 10
+    
+    results = typeahead.complete(query, limit)
+    for result in results:
+        if result['type'] == 'book':
+            result['url'] = reverse('library:book_detail', args=[result['id']])
+    
+    return JsonResponse({'query': query, 'results': results})
 
 @employee_required
-@transaction.atomic
+@transactional
 def book_create(request):
     """Create a new book (employee only)"""
     if request.method == 'POST':
@@ -274,7 +215,7 @@ def book_create(request):
     return render(request, 'library/book_form.html', {'form': form, 'action': 'Create'})
 
 @employee_required
-@transaction.atomic
+@transactional
 def book_update(request, book_id):
     """Update book details (employee only)"""
     book = get_object_or_404(Book, book_id=book_id)
@@ -290,31 +231,27 @@ def book_update(request, book_id):
     return render(request, 'library/book_form.html', {'form': form, 'book': book, 'action': 'Update'})
 
 @employee_required
-@transaction.atomic
+@transactional
 def book_add_copies(request, book_id):
     """Add copies of a book (employee only)"""
     book = get_object_or_404(Book, book_id=book_id)
     
     if request.method == 'POST':
-        num_copies = int(request.POST.get('num_copies', 1))
-        
-        # Create new copies
-        for _ in range(num_copies):
-            try:
-                max_copy_id = BookCopy.objects.order_by('-copy_id').first().copy_id
-            except AttributeError:
-                max_copy_id = 0
-                
-            BookCopy.objects.create(
-                copy_id=max_copy_id + 1,
-                status='available',
-                book=book
-            )
+        try:
+            num_copies = int(request.POST.get('num_copies', 1))
+        except ValueError:
+            num_copies = 0
         
-        messages.success(request, f"Added {num_copies} new copies of '{book.book_name}'.")
-        return redirect('library:book_detail', book_id=book.book_id)
+        # One batched insert; counters are updated in the same transaction
+        try:
+            add_copies(book, num_copies)
+        except ValueError as e:
+            messages.error(request, str(e))
+        else:
+            messages.success(request, f"Added {num_copies} new copies of '{book.book_name}'.")
+            return redirect('library:book_detail', book_id=book.book_id)
     
-    return render(request, 'library/book_add_copies.html', {'book': book})
+    return render(request, 'library/book_add_copies.html', {'book': book, 'max_copies': MAX_NEW_COPIES})
 
 # Author Views
 def author_list(request):
@@ -331,9 +268,8 @@ def author_list(request):
         )
     
     # Pagination
-    paginator = Paginator(authors, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = KeysetPaginator(authors, 10, ordering=('author_id',))
+    page_obj = paginator.get_page(request.GET.get('cursor'))
     
     context = {
         'page_obj': page_obj,
@@ -356,21 +292,14 @@ def author_detail(request, author_id):
     return render(request, 'library/author_detail.html', context)
 
 @employee_required
-@transaction.atomic
+@transactional
 def author_create(request):
     """Create a new author (employee only)"""
     if request.method == 'POST':
         form = AuthorForm(request.POST)
         if form.is_valid():
-            # Get the next available author ID
-            try:
-                max_id = Author.objects.order_by('-author_id').first().author_id
-            except AttributeError:
-                max_id = 0
-                
-            author = form.save(commit=False)
-            author.author_id = max_id + 1
-            author.save()
+            # The id is assigned on insert by library.ids
+            author = form.save()
             
             messages.success(request, f"Author '{author.full_name}' created successfully.")
             return redirect('library:author_detail', author_id=author.author_id)
@@ -400,6 +329,7 @@ def author_update(request, author_id):
     })
 
 @author_required
+@transactional
 def author_seminar_registration(request):
     """Handle author registration for seminars"""
     if request.method == 'POST':
@@ -447,6 +377,9 @@ def author_seminar_registration(request):
             return redirect('library:author_detail', author_id=author.author_id)
 
         except Exception as e:
+            if is_retriable(e):
+                # Let @transactional roll back and run the view again
+                raise
             messages.error(request, f'Error registering for seminar: {str(e)}')
             return redirect('library:author_seminar_registration')
 
@@ -502,9 +435,8 @@ def customer_list(request):
         )
     
     # Pagination
-    paginator = Paginator(customers, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = KeysetPaginator(customers, 10, ordering=('cust_id',))
+    page_obj = paginator.get_page(request.GET.get('cursor'))
     
     context = {
         'page_obj': page_obj,
@@ -533,21 +465,14 @@ def customer_detail(request, cust_id):
     return render(request, 'library/customer_detail.html', context)
 
 @employee_required
-@transaction.atomic
+@transactional
 def customer_create(request):
     """Create a new customer (employee only)"""
     if request.method == 'POST':
         form = CustomerForm(request.POST)
         if form.is_valid():
-            # Get the next available customer ID
-            try:
-                max_id = Customer.objects.order_by('-cust_id').first().cust_id
-            except AttributeError:
-                max_id = 0
-                
-            customer = form.save(commit=False)
-            customer.cust_id = max_id + 1
-            customer.save()
+            # The id is assigned on insert by library.ids
+            customer = form.save()
             
             messages.success(request, f"Customer '{customer.full_name}' created successfully.")
             return redirect('library:customer_detail', cust_id=customer.cust_id)
@@ -649,36 +574,26 @@ def rental_detail(request, rental_id):
     return render(request, 'library/rental_detail.html', context)
 
 @employee_required
-@transaction.atomic
+@transactional
 def rental_create(request):
     """Create a new rental (employee only)"""
     if request.method == 'POST':
         form = RentalForm(request.POST)
         if form.is_valid():
-            # Get the next available rental ID
-            try:
-                max_id = Rental.objects.order_by('-rental_id').first().rental_id
-            except AttributeError:
-                max_id = 0
-            
             rental = form.save(commit=False)
-            rental.rental_id = max_id + 1
             rental.status = 'Borrowed'
             rental.borrow_date = timezone.now()
             
-            # Update book copy status
-            book_copy = rental.book_copy
-            book_copy.status = 'unavailable'
-            book_copy.save()
+            # Claim the selected copy; another checkout may have taken it
+            # since the form was rendered
+            try:
+                claim_copy(rental.book_copy)
+            except CopyUnavailable as e:
+                form.add_error('book_copy', str(e))
+                return render(request, 'library/rental_form.html', {'form': form})
             
             # Create initial rental invoice
-            try:
-                max_invoice_id = Invoice.objects.order_by('-invoice_id').first().invoice_id
-            except AttributeError:
-                max_invoice_id = 0
-                
             invoice = Invoice.objects.create(
-                invoice_id=max_invoice_id + 1,
                 invoice_date=timezone.now(),
                 invoice_amt=5.00  # Base rental fee
             )
@@ -695,7 +610,7 @@ def rental_create(request):
     return render(request, 'library/rental_form.html', {'form': form})
 
 @employee_required
-@transaction.atomic
+@transactional
 def rental_return(request, rental_id):
     """Process book return (employee only)"""
     rental = get_object_or_404(Rental, rental_id=rental_id)
@@ -705,37 +620,28 @@ def rental_return(request, rental_id):
         return redirect('library:rental_detail', rental_id=rental_id)
     
     if request.method == 'POST':
-        # Update rental status
-        rental.status = 'Returned'
-        rental.actual_return_dt = timezone.now()
+        actual_return_dt = timezone.now()
         
         # Update book copy status
         book_copy = rental.book_copy
-        book_copy.status = 'available'
-        book_copy.save()
+        set_copy_status(book_copy, 'available')
         
         # Calculate rental fee and late fees (if applicable)
         base_fee = 5.00  # Base rental fee
-        days_borrowed = (rental.actual_return_dt - rental.borrow_date).days
-        late_days = max(0, (rental.actual_return_dt - rental.exp_return_dt).days)
+        days_borrowed = (actual_return_dt - rental.borrow_date).days
+        late_days = max(0, (actual_return_dt - rental.exp_return_dt).days)
         late_fee = late_days * 1.00  # $1 per day late
         total_fee = base_fee + late_fee
         
         # Create invoice
-        try:
-            max_id = Invoice.objects.order_by('-invoice_id').first().invoice_id
-        except AttributeError:
-            max_id = 0
-            
         invoice = Invoice.objects.create(
-            invoice_id=max_id + 1,
             invoice_date=timezone.now(),
             invoice_amt=total_fee
         )
         
-        # Link invoice to rental
-        rental.invoice = invoice
-        rental.save()
+        # Close the rental; if another request got there first this
+        # raises and the view runs again against the current row
+        rental.transition(status='Returned', actual_return_dt=actual_return_dt, invoice=invoice)
         
         messages.success(
             request, 
@@ -747,7 +653,7 @@ def rental_return(request, rental_id):
     return render(request, 'library/rental_return.html', {'rental': rental})
 
 @employee_required
-@transaction.atomic
+@transactional
 def rental_mark_lost(request, rental_id):
     """Mark rental as lost (employee only)"""
     rental = get_object_or_404(Rental, rental_id=rental_id)
@@ -757,14 +663,9 @@ def rental_mark_lost(request, rental_id):
         return redirect('library:rental_detail', rental_id=rental_id)
     
     if request.method == 'POST':
-        # Update rental status
-        rental.status = 'Lost'
-        rental.actual_return_dt = timezone.now()
-        
         # Update book copy status
         book_copy = rental.book_copy
-        book_copy.status = 'lost'
-        book_copy.save()
+        set_copy_status(book_copy, 'lost')
         
         # Calculate fees (replacement cost + rental fee)
         replacement_cost = 25.00  # Base replacement cost
@@ -772,20 +673,13 @@ def rental_mark_lost(request, rental_id):
         total_fee = replacement_cost + rental_fee
         
         # Create invoice
-        try:
-            max_id = Invoice.objects.order_by('-invoice_id').first().invoice_id
-        except AttributeError:
-            max_id = 0
-            
         invoice = Invoice.objects.create(
-            invoice_id=max_id + 1,
             invoice_date=timezone.now(),
             invoice_amt=total_fee
         )
         
-        # Link invoice to rental
-        rental.invoice = invoice
-        rental.save()
+        # Close the rental
+        rental.transition(status='Lost', actual_return_dt=timezone.now(), invoice=invoice)
         
         messages.success(
             request, 
@@ -802,9 +696,9 @@ def event_list(request):
     now = timezone.now()
     
     # Get exhibitions (available to all authenticated users)
-    exhibitions = Event.objects.filter(
+    exhibition_events = Event.objects.filter(
         event_type='E'  # Changed from 'exhibition' to 'E'
-    ).order_by('-start_dt')  # Order by latest first
+    ).select_related('exhibition').order_by('-start_dt')  # Order by latest first
 
     # Get seminars (available only to authors)
     seminars = Event.objects.filter(
@@ -812,7 +706,7 @@ def event_list(request):
     ).order_by('-start_dt')  # Order by latest first
     
     context = {
-        'exhibitions': exhibitions,
+        'exhibitions': exhibition_events,
         'seminars': seminars,
         'now': now,  # Pass current time to template
     }
@@ -826,8 +720,9 @@ def event_detail(request, event_id):
     is_registered = False
     if request.user.is_authenticated and hasattr(request.user, 'customer_profile'):
         if event.event_type == 'E':
-            is_registered = event.exhibition.attendees.filter(
-                cust_id=request.user.customer_profile.cust_id
+            is_registered = ExhibitionAttendance.objects.filter(
+                exhibition_id=event.event_id,
+                customer_id=request.user.customer_profile.cust_id
             ).exists()
     
     context = {
@@ -839,7 +734,7 @@ def event_detail(request, event_id):
     return render(request, 'library/event_detail.html', context)
 
 @employee_required
-@transaction.atomic
+@transactional
 def event_create(request):
     """Create a new event (employee only)"""
     if request.method == 'POST':
@@ -852,15 +747,8 @@ def event_create(request):
             detail_form = SeminarForm(request.POST)
         
         if event_form.is_valid() and detail_form.is_valid():
-            # Get the next available event ID
-            try:
-                max_id = Event.objects.order_by('-event_id').first().event_id
-            except AttributeError:
-                max_id = 0
-            
             # Create event
             event = event_form.save(commit=False)
-            event.event_id = max_id + 1
             event.event_type = event_type
             event.save()
             
@@ -885,7 +773,7 @@ def event_create(request):
     return render(request, 'library/event_form.html', context)
 
 @employee_required
-@transaction.atomic
+@transactional
 def event_update(request, event_id):
     """Update an existing event (employee only)"""
     event = get_object_or_404(Event, event_id=event_id)
@@ -926,78 +814,47 @@ def event_update(request, event_id):
     return render(request, 'library/event_form.html', context)
 
 @login_required
-@transaction.atomic
+@transactional(read_only_methods=())
 def register_exhibition(request, event_id):
     """Register for an exhibition (customer only)"""
     event = get_object_or_404(Event, event_id=event_id)
     
-    if event.event_type != 'E':
-        messages.error(request, "This event is not an exhibition.")
-        return redirect('library:event_detail', event_id=event_id)
-    
-    if event.end_dt < timezone.now():
-        messages.error(request, "This exhibition has already ended.")
-        return redirect('library:event_detail', event_id=event_id)
-    
     try:
         customer = request.user.customer_profile
     except (AttributeError, Customer.DoesNotExist):
         messages.error(request, "You need a customer profile to register for exhibitions.")
         return redirect('library:event_detail', event_id=event_id)
     
-    exhibition = Exhibition.objects.get(event_id=event.event_id)
-    
-    # Check if already registered
-    if exhibition.attendees.filter(cust_id=customer.cust_id).exists():
-        messages.info(request, "You are already registered for this exhibition.")
-        return redirect('library:event_detail', event_id=event_id)
-    
-    # Check if exhibition is full
-    current_attendees = exhibition.attendees.count()
-    if current_attendees >= event.attd_no:
-        messages.error(request, "Sorry, this exhibition is full.")
-        return redirect('library:event_detail', event_id=event_id)
-    
-    # Create registration
-    ExhibitionAttendance.objects.create(
-        exhibition=exhibition,
-        customer=customer
-    )
-    
-    messages.success(request, "Successfully registered for the exhibition!")
+    # One conditional UPDATE claims a place, so a crowd can't overfill it
+    try:
+        exhibitions.register(event, customer)
+    except exhibitions.AlreadyRegistered as e:
+        messages.info(request, str(e))
+    except exhibitions.RegistrationError as e:
+        messages.error(request, str(e))
+    else:
+        messages.success(request, "Successfully registered for the exhibition!")
     return redirect('library:event_detail', event_id=event_id)
 
 @login_required
-@transaction.atomic
+@transactional(read_only_methods=())
 def unregister_exhibition(request, event_id):
     """Unregister from an exhibition (customer only)"""
     event = get_object_or_404(Event, event_id=event_id)
     
-    if event.event_type != 'E':
-        messages.error(request, "This event is not an exhibition.")
-        return redirect('library:event_detail', event_id=event_id)
-    
     # Check if user has a customer profile
     if not hasattr(request.user, 'customer_profile'):
         messages.error(request, "You need a customer profile to unregister from exhibitions.")
         return redirect('library:event_detail', event_id=event_id)
     
-    customer = request.user.customer_profile
-    exhibition = Exhibition.objects.get(event_id=event.event_id)
-    
-    # Check if registered
-    attendance = ExhibitionAttendance.objects.filter(
-        exhibition=exhibition,
-        customer=customer
-    ).first()
-    
-    if not attendance:
-        messages.info(request, "You are not registered for this exhibition.")
-        return redirect('library:event_detail', event_id=event_id)
-    
-    # Delete registration
-    attendance.delete()
-    messages.success(request, "Successfully unregistered from the exhibition.")
+    try:
+        exhibitions.unregister(event, request.user.customer_profile)
+    except exhibitions.NotRegistered as e:
+        messages.info(request, str(e))
+    except exhibitions.RegistrationError as e:
+        messages.error(request, str(e))
+    else:
+        messages.success(request, "Successfully unregistered from the exhibition.")
     return redirect('library:event_detail', event_id=event_id)
 
 # Study Room Views
@@ -1005,18 +862,19 @@ def unregister_exhibition(request, event_id):
 def study_room_list(request):
     """Display list of study rooms with availability"""
     # Get all study rooms
-    rooms = StudyRoom.objects.all()
+    rooms = list(StudyRoom.objects.all())
     
     # Get current time for availability check
     now = timezone.now()
     
-    # Check availability for each room
+    # Rooms reserved right now, in one query; the page then follows
+    # changes through availability_stream
+    occupied = set(
+        Reservation.objects.filter(start_dt__lte=now, end_dt__gt=now)
+        .values_list('study_room_id', flat=True)
+    )
     for room in rooms:
-        room.is_available = not Reservation.objects.filter(
-            study_room=room,
-            start_dt__lte=now,
-            end_dt__gt=now
-        ).exists()
+        room.is_available = room.room_id not in occupied
     
     context = {
         'rooms': rooms,
@@ -1024,7 +882,35 @@ def study_room_list(request):
     return render(request, 'library/study_room_list.html', context)
 
 @login_required
-@transaction.atomic
+def availability_stream(request):
+    """Server-Sent Events stream of book and study room availability.
+
+    ``?books=1,2`` follows those books and ``?rooms=3,4`` those rooms;
+    without ``rooms`` every room is followed. The stream starts with the
+    current state and then sends changes as they happen.
+    """
+    try:
+        books = _id_list(request.GET.get('books', ''))
+        rooms = _id_list(request.GET['rooms']) if 'rooms' in request.GET else None
+    except ValueError:
+        return JsonResponse({'error': 'books and rooms must be comma-separated ids.'}, status=400)
+    
+    # Under ASGI a sync iterator would be read to the end before sending
+    if isinstance(request, ASGIRequest):
+        events = availability.async_stream(books, rooms)
+    else:
+        events = availability.stream(books, rooms)
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def _id_list(value):
+    return {int(part) for part in value.split(',') if part.strip()}
+
+@login_required
+@idempotent
+@transactional
 def reserve_room(request, room_id):
     """Reserve a study room (customer only)"""
     room = get_object_or_404(StudyRoom, room_id=room_id)
@@ -1044,37 +930,18 @@ def reserve_room(request, room_id):
             start_dt = form.cleaned_data['start_dt']
             end_dt = form.cleaned_data['end_dt']
             
-            # Check for conflicts
-            conflicts = Reservation.objects.filter(
-                study_room=room,
-                start_dt__lt=end_dt,
-                end_dt__gt=start_dt
-            )
+            reservation = form.save(commit=False)
+            reservation.customer = customer
+            reservation.study_room = room
             
-            if conflicts.exists():
+            # Book under the room's lock so concurrent requests can't both take the slot
+            try:
+                book_room(reservation)
+            except BookingError as e:
                 if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                    return JsonResponse({
-                        'success': False, 
-                        'errors': "The room is already reserved during this time. Please choose another time."
-                    })
-                messages.error(
-                    request, 
-                    "The room is already reserved during this time. Please choose another time."
-                )
+                    return JsonResponse({'success': False, 'errors': str(e)})
+                messages.error(request, str(e))
             else:
-                # Get the next available reservation ID
-                try:
-                    max_id = Reservation.objects.order_by('-reserve_id').first().reserve_id
-                except AttributeError:
-                    max_id = 0
-                
-                # Create reservation
-                reservation = form.save(commit=False)
-                reservation.reserve_id = max_id + 1
-                reservation.customer = customer
-                reservation.study_room = room
-                reservation.save()
-                
                 if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                     return JsonResponse({
                         'success': True,
@@ -1270,9 +1137,8 @@ def invoice_list(request):
             return redirect('library:home')
     
     # Pagination
-    paginator = Paginator(invoices.order_by('-invoice_date'), 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = KeysetPaginator(invoices, 10, ordering=('-invoice_date', '-invoice_id'))
+    page_obj = paginator.get_page(request.GET.get('cursor'))
     
     context = {
         'page_obj': page_obj,
@@ -1322,7 +1188,9 @@ def invoice_detail(request, invoice_id):
     return render(request, 'library/invoice_detail.html', context)
 
 @login_required
-@transaction.atomic
+@use_primary
+@idempotent
+@transactional
 def process_payment(request, invoice_id):
     """Process payment for an invoice and handle rental return"""
     invoice = get_object_or_404(Invoice, invoice_id=invoice_id)
@@ -1337,13 +1205,7 @@ def process_payment(request, invoice_id):
     if request.method == 'POST':
         try:
             # Create payment for the full amount
-            try:
-                max_id = Payment.objects.order_by('-payment_id').first().payment_id
-            except AttributeError:
-                max_id = 0
-            
             Payment.objects.create(
-                payment_id=max_id + 1,
                 payment_date=timezone.now(),
                 pay_method='Cash',  # Default payment method
                 payment_amt=invoice.invoice_amt,
@@ -1351,19 +1213,19 @@ def process_payment(request, invoice_id):
             )
             
             # Update rental status
-            rental.status = 'Returned'
-            rental.actual_return_dt = timezone.now()
-            rental.save()
+            rental.transition(status='Returned', actual_return_dt=timezone.now())
             
             # Update book copy status
             book_copy = rental.book_copy
-            book_copy.status = 'available'
-            book_copy.save()
+            set_copy_status(book_copy, 'available')
             
             messages.success(request, "Payment processed successfully and book has been returned.")
             return redirect('library:rental_list')
             
         except Exception as e:
+            if is_retriable(e):
+                # Let @transactional roll back and run the view again
+                raise
             messages.error(request, f"Error processing payment: {str(e)}")
             return redirect('library:invoice_detail', invoice_id=invoice_id)
     
@@ -1373,7 +1235,7 @@ def process_payment(request, invoice_id):
     })
 
 @login_required
-@transaction.atomic
+@transactional
 def cancel_reservation(request, reserve_id):
     """Cancel a reservation (owner or employee only)"""
     reservation = get_object_or_404(Reservation, reserve_id=reserve_id)
@@ -1404,32 +1266,113 @@ def cancel_reservation(request, reserve_id):
     
     return render(request, 'library/cancel_reservation.html', {'reservation': reservation})
 
-class BookViewSet(viewsets.ModelViewSet):
-    queryset = Book.objects.all()
+class BookViewSet(IdempotentViewSetMixin, TransactionalViewSetMixin, viewsets.ModelViewSet):
+    queryset = Book.objects.select_related('topic').prefetch_related('authors')
     serializer_class = BookSerializer
     permission_classes = [IsCustomerOrReadOnly]
+    pagination_class = KeysetPagination
+
+    def get_keyset_ordering(self):
+        if self.request.query_params.get('search', ''):
+            return ('-search_rank', 'book_id')
+        return ('book_id',)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        search_query = self.request.query_params.get('search', '')
+        if search_query:
+            queryset = search_books(search_query, queryset)
+        return queryset
 
     @action(detail=True, methods=['get'])
     def available_copies(self, request, pk=None):
         book = self.get_object()
-        copies = book.bookcopy_set.filter(status='available')
+        copies = list(book.bookcopy_set.filter(status='available'))
+        # Every copy nests the same book; reuse the one already loaded
+        for copy in copies:
+            copy.book = book
         serializer = BookCopySerializer(copies, many=True)
         return Response(serializer.data)
 
-class RentalViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['post'], url_path='add-copies', permission_classes=[IsEmployee])
+    def add_copies(self, request, pk=None):
+        book = self.get_object()
+        try:
+            count = int(request.data.get('count', 1))
+        except (TypeError, ValueError):
+            return Response({'error': 'count must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            add_copies(book, count)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        book.refresh_from_db(fields=['available_copies', 'total_copies'])
+        return Response({
+            'book_id': book.book_id,
+            'added': count,
+            'available_copies': book.available_copies,
+            'total_copies': book.total_copies,
+        }, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get'])
+    def recommendations(self, request, pk=None):
+        book = self.get_object()
+        books = [
+            recommendation.recommended
+            for recommendation in recommendations_for(book.book_id).select_related(
+                'recommended__topic'
+            ).prefetch_related('recommended__authors')
+        ]
+        serializer = self.get_serializer(books, many=True)
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def popular(self, request):
+        window = request.query_params.get('window', leaderboard.DEFAULT_WINDOW)
+        try:
+            limit = int(request.query_params.get('limit', 10))
+            rows = leaderboard.ranking(window)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= limit <= 50:
+            return Response({'error': 'limit must be between 1 and 50.'}, status=status.HTTP_400_BAD_REQUEST)
+        rows = rows.select_related('book__topic').prefetch_related('book__authors')[:limit]
+        return Response({
+            'window': window,
+            'results': [
+                {'checkouts': row.checkouts, 'book': self.get_serializer(row.book).data}
+                for row in rows
+            ],
+        })
+
+class RentalViewSet(IdempotentViewSetMixin, TransactionalViewSetMixin, viewsets.ModelViewSet):
     serializer_class = RentalSerializer
     permission_classes = [IsCustomerOrEmployee]
 
     def get_queryset(self):
         user = self.request.user
+        rentals = Rental.objects.select_related(
+            'customer', 'book_copy__book__topic'
+        ).prefetch_related('book_copy__book__authors')
         if user.groups.filter(name='Employees').exists():
-            return Rental.objects.all()
-        return Rental.objects.filter(customer__user=user)
+            return rentals
+        return rentals.filter(customer__user=user)
 
     def perform_create(self, serializer):
-        serializer.save(customer=self.request.user.customer_profile)
+        book_id = serializer.validated_data.pop('book_id')
+        try:
+            book_copy = checkout_copy(book_id)
+        except CopyUnavailable as e:
+            raise ValidationError({'book_id': str(e)})
+        now = timezone.now()
+        serializer.save(
+            customer=self.request.user.customer_profile,
+            book_copy=book_copy,
+            status='Borrowed',
+            borrow_date=now,
+            exp_return_dt=serializer.validated_data.get('exp_return_dt') or now + timezone.timedelta(days=14),
+        )
 
-class EventViewSet(viewsets.ModelViewSet):
+class EventViewSet(IdempotentViewSetMixin, TransactionalViewSetMixin, viewsets.ModelViewSet):
     queryset = Event.objects.all()
     serializer_class = EventSerializer
     permission_classes = [IsCustomerOrReadOnly]
@@ -1445,7 +1388,29 @@ class EventViewSet(viewsets.ModelViewSet):
             serializer = AuthorSerializer(attendees, many=True)
         return Response(serializer.data)
 
-class StudyRoomViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['post', 'delete'], permission_classes=[IsAuthenticated])
+    def register(self, request, pk=None):
+        """Register (POST) or cancel (DELETE) the caller's place at an exhibition"""
+        event = self.get_object()
+        customer = getattr(request.user, 'customer_profile', None)
+        if customer is None:
+            return Response({'error': 'A customer profile is required.'}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            if request.method == 'POST':
+                exhibitions.register(event, customer)
+            else:
+                exhibitions.unregister(event, customer)
+        except exhibitions.ExhibitionFull as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+        except exhibitions.RegistrationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        registered_count = Exhibition.objects.values_list('registered_count', flat=True).get(pk=event.event_id)
+        return Response(
+            {'registered_count': registered_count, 'attd_no': event.attd_no},
+            status=status.HTTP_201_CREATED if request.method == 'POST' else status.HTTP_200_OK,
+        )
+
+class StudyRoomViewSet(IdempotentViewSetMixin, TransactionalViewSetMixin, viewsets.ModelViewSet):
     queryset = StudyRoom.objects.all()
     serializer_class = StudyRoomSerializer
     permission_classes = [IsCustomerOrReadOnly]
@@ -1461,54 +1426,118 @@ class StudyRoomViewSet(viewsets.ModelViewSet):
         is_available = not reservations.exists()
         return Response({'is_available': is_available})
 
-class ReservationViewSet(viewsets.ModelViewSet):
+class ReservationViewSet(IdempotentViewSetMixin, TransactionalViewSetMixin, viewsets.ModelViewSet):
     serializer_class = ReservationSerializer
     permission_classes = [IsCustomerOrEmployee]
 
     def get_queryset(self):
         user = self.request.user
+        reservations = Reservation.objects.select_related('customer', 'study_room')
         if user.groups.filter(name='Employees').exists():
-            return Reservation.objects.all()
-        return Reservation.objects.filter(customer__user=user)
+            return reservations
+        return reservations.filter(customer__user=user)
 
     def perform_create(self, serializer):
-        serializer.save(customer=self.request.user.customer_profile)
+        data = dict(serializer.validated_data)
+        room_id = data.pop('room_id')
+        self.book(serializer, Reservation(
+            customer=self.request.user.customer_profile, study_room_id=room_id, **data
+        ))
+
+    def perform_update(self, serializer):
+        reservation = serializer.instance
+        for field, value in serializer.validated_data.items():
+            setattr(reservation, field if field != 'room_id' else 'study_room_id', value)
+        self.book(serializer, reservation)
+
+    def book(self, serializer, reservation):
+        try:
+            serializer.instance = book_room(reservation)
+        except BookingError as e:
+            raise ValidationError({'non_field_errors': [str(e)]})
 
-class CustomerViewSet(viewsets.ModelViewSet):
+class CustomerViewSet(IdempotentViewSetMixin, TransactionalViewSetMixin, viewsets.ModelViewSet):
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
     permission_classes = [IsEmployee]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('cust_id',)
 
     @action(detail=True, methods=['get'])
     def rentals(self, request, pk=None):
         customer = self.get_object()
-        rentals = customer.rental_set.all()
+        rentals = customer.rental_set.select_related(
+            'customer', 'book_copy__book__topic'
+        ).prefetch_related('book_copy__book__authors')
         serializer = RentalSerializer(rentals, many=True)
         return Response(serializer.data)
 
-class InvoiceViewSet(viewsets.ModelViewSet):
+class InvoiceViewSet(IdempotentViewSetMixin, TransactionalViewSetMixin, viewsets.ModelViewSet):
     serializer_class = InvoiceSerializer
     permission_classes = [IsCustomerOrEmployee]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-invoice_date', '-invoice_id')
 
     def get_queryset(self):
         user = self.request.user
+        # is_paid sums payment_set, so load payments for the whole page at once
+        invoices = Invoice.objects.prefetch_related('payment_set')
         if user.groups.filter(name='Employees').exists():
-            return Invoice.objects.all()
-        return Invoice.objects.filter(rental__customer__user=user)
+            return invoices
+        return invoices.filter(rental__customer__user=user)
 
-class PaymentViewSet(viewsets.ModelViewSet):
+class PaymentViewSet(IdempotentViewSetMixin, TransactionalViewSetMixin, viewsets.ModelViewSet):
     serializer_class = PaymentSerializer
     permission_classes = [IsEmployee]
 
     def get_queryset(self):
-        return Payment.objects.all()
+        return Payment.objects.select_related('invoice').prefetch_related('invoice__payment_set')
+
+class DashboardViewSet(viewsets.ViewSet):
+    """Dashboard widgets as JSON, all of them or one by name, with conditional GET.
+
+    The ETag and Last-Modified come from the widgets' versions, which cost
+    no query, so an unchanged dashboard is answered with 304 before any
+    widget is computed.
+    """
+    permission_classes = [IsEmployee]
+    lookup_value_regex = '[a-z_]+'
+
+    def list(self, request):
+        return self.widgets_response(request, list(dashboard.WIDGETS))
+
+    def retrieve(self, request, pk=None):
+        if pk not in dashboard.WIDGETS:
+            raise NotFound(f'No dashboard widget named "{pk}".')
+        return self.widgets_response(request, [pk])
+
+    def widgets_response(self, request, names):
+        today = timezone.localdate()
+        versions, last_modified = dashboard.versions(names, today)
+        etag = dashboard.etag(versions)
+        # HTTP dates have one-second resolution; ETag takes precedence when sent
+        modified = int(last_modified.timestamp())
+        response = get_conditional_response(request, etag=etag, last_modified=modified)
+        if response is None:
+            payloads = dashboard.widgets(names, today)
+            response = Response({
+                'api_version': dashboard.API_VERSION,
+                'widgets': {name: {'version': versions[name], 'data': payloads[name]} for name in names},
+            })
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(modified)
+        # Clients may keep the body but must revalidate before using it
+        response['Cache-Control'] = 'private, no-cache'
+        return response
 
 @login_required
 def profile(request):
     return render(request, 'library/profile.html')
 
 @customer_required
-@transaction.atomic
+@use_primary
+@idempotent
+@transactional
 def borrow_book(request, book_id):
     book = get_object_or_404(Book, book_id=book_id)
     customer = request.user.customer_profile
@@ -1524,50 +1553,46 @@ def borrow_book(request, book_id):
         messages.error(request, f'You already have an active rental for "{book.book_name}". Please return it before borrowing another copy.')
         return redirect('library:book_detail', book_id=book_id)
     
-    # Get available copies
-    available_copies = book.bookcopy_set.filter(status='available')
-    
-    if not available_copies.exists():
+    if book.available_copies == 0:
         messages.error(request, 'Sorry, no copies of this book are currently available.')
         return redirect('library:book_detail', book_id=book_id)
     
     if request.method == 'POST':
         try:
-            # Get the first available copy
-            book_copy = available_copies.first()
+            # Claim an available copy without queueing behind other borrowers
+            book_copy = checkout_copy(book.book_id)
             
-            # Create rental
+            # Create invoice
+            invoice = Invoice.objects.create(
+                invoice_date=timezone.now(),
+                invoice_amt=0.00  # Will be updated when book is returned
+            )
+            
+            # Create rental, linked to its invoice in the same INSERT
             rental = Rental.objects.create(
                 customer=customer,
                 book_copy=book_copy,
+                invoice=invoice,
                 borrow_date=timezone.now(),
                 exp_return_dt=timezone.now() + timezone.timedelta(days=14),
                 status='Borrowed'
             )
             
-            # Create invoice
-            invoice = Invoice.objects.create(
-                invoice_date=timezone.now(),
-                invoice_amt=0.00  # Will be updated when book is returned
-            )
-            
-            # Link invoice to rental
-            rental.invoice = invoice
-            rental.save()
-            
-            # Update book copy status
-            book_copy.status = 'not available'
-            book_copy.save()
-            
             messages.success(request, f'Successfully borrowed "{book.book_name}". Please return it by {rental.exp_return_dt.strftime("%B %d, %Y")}.')
             return redirect('library:rental_list')
             
+        except CopyUnavailable as e:
+            messages.error(request, str(e))
+            return redirect('library:book_detail', book_id=book_id)
         except Exception as e:
+            if is_retriable(e):
+                # Let @transactional roll back and run the view again
+                raise
             messages.error(request, f'Error borrowing book: {str(e)}')
             return redirect('library:book_detail', book_id=book_id)
     
     # For GET requests, show the borrow confirmation page
     return render(request, 'library/borrow_book.html', {
         'book': book,
-        'available_copies': available_copies.count()
+        'available_copies': book.available_copies
     })
@@ -1,6 +1,6 @@
 import os
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -36,7 +36,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'library.middleware.DeadlockRetryMiddleware',  # Custom middleware for deadlock handling
+    'library.db_router.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'library_project.urls'
@@ -55,6 +55,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'library.idempotency.form_token',
             ],
         },
     },
@@ -79,6 +80,32 @@ DATABASES = {
     }
 }
 
+# Read replicas: one alias per host in DB_REPLICA_HOSTS (comma-separated),
+# sharing the primary's credentials. See library/db_router.py.
+DATABASE_ROUTERS = ['library.db_router.ReplicaRouter']
+LIBRARY_READ_REPLICAS = []
+for number, host in enumerate(config('DB_REPLICA_HOSTS', default='', cast=Csv()), start=1):
+    alias = f'replica{number}'
+    DATABASES[alias] = {**DATABASES['default'], 'HOST': host, 'TEST': {'MIRROR': 'default'}}
+    LIBRARY_READ_REPLICAS.append(alias)
+LIBRARY_REPLICA_STICKY_SECONDS = config('DB_REPLICA_STICKY_SECONDS', default=5, cast=int)
+
+# Cache. The book detail cache, the KPIs and the dashboard API are
+# invalidated by version keys that writers bump in the cache (see
+# library/book_cache.py, library/kpis.py and library/dashboard.py). Every
+# worker process has to see those bumps, so a deployment with more than one
+# process needs a shared backend, e.g.
+#   CACHE_BACKEND=django.core.cache.backends.redis.RedisCache  (needs the redis package)
+#   CACHE_LOCATION=redis://127.0.0.1:6379/1
+# The default per-process memory cache is only right for a single process,
+# such as runserver.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    }
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {